@@ -1,25 +1,57 @@
-from flask import Flask, render_template, request, send_file, redirect, url_for, session, flash, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, send_file, redirect, url_for, session, flash, jsonify, send_from_directory
 from datetime import datetime
 import pandas as pd
 import os
-from threading import Lock
 from xhtml2pdf import pisa
-from num2words import num2words
 import json
 from pypdf import PdfReader, PdfWriter  # Updated import for pypdf 5.0.0+
 import io
+import csv
+import itertools
+import zlib
+import time
+from threading import Thread
+from bill_store import (
+    SALE_FILE, PURCHASE_FILE, TRANSPORT_FILE, excel_lock, select_bills, iter_bills, view_filters, parse_range,
+    append_bills, clear_bills, delete_bills, deleted_bills, restore_bills, StoreCorruptError
+)
+import assets
+import audit_log
+import backup
+import bill_store
+import dashboard
+import http_cache
+import idempotency
+import timing
+from timing import span
+import profiling
+from bill_calc import (
+    BillInputError, compute_sale_bill, compute_purchase_bill, compute_transport_bill,
+    infer_sale_inputs, infer_purchase_inputs, infer_transport_inputs
+)
+from xlsx_stream import stream_xlsx
+import export_jobs
+from export_jobs import EXPORT_COLUMN_TYPES
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', os.urandom(24))
-excel_lock = Lock()
+timing.init_app(app)
+timing.add_collector(dashboard.metrics_lines)
+profiling.init_app(app)
+# Fingerprinted JS/CSS bundles under /assets/, plus /service-worker.js and /manifest.json
+assets.init_app(app)
+# gzip/brotli for HTML and JSON responses; the store-backed pages also answer 304 (http_cache.validated)
+app.wsgi_app = http_cache.CompressionMiddleware(app.wsgi_app)
+# Preload bill tables, templates and the PDF engine in a background thread at startup
+app.config["WARMUP_ON_START"] = os.environ.get("BILLING_WARMUP", "1") != "0"
+
+# Identifies this app on /healthz so the launcher can tell it apart from other local servers
+APP_ID = "sri-anjaneya-traders"
 
 # Path for Word file
 DOCS_DIR = os.path.join(app.root_path, "static", "docs")
 DOCX_FILENAME = "new_10_bill.docx"
 
-# Files for bills
-SALE_FILE = "sale_bills.xlsx"
-PURCHASE_FILE = "purchase_bills.xlsx"
 USERS_FILE = "users.json"
 
 def generate_bill_no(file_path, date):
@@ -29,16 +61,18 @@ def generate_bill_no(file_path, date):
         prefix = "SB"
     elif file_path == PURCHASE_FILE:
         prefix = "PB"
-    else:  # bills.xlsx for transportation
+    else:  # TRANSPORT_FILE
         prefix = "TB"
     bill_no = f"{prefix}-{date_str}-001"
     try:
-        with excel_lock:
+        with span("bill_no"), excel_lock:
             if os.path.exists(file_path):
-                df_existing = pd.read_excel(file_path, engine='openpyxl')
-                date_bills = df_existing[df_existing['date'] == date.strftime('%d-%m-%Y')]
-                if not date_bills.empty:
-                    bill_numbers = date_bills['bill_no'].str.extract(r'(?:SB|PB|TB)-\d{8}-(\d{3})').astype(float)
+                date_bills = select_bills(file_path, {"date": date.strftime('%d-%m-%Y')}, include_deleted=True)
+                issued = date_bills['bill_no'].astype(str).tolist() if not date_bills.empty else []
+                # Deleted bills that compaction has removed for good still hold on to their numbers
+                issued += [b for b in bill_store.purged_bills(file_path) if b.startswith(f"{prefix}-{date_str}-")]
+                if issued:
+                    bill_numbers = pd.Series(issued).str.extract(r'(?:SB|PB|TB)-\d{8}-(\d{3})').astype(float)
                     if not bill_numbers.empty:
                         max_seq = int(bill_numbers[0].max())
                         bill_no = f"{prefix}-{date_str}-{str(max_seq + 1).zfill(3)}"
@@ -46,6 +80,12 @@ def generate_bill_no(file_path, date):
         print(f"Error reading Excel for bill number: {e}")
     return bill_no
 
+def render_bill_pdf(template, bill_data, dest):
+    """Render a bill template and write it as PDF into the binary file object `dest`."""
+    html = render_template(template, **bill_data)
+    with span("pdf"):
+        pisa.CreatePDF(html, dest=dest)
+
 def load_users():
     if not os.path.exists(USERS_FILE):
         return {}
@@ -53,8 +93,9 @@ def load_users():
         return json.load(f)
 
 def save_users(users):
-    with open(USERS_FILE, "w") as f:
+    with open(USERS_FILE + ".tmp", "w") as f:
         json.dump(users, f)
+    bill_store.durable_replace(USERS_FILE + ".tmp", USERS_FILE)
 
 @app.route("/", methods=["GET", "POST"])
 def login():
@@ -100,114 +141,9 @@ def sale_bill():
         return redirect("/")
 
     if request.method == "POST":
-        try:
-            data = request.form
-            # Validate required fields
-            required_fields = ["mill_name", "farmer_name", "rice_type", "bags", "ntwt", "price", "calc_type", "lorry_no", "mobile_no"]
-            for field in required_fields:
-                if not data.get(field):
-                    flash(f"⚠️ Missing required field: {field.replace('_', ' ').title()}", "error")
-                    return redirect("/sale-bill")
-
-            # Handle date
-            if data.get("date_mode") == "manual" and data.get("manual_date"):
-                try:
-                    selected_date = datetime.strptime(data["manual_date"], "%Y-%m-%d")
-                except ValueError:
-                    flash("⚠️ Invalid date format. Please use YYYY-MM-DD.", "error")
-                    return redirect("/sale-bill")
-            else:
-                selected_date = datetime.now()
-
-            bill_no = generate_bill_no(SALE_FILE, selected_date)
-            date = selected_date.strftime("%d-%m-%Y")
-
-            mill_name = data["mill_name"].upper()
-            mill_code = data.get("mill_code", "").upper()
-            farmer_name = data["farmer_name"].upper()
-            rice_type = data["rice_type"].upper()
-            bags = int(data["bags"])
-            ntwt = float(data["ntwt"])
-            price = float(data["price"])
-            calc_type = data["calc_type"]
-
-            stwt = 0
-            sut_rate = 0
-            if calc_type == "1":
-                net_bags = ntwt / 77
-            elif calc_type == "2":
-                sut_rate = float(data.get("sut_rate", 0))
-                if sut_rate == 0:
-                    flash("⚠️ Sut Rate is required for Option 2.", "error")
-                    return redirect("/sale-bill")
-                stwt = bags * sut_rate
-                net_bags = (ntwt - stwt) / 75
-            elif calc_type == "3":
-                net_bags = (ntwt - (ntwt / 1000) * 5) / 100
-            else:
-                flash("⚠️ Invalid calculation type.", "error")
-                return redirect("/sale-bill")
-
-            amount = net_bags * price
-            commission = amount / 100 if data.get("commission") == "yes" else 0
-            hamali_rate = float(data.get("hamali_rate", 0)) if data.get("hamali") == "yes" else 0
-            hamali = bags * hamali_rate
-            gunny_rate = float(data.get("gunny_rate", 0)) if data.get("gunny_bags") == "yes" else 0
-            gunny = bags * gunny_rate
-            advance = float(data.get("advance", 0))
-            rmc = float(data.get("rmc", 0))
-            grand_total = amount + commission + hamali + gunny + advance + rmc
-            lorry_no = data["lorry_no"].upper()
-            mobile_no = data["mobile_no"]
-
-            bill_data = {
-                "bill_type": "Sale",
-                "bill_no": bill_no,
-                "date": date,
-                "mill_name": mill_name,
-                "mill_code": mill_code,
-                "farmer_name": farmer_name,
-                "rice_type": rice_type,
-                "bags": bags,
-                "ntwt": ntwt,
-                "stwt": round(stwt, 2),
-                "sut_rate": sut_rate,
-                "price": price,
-                "net_bags": round(net_bags, 2),
-                "amount": round(amount, 2),
-                "commission": round(commission, 2),
-                "hamali": round(hamali, 2),
-                "gunny": round(gunny, 2),
-                "advance": round(advance, 2),
-                "rmc": round(rmc, 2),
-                "grand_total": round(grand_total, 2),
-                "lorry_no": lorry_no,
-                "mobile_no": mobile_no
-            }
-
-            df = pd.DataFrame([bill_data])
-            with excel_lock:
-                if os.path.exists(SALE_FILE):
-                    df_existing = pd.read_excel(SALE_FILE, engine='openpyxl')
-                    df = pd.concat([df_existing, df], ignore_index=True)
-                df.to_excel(SALE_FILE, index=False, engine='openpyxl')
+        return submit_bill_form("sale")
 
-            bill_data_pdf = bill_data.copy()
-            bill_data_pdf.pop("farmer_name")
-
-            pdf_file = f"generated_pdfs/{bill_no}.pdf"
-            os.makedirs("generated_pdfs", exist_ok=True)
-            with open(pdf_file, "wb") as f:
-                html = render_template("bill_template.html", **bill_data_pdf)
-                pisa.CreatePDF(html, dest=f)
-
-            flash(f"✅ Sale Bill {bill_no} created!", "success")
-            return send_file(pdf_file, as_attachment=True)
-        except Exception as e:
-            flash(f"⚠️ Error: {str(e)}", "error")
-            return redirect("/sale-bill")
-
-    return render_template("sale_bill.html")
+    return render_template("sale_bill.html", idempotency_key=idempotency.new_key())
 
 @app.route("/purchase-bill", methods=["GET", "POST"])
 def purchase_bill():
@@ -216,87 +152,9 @@ def purchase_bill():
         return redirect("/")
 
     if request.method == "POST":
-        try:
-            data = request.form
-            required_fields = ["farmer_name", "village_name", "mill_name", "rice_type", "bags", "ntwt", "sut_rate", "rate", "hamali_rate", "weigh_bridge", "lorry_no"]
-            for field in required_fields:
-                if not data.get(field):
-                    flash(f"⚠️ Missing required field: {field.replace('_', ' ').title()}", "error")
-                    return redirect("/purchase-bill")
-
-            if data.get("date_mode") == "manual" and data.get("date"):
-                try:
-                    selected_date = datetime.strptime(data["date"], "%Y-%m-%d")
-                except ValueError:
-                    flash("⚠️ Invalid date format. Please use YYYY-MM-DD.", "error")
-                    return redirect("/purchase-bill")
-            else:
-                selected_date = datetime.now()
-
-            bill_no = generate_bill_no(PURCHASE_FILE, selected_date)
-            date = selected_date.strftime("%d-%m-%Y")
-
-            farmer_name = data["farmer_name"].upper()
-            village_name = data["village_name"].upper()
-            mill_name = data["mill_name"].upper()
-            rice_type = data["rice_type"].upper()
-            bags = int(data["bags"])
-            ntwt = float(data["ntwt"])
-            sut_rate = float(data["sut_rate"])
-            stwt = bags * sut_rate
-            total_ntwt = (ntwt - stwt) / 75
-            rate = float(data["rate"])
-            amount = total_ntwt * rate
-            hamali_rate = float(data["hamali_rate"])
-            hamali = hamali_rate * bags
-            weigh_bridge = float(data["weigh_bridge"])
-            grand_total = amount - hamali - weigh_bridge
-            lorry_no = data["lorry_no"].upper()
-
-            bill_data_excel = {
-                "bill_type": "Purchase",
-                "bill_no": bill_no,
-                "date": date,
-                "farmer_name": farmer_name,
-                "village_name": village_name,
-                "mill_name": mill_name,
-                "rice_type": rice_type,
-                "bags": bags,
-                "ntwt": ntwt,
-                "sut_rate": sut_rate,
-                "stwt": stwt,
-                "total_ntwt": round(total_ntwt, 2),
-                "rate": rate,
-                "amount": round(amount, 2),
-                "hamali": round(hamali, 2),
-                "weigh_bridge": round(weigh_bridge, 2),
-                "grand_total": round(grand_total, 2),
-                "lorry_no": lorry_no
-            }
-
-            bill_data_pdf = bill_data_excel.copy()
-            bill_data_pdf.pop("mill_name")
-
-            df = pd.DataFrame([bill_data_excel])
-            with excel_lock:
-                if os.path.exists(PURCHASE_FILE):
-                    df_existing = pd.read_excel(PURCHASE_FILE, engine='openpyxl')
-                    df = pd.concat([df_existing, df], ignore_index=True)
-                df.to_excel(PURCHASE_FILE, index=False, engine='openpyxl')
+        return submit_bill_form("purchase")
 
-            pdf_file = f"generated_pdfs/{bill_no}.pdf"
-            os.makedirs("generated_pdfs", exist_ok=True)
-            with open(pdf_file, "wb") as f:
-                html = render_template("purchase_bill_template.html", **bill_data_pdf)
-                pisa.CreatePDF(html, dest=f)
-
-            flash(f"✅ Purchase Bill {bill_no} created!", "success")
-            return send_file(pdf_file, as_attachment=True)
-        except Exception as e:
-            flash(f"⚠️ Error: {str(e)}", "error")
-            return redirect("/purchase-bill")
-
-    return render_template("purchase_bill.html")
+    return render_template("purchase_bill.html", idempotency_key=idempotency.new_key())
 
 @app.route("/transportation-bill", methods=["GET", "POST"])
 def transportation_bill():
@@ -305,81 +163,12 @@ def transportation_bill():
         return redirect("/")
 
     if request.method == "POST":
-        try:
-            data = request.form
-            # Handle date
-            if data.get("date_mode") == "manual" and data.get("date"):
-                try:
-                    selected_date = datetime.strptime(data["date"], "%Y-%m-%d")
-                except ValueError:
-                    flash("⚠️ Invalid date format. Please use YYYY-MM-DD.", "error")
-                    return redirect("/transportation-bill")
-            else:
-                selected_date = datetime.now()
-
-            required_fields = ["ms", "from_location", "to_location", "bags", "kgs", "rice_type", "lorry_no", "lorry_freight", "mobile_no"]
-            for field in required_fields:
-                if not data.get(field):
-                    flash(f"⚠️ Missing required field: {field.replace('_', ' ').title()}", "error")
-                    return redirect("/transportation-bill")
-
-            bill_no = generate_bill_no("bills.xlsx", selected_date)
-            date = selected_date.strftime("%d-%m-%Y")
-
-            bags = int(data["bags"])
-            kgs = float(data["kgs"])
-            lorry_freight = float(data["lorry_freight"])
-            zero_charge = float(data.get("zero_charge", 0.0))  # Ensure default value
-            advance = float(data.get("advance", 0.0))
-
-            whole_part = int(lorry_freight)
-            decimal_part = int((lorry_freight % 1) * 100)
-            rupees_in_words = num2words(whole_part, lang='en_IN').replace('-', ' ').title()
-            paise_in_words = num2words(decimal_part, lang='en_IN').replace('-', ' ').title() if decimal_part > 0 else "Zero"
-            freight_in_words = f"{rupees_in_words} Rupees and {paise_in_words} Paise Only"
-
-            bill_data = {
-                "bill_type": "Transportation",
-                "bill_no": bill_no,
-                "date": date,
-                "ref": bill_no,
-                "ms": data["ms"].upper(),
-                "from_location": data["from_location"].upper(),
-                "to_location": data["to_location"].upper(),
-                "bags": bags,
-                "kgs": kgs,
-                "rice_type": data["rice_type"].upper(),
-                "lorry_no": data["lorry_no"].upper(),
-                "lorry_freight": round(lorry_freight, 2),
-                "zero_charge": round(zero_charge, 2),
-                "advance": round(advance, 2),
-                "mobile_no": data["mobile_no"],
-                "freight_in_words": freight_in_words
-            }
-
-            df = pd.DataFrame([bill_data])
-            file_path = "bills.xlsx"
-            with excel_lock:
-                if os.path.exists(file_path):
-                    df_existing = pd.read_excel(file_path, engine='openpyxl')
-                    df = pd.concat([df_existing, df], ignore_index=True)
-                df.to_excel(file_path, index=False, engine='openpyxl')
+        return submit_bill_form("transport")
 
-            pdf_file = f"generated_pdfs/{bill_no}.pdf"
-            os.makedirs("generated_pdfs", exist_ok=True)
-            with open(pdf_file, "wb") as f:
-                html = render_template("transportation_bill_template.html", **bill_data)
-                pisa.CreatePDF(html, dest=f)
-
-            flash(f"✅ Transportation Bill {bill_no} created!", "success")
-            return send_file(pdf_file, as_attachment=True)
-        except Exception as e:
-            flash(f"⚠️ Error: {str(e)}", "error")
-            return redirect("/transportation-bill")
-
-    return render_template("transportation_bill.html")
+    return render_template("transportation_bill.html", idempotency_key=idempotency.new_key())
 
 @app.route("/view-bills", methods=["GET", "POST"])
+@http_cache.validated(lambda: [SALE_FILE])
 def view_bills():
     if "user" not in session:
         return redirect("/")
@@ -388,41 +177,33 @@ def view_bills():
     if request.method == "POST":
         selected_bills = request.form.getlist("delete_ids")
         if os.path.exists(file_path) and selected_bills:
-            df = pd.read_excel(file_path, engine='openpyxl')
-            df = df[~df['bill_no'].astype(str).isin(selected_bills)]
-            df.to_excel(file_path, index=False, engine='openpyxl')
-            flash(f"✅ {len(selected_bills)} Sale Bill(s) deleted.", "success")
+            deleted = delete_bills(file_path, selected_bills, session["user"])
+            flash(f"✅ {deleted} Sale Bill(s) deleted. They can be restored for "
+                  f"{bill_store.DELETE_RETENTION.days} days from Recently Deleted below.", "success")
             return redirect("/view-bills")
 
     bills = []
-    if os.path.exists(file_path):
+    try:
+        date_range = parse_range(request.args)
+    except ValueError as e:
+        flash(f"⚠️ {e}.", "warning")
+        date_range = None
+    if os.path.exists(file_path) and date_range is not None:
+        filters = view_filters(request.args)
         with excel_lock:
-            df = pd.read_excel(file_path, engine='openpyxl')
-            df = df.drop_duplicates(subset='bill_no', keep='last')
-            date = request.args.get("date")
-            bill_no = request.args.get("bill_no")
-            mill_name = request.args.get("mill_name")
-            farmer_name = request.args.get("farmer_name")
-            rice_type = request.args.get("rice_type")
-            if date:
-                df = df[df['date'] == date]
-            if bill_no:
-                df = df[df['bill_no'].astype(str) == bill_no]
-            if mill_name:
-                df = df[df['mill_name'] == mill_name]
-            if farmer_name:
-                df = df[df['farmer_name'] == farmer_name]
-            if rice_type:
-                df = df[df['rice_type'] == rice_type]
+            # Archived years are only opened when the dates asked for reach into them
+            df = select_bills(file_path, filters, date_range, archived=any(date_range) or "date" in filters)
             unique_bill_nos = df['bill_no'].dropna().astype(str).unique()
             unique_mill_names = df['mill_name'].dropna().unique()
             unique_farmer_names = df['farmer_name'].dropna().unique()
             unique_rice_types = df['rice_type'].dropna().unique()
-            bills = df.to_dict(orient='records')
+            bills = bill_store.mark_archived(file_path, df.to_dict(orient='records'))
 
     return render_template(
         "view_bills_sale.html",
         bills=bills,
+        deleted=deleted_bills(file_path),
+        archived_years=sorted(bill_store.archived_years(file_path)),
         unique_bill_nos=unique_bill_nos if 'unique_bill_nos' in locals() else [],
         unique_mill_names=unique_mill_names if 'unique_mill_names' in locals() else [],
         unique_farmer_names=unique_farmer_names if 'unique_farmer_names' in locals() else [],
@@ -430,6 +211,7 @@ def view_bills():
     )
 
 @app.route("/view-purchase-bills", methods=["GET", "POST"])
+@http_cache.validated(lambda: [PURCHASE_FILE])
 def view_purchase_bills():
     if "user" not in session:
         return redirect("/")
@@ -438,47 +220,375 @@ def view_purchase_bills():
     if request.method == "POST":
         selected_bills = request.form.getlist("delete_ids")
         if os.path.exists(file_path) and selected_bills:
-            df = pd.read_excel(file_path, engine='openpyxl')
-            df = df[~df['bill_no'].astype(str).isin(selected_bills)]
-            df.to_excel(file_path, index=False, engine='openpyxl')
-            flash(f"✅ {len(selected_bills)} Purchase Bill(s) deleted.", "success")
+            deleted = delete_bills(file_path, selected_bills, session["user"])
+            flash(f"✅ {deleted} Purchase Bill(s) deleted. They can be restored for "
+                  f"{bill_store.DELETE_RETENTION.days} days from Recently Deleted below.", "success")
             return redirect("/view-purchase-bills")
 
     bills = []
-    if os.path.exists(file_path):
+    try:
+        date_range = parse_range(request.args)
+    except ValueError as e:
+        flash(f"⚠️ {e}.", "warning")
+        date_range = None
+    if os.path.exists(file_path) and date_range is not None:
+        filters = view_filters(request.args)
         with excel_lock:
-            df = pd.read_excel(file_path, engine='openpyxl')
-            df = df.drop_duplicates(subset='bill_no', keep='last')
-            date = request.args.get("date")
-            bill_no = request.args.get("bill_no")
-            mill_name = request.args.get("mill_name")
-            farmer_name = request.args.get("farmer_name")
-            rice_type = request.args.get("rice_type")
-            if date:
-                df = df[df['date'] == date]
-            if bill_no:
-                df = df[df['bill_no'].astype(str) == bill_no]
-            if mill_name:
-                df = df[df['mill_name'] == mill_name]
-            if farmer_name:
-                df = df[df['farmer_name'] == farmer_name]
-            if rice_type:
-                df = df[df['rice_type'] == rice_type]
+            # Archived years are only opened when the dates asked for reach into them
+            df = select_bills(file_path, filters, date_range, archived=any(date_range) or "date" in filters)
             unique_bill_nos = df['bill_no'].dropna().astype(str).unique()
             unique_mill_names = df['mill_name'].dropna().unique()
             unique_farmer_names = df['farmer_name'].dropna().unique()
             unique_rice_types = df['rice_type'].dropna().unique()
-            bills = df.to_dict(orient='records')
+            bills = bill_store.mark_archived(file_path, df.to_dict(orient='records'))
 
     return render_template(
         "view_bills_purchase.html",
         bills=bills,
+        deleted=deleted_bills(file_path),
+        archived_years=sorted(bill_store.archived_years(file_path)),
         unique_bill_nos=unique_bill_nos if 'unique_bill_nos' in locals() else [],
         unique_mill_names=unique_mill_names if 'unique_mill_names' in locals() else [],
         unique_farmer_names=unique_farmer_names if 'unique_farmer_names' in locals() else [],
         unique_rice_types=unique_rice_types if 'unique_rice_types' in locals() else []
     )
 
+YES_NO = [("yes", "Yes"), ("no", "No")]
+
+# Everything the entry and edit pages need per bill type: store, calculation, PDF and form fields.
+# A field is (name, label, input type or list of radio choices). "entry_url" is the entry form,
+# and "date_field" is its manual date input.
+BILL_KINDS = {
+    "sale": {
+        "title": "Sale", "file": SALE_FILE, "prefix": "SB", "view_url": "/view-bills",
+        "entry_url": "/sale-bill", "date_field": "manual_date",
+        "compute": compute_sale_bill, "infer": infer_sale_inputs,
+        "template": "bill_template.html", "exclude": "farmer_name",
+        "fields": [
+            ("date", "Date", "date"), ("mill_name", "Mill Name", "text"), ("mill_code", "Mill Code", "text"),
+            ("farmer_name", "Farmer Name", "text"), ("rice_type", "Rice Type", "text"), ("bags", "Bags", "int"),
+            ("ntwt", "Net Weight", "number"), ("price", "Price", "number"),
+            ("calc_type", "Net Bag Type", [("1", "Option 1 → (No STWT)"), ("2", "Option 2 → (With STWT)"),
+                                           ("3", "Option 3 → (For 100 Kgs)")]),
+            ("sut_rate", "Sut Rate (per bag)", "number"), ("commission", "Commission", YES_NO),
+            ("hamali", "Hamali", YES_NO), ("hamali_rate", "Hamali Rate", "number"),
+            ("gunny_bags", "Gunny Bags", YES_NO), ("gunny_rate", "Gunny Rate", "number"),
+            ("advance", "Advance", "number"), ("rmc", "RMC Amount", "number"),
+            ("lorry_no", "Lorry No", "text"), ("mobile_no", "Mobile No", "text"),
+        ],
+    },
+    "purchase": {
+        "title": "Purchase", "file": PURCHASE_FILE, "prefix": "PB", "view_url": "/view-purchase-bills",
+        "entry_url": "/purchase-bill", "date_field": "date",
+        "compute": compute_purchase_bill, "infer": infer_purchase_inputs,
+        "template": "purchase_bill_template.html", "exclude": "mill_name",
+        "fields": [
+            ("date", "Date", "date"), ("farmer_name", "Farmer Name", "text"), ("village_name", "Village Name", "text"),
+            ("mill_name", "Mill Name", "text"), ("rice_type", "Rice Type", "text"), ("bags", "Bags", "int"),
+            ("ntwt", "Net Weight", "number"), ("sut_rate", "Sut Rate", "number"), ("rate", "Rate", "number"),
+            ("hamali_rate", "Hamali Rate", "number"), ("weigh_bridge", "Weigh Bridge", "number"),
+            ("lorry_no", "Lorry No", "text"),
+        ],
+    },
+    "transport": {
+        "title": "Transportation", "file": TRANSPORT_FILE, "prefix": "TB", "view_url": "/menu",
+        "entry_url": "/transportation-bill", "date_field": "date",
+        "compute": compute_transport_bill, "infer": infer_transport_inputs,
+        "template": "transportation_bill_template.html", "exclude": None,
+        "fields": [
+            ("date", "Date", "date"), ("ms", "M/S", "text"), ("from_location", "From", "text"),
+            ("to_location", "To", "text"), ("bags", "Bags", "int"), ("kgs", "Kgs", "number"),
+            ("rice_type", "Rice Type", "text"), ("lorry_no", "Lorry No", "text"),
+            ("lorry_freight", "Lorry Freight", "number"), ("zero_charge", "Zero Charge", "number"),
+            ("advance", "Advance", "number"), ("mobile_no", "Mobile No", "text"),
+        ],
+    },
+}
+
+def locate_bill(bill_no):
+    """(kind, current row) of a live bill, looking first in the store its prefix belongs to."""
+    kinds = sorted(BILL_KINDS, key=lambda k: not str(bill_no).startswith(BILL_KINDS[k]["prefix"] + "-"))
+    for kind in kinds:
+        bill = bill_store.find_bill(BILL_KINDS[kind]["file"], bill_no)
+        if bill is not None:
+            return kind, bill
+    return None, None
+
+def edit_form_values(kind, bill):
+    """Prefill values for the edit form from the stored row."""
+    values = {}
+    for name, _, input_type in BILL_KINDS[kind]["fields"]:
+        value = bill.get(name)
+        if value is None or (isinstance(value, float) and value != value):
+            value = 0 if input_type in ("int", "number") else ""  # empty cells in older rows
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        values[name] = value
+    try:
+        values["date"] = datetime.strptime(str(bill.get("date")), "%d-%m-%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        values["date"] = ""
+    values.update(BILL_KINDS[kind]["infer"](bill))
+    return values
+
+def bill_date(kind, data):
+    """The date picked on the entry form, or now when the form is left on automatic."""
+    field = BILL_KINDS[kind]["date_field"]
+    if data.get("date_mode") == "manual" and data.get(field):
+        try:
+            return datetime.strptime(data[field], "%Y-%m-%d")
+        except ValueError:
+            raise BillInputError("⚠️ Invalid date format. Please use YYYY-MM-DD.")
+    return datetime.now()
+
+def next_bill_no(bill_no):
+    """SB-20251026-004 -> SB-20251026-005"""
+    prefix, seq = bill_no.rsplit("-", 1)
+    return f"{prefix}-{str(int(seq) + 1).zfill(3)}"
+
+def create_bills(kind, submissions, user):
+    """Create bills of one kind from entry-form submissions with one store write, and render their PDFs.
+
+    `submissions` is a list of {"fields": form fields, "key": optional idempotency key}. Returns one
+    result per submission, in order: {"status": "created", "bill_no", "pdf"} for a new bill,
+    {"status": "duplicate", "bill_no"} when the key already created a bill from the same fields,
+    or {"status": "conflict" | "error", "error"} with the message for the clerk.
+    """
+    spec = BILL_KINDS[kind]
+    results, rows, keys = [], [], {}
+    with excel_lock:
+        # Allocate the numbers and append under one lock so concurrent clerks never share a bill number
+        last_no = {}  # date -> last number handed out in this batch
+        for submission in submissions:
+            fields, key = submission["fields"], submission.get("key")
+            if key:
+                # The offline queue pins the date of a bill left on automatic, so a replay of a post
+                # that did arrive differs only there; the date is left out of the comparison
+                fingerprint = idempotency.fingerprint(
+                    kind, {k: fields[k] for k in fields if k not in ("date_mode", spec["date_field"])})
+                seen = keys.get(key) or idempotency.lookup(key)
+                if seen and seen["fingerprint"] == fingerprint:
+                    results.append({"status": "duplicate", "bill_no": seen["bill_no"]})
+                    continue
+                if seen:
+                    results.append({"status": "conflict",
+                                    "error": f"⚠️ This submission was already used for bill {seen['bill_no']} "
+                                             f"with different details."})
+                    continue
+            try:
+                selected_date = bill_date(kind, fields)
+                row = spec["compute"](fields, selected_date)
+                bill_store.check_open(spec["file"], [row])
+            except BillInputError as e:
+                results.append({"status": "error", "error": str(e)})
+                continue
+            except ValueError as e:
+                results.append({"status": "error", "error": f"⚠️ Error: {str(e)}"})
+                continue
+            previous = last_no.get(row["date"])
+            bill_no = next_bill_no(previous) if previous else generate_bill_no(spec["file"], selected_date)
+            last_no[row["date"]] = row["bill_no"] = bill_no
+            if "ref" in row:
+                row["ref"] = bill_no  # a transport bill's reference is its number
+            rows.append(row)
+            results.append({"status": "created", "bill_no": bill_no, "pdf": f"generated_pdfs/{bill_no}.pdf"})
+            if key:
+                keys[key] = {"key": key, "kind": kind, "bill_no": bill_no, "fingerprint": fingerprint}
+        if rows:
+            # The keys go to disk first, so a crash after the bills are saved cannot lose them
+            idempotency.remember(list(keys.values()))
+            try:
+                append_bills(spec["file"], rows, user)
+            except Exception:
+                idempotency.forget(list(keys))
+                raise
+            idempotency.confirm(list(keys))
+
+    os.makedirs("generated_pdfs", exist_ok=True)
+    for row in rows:
+        bill_data_pdf = row.copy()
+        if spec["exclude"]:
+            bill_data_pdf.pop(spec["exclude"])
+        pdf_file = f"generated_pdfs/{row['bill_no']}.pdf"
+        # Written aside and renamed, so a repeated submission never sends a half-written PDF
+        with open(pdf_file + ".tmp", "wb") as f:
+            render_bill_pdf(spec["template"], bill_data_pdf, f)
+        os.replace(pdf_file + ".tmp", pdf_file)
+    return results
+
+def send_bill_pdf(kind, bill_no):
+    """The PDF of an existing bill: the saved file, or rendered in memory while it is still being written."""
+    pdf_file = f"generated_pdfs/{bill_no}.pdf"
+    if os.path.exists(pdf_file):
+        return send_file(os.path.abspath(pdf_file), as_attachment=True)
+    spec = BILL_KINDS[kind]
+    bill_data_pdf = bill_store.find_bill(spec["file"], bill_no)
+    if spec["exclude"]:
+        bill_data_pdf.pop(spec["exclude"], None)
+    pdf = io.BytesIO()
+    render_bill_pdf(spec["template"], bill_data_pdf, pdf)
+    pdf.seek(0)
+    return send_file(pdf, mimetype="application/pdf", as_attachment=True, download_name=f"{bill_no}.pdf")
+
+def submit_bill_form(kind):
+    """Create the bill posted from an entry form and send its PDF, or flash why it was refused.
+
+    The form carries an idempotency key, so posting it again (a double tap, a retried request)
+    sends the PDF of the bill it already created without writing anything.
+    """
+    spec = BILL_KINDS[kind]
+    key = request.form.get("idempotency_key")
+    try:
+        result = create_bills(kind, [{"fields": request.form, "key": key if idempotency.valid(key) else None}],
+                              session["user"])[0]
+        if result["status"] == "duplicate":
+            if bill_store.find_bill(spec["file"], result["bill_no"]) is None:
+                flash(f"⚠️ {spec['title']} Bill {result['bill_no']} was already created from this form "
+                      f"and has since been deleted.", "warning")
+                return redirect(spec["entry_url"])
+            flash(f"ℹ️ {spec['title']} Bill {result['bill_no']} was already created from this form.", "info")
+            return send_bill_pdf(kind, result["bill_no"])
+        if result["status"] != "created":
+            flash(result["error"], "error")
+            return redirect(spec["entry_url"])
+        flash(f"✅ {spec['title']} Bill {result['bill_no']} created!", "success")
+        return send_file(os.path.abspath(result["pdf"]), as_attachment=True)
+    except Exception as e:
+        flash(f"⚠️ Error: {str(e)}", "error")
+        return redirect(spec["entry_url"])
+
+# Most bills accepted in one /api/bills/bulk request
+BULK_MAX_BILLS = 50
+
+@app.route("/api/bills/bulk", methods=["POST"])
+def bulk_bills():
+    """Create bills queued offline: {"bills": [{"kind": "sale", "key": "...", "fields": {...}}, ...]}.
+
+    Every bill carries an idempotency key, so a batch sent again after a dropped connection gets
+    the bills it already created back as "duplicate" instead of new ones. Answers
+    {"results": [...]} in request order, each with its key (see create_bills for the statuses).
+    """
+    if "user" not in session:
+        return jsonify({"error": "Please log in first."}), 401
+    bills = (request.get_json(silent=True) or {}).get("bills")
+    if not isinstance(bills, list) or not bills:
+        return jsonify({"error": 'expected {"bills": [...]}'}), 400
+    if len(bills) > BULK_MAX_BILLS:
+        return jsonify({"error": f"at most {BULK_MAX_BILLS} bills per request"}), 413
+
+    results = [None] * len(bills)
+    by_kind = {}
+    for i, bill in enumerate(bills):
+        key = bill.get("key") if isinstance(bill, dict) else None
+        if not isinstance(bill, dict) or bill.get("kind") not in BILL_KINDS:
+            results[i] = {"status": "error", "error": "unknown bill kind", "key": key}
+        elif not idempotency.valid(key):
+            results[i] = {"status": "error", "error": "missing or malformed idempotency key", "key": key}
+        elif not isinstance(bill.get("fields"), dict):
+            results[i] = {"status": "error", "error": "fields must be an object", "key": key}
+        else:
+            by_kind.setdefault(bill["kind"], []).append(i)
+    for kind, positions in by_kind.items():
+        submissions = [{"key": bills[i]["key"],
+                        "fields": {k: str(v) for k, v in bills[i]["fields"].items() if v is not None}}
+                       for i in positions]
+        for i, result in zip(positions, create_bills(kind, submissions, session["user"])):
+            result.pop("pdf", None)
+            results[i] = dict(result, key=bills[i]["key"])
+    return jsonify({"results": results})
+
+@app.route("/bill/<bill_no>/edit", methods=["GET", "POST"])
+def edit_bill(bill_no):
+    if "user" not in session:
+        flash("⚠️ Please log in to continue.", "warning")
+        return redirect("/")
+
+    kind, bill = locate_bill(bill_no)
+    if bill is None:
+        flash(f"❌ Bill {bill_no} not found.", "error")
+        return redirect("/menu")
+    spec = BILL_KINDS[kind]
+    edit_url = url_for("edit_bill", bill_no=bill_no)
+
+    if request.method == "POST":
+        try:
+            data = request.form
+            try:
+                selected_date = datetime.strptime(data.get("date", ""), "%Y-%m-%d")
+            except ValueError:
+                flash("⚠️ Invalid date format. Please use YYYY-MM-DD.", "error")
+                return redirect(edit_url)
+            # The number carries the day it was issued for; numbering and archiving go by it
+            issued_day = bill_store.bill_no_day(bill_no)
+            if issued_day and selected_date.date() != issued_day:
+                flash(f"⚠️ Bill {bill_no} was issued for {issued_day.strftime('%d-%m-%Y')} and must keep "
+                      f"that date. To move it to another day, delete it and enter a new bill.", "error")
+                return redirect(edit_url)
+
+            new_data = spec["compute"](data, selected_date)
+            new_data.pop("bill_no")
+            new_data.pop("bill_type")
+            new_data.pop("ref", None)  # a transport bill keeps the reference it was issued with
+            version, changes = bill_store.amend_bill(spec["file"], bill_no, new_data, session["user"])
+            if not changes:
+                flash("ℹ️ Nothing changed.", "info")
+                return redirect(edit_url)
+
+            # Only this bill's PDF is stale; re-render it from the amended row
+            bill_data_pdf = bill_store.find_bill(spec["file"], bill_no)
+            if spec["exclude"]:
+                bill_data_pdf.pop(spec["exclude"], None)
+            pdf_file = f"generated_pdfs/{bill_no}.pdf"
+            os.makedirs("generated_pdfs", exist_ok=True)
+            # Rendered aside and renamed over the old one: a failed render keeps the previous PDF,
+            # and a download running meanwhile never sees a half-written file
+            with open(pdf_file + ".tmp", "wb") as f:
+                render_bill_pdf(spec["template"], bill_data_pdf, f)
+            os.replace(pdf_file + ".tmp", pdf_file)
+
+            flash(f"✅ {spec['title']} Bill {bill_no} updated (version {version}: "
+                  f"{', '.join(col.replace('_', ' ') for col in changes)}).", "success")
+            return send_file(os.path.abspath(pdf_file), as_attachment=True)
+        except BillInputError as e:
+            flash(str(e), "error")
+            return redirect(edit_url)
+        except Exception as e:
+            flash(f"⚠️ Error: {str(e)}", "error")
+            return redirect(edit_url)
+
+    return render_template(
+        "edit_bill.html",
+        bill_no=bill_no,
+        title=spec["title"],
+        fields=spec["fields"],
+        values=edit_form_values(kind, bill),
+        history=list(reversed(bill_store.bill_history(spec["file"], bill_no))),
+        back_url=spec["view_url"],
+    )
+
+@app.route("/restore-bills/<billtype>", methods=["POST"])
+def restore_deleted_bills(billtype):
+    if "user" not in session:
+        return redirect("/")
+    if billtype == "sale":
+        file_path, view_url = SALE_FILE, "/view-bills"
+    elif billtype == "purchase":
+        file_path, view_url = PURCHASE_FILE, "/view-purchase-bills"
+    else:
+        flash("❌ Invalid bill type.", "error")
+        return redirect("/menu")
+
+    selected_bills = request.form.getlist("restore_ids")
+    if not selected_bills:
+        flash("⚠️ No bills selected to restore.", "warning")
+        return redirect(view_url)
+    restored = restore_bills(file_path, selected_bills, session["user"])
+    if restored < len(selected_bills):
+        flash(f"⚠️ {len(selected_bills) - restored} bill(s) could not be restored (already restored or past the "
+              f"{bill_store.DELETE_RETENTION.days}-day window).", "warning")
+    flash(f"✅ {restored} {billtype.title()} Bill(s) restored.", "success")
+    return redirect(view_url)
+
 @app.route("/download-selected-bills/<billtype>", methods=["POST"])
 def download_selected_bills(billtype):
     if "user" not in session:
@@ -519,8 +629,7 @@ def download_selected_bills(billtype):
 
         # Read Excel file and select matching bills
         with excel_lock:
-            df = pd.read_excel(file_path, engine='openpyxl')
-            selected_df = df[df['bill_no'].astype(str).isin(selected_bills)]
+            selected_df = bill_store.select_bill_nos(file_path, selected_bills)
 
         if selected_df.empty:
             flash("❌ Selected bills not found in database.", "error")
@@ -543,8 +652,7 @@ def download_selected_bills(billtype):
             # Generate temporary PDF
             pdf_file = f"generated_pdfs/temp_{bill_no}.pdf"
             with open(pdf_file, "wb") as f:
-                html = render_template(template, **bill_data_pdf)
-                pisa.CreatePDF(html, dest=f)
+                render_bill_pdf(template, bill_data_pdf, f)
             temp_files.append(pdf_file)
 
             # Add pages from temp PDF to writer
@@ -562,7 +670,7 @@ def download_selected_bills(billtype):
             if os.path.exists(file):
                 os.remove(file)
 
-        return send_file(final_pdf, as_attachment=True)
+        return send_file(os.path.abspath(final_pdf), as_attachment=True)
 
     except Exception as e:
         flash(f"⚠️ Error merging PDFs: {str(e)}", "error")
@@ -596,7 +704,50 @@ def ten_form_download():
         mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
     )
 
+def csv_chunks(rows, compress=False, rows_per_chunk=500):
+    """Encode rows as CSV a chunk at a time, gzip-compressing on the fly when `compress` is set."""
+    gz = zlib.compressobj(wbits=31) if compress else None  # wbits=31 -> gzip container
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+
+    def take():
+        data = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+        return gz.compress(data) if gz else data
+
+    for i, row in enumerate(rows, 1):
+        writer.writerow(["" if pd.isna(v) else v for v in row])
+        if i % rows_per_chunk == 0:
+            chunk = take()
+            if chunk:
+                yield chunk
+    chunk = take()
+    if gz:
+        chunk += gz.flush()
+    if chunk:
+        yield chunk
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def started(chunks):
+    """`chunks` with its first item already produced. An error there is raised in the view, and
+    goes to the error page or flash, instead of ending a download that was already sent as 200."""
+    chunks = iter(chunks)
+    for first in chunks:
+        return itertools.chain([first], chunks)
+    return iter(())
+
+def xlsx_response(chunks, filename):
+    """Send the .xlsx bytes yielded by `chunks` as a download as they are produced."""
+    return Response(
+        started(chunks),
+        mimetype=XLSX_MIMETYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @app.route("/download/<billtype>/<filetype>")
+@http_cache.validated(lambda billtype, filetype: [SALE_FILE if billtype.lower() == "sale" else PURCHASE_FILE])
 def download_file(billtype, filetype):
     if "user" not in session:
         flash("⚠️ Please log in first.", "warning")
@@ -614,15 +765,26 @@ def download_file(billtype, filetype):
         flash(f"❌ {file_path} not found.", "error")
         return redirect("/menu")
 
-    df = pd.read_excel(file_path, engine='openpyxl')
+    try:
+        date_range = parse_range(request.args)
+    except ValueError as e:
+        flash(f"⚠️ {e}.", "warning")
+        return redirect("/view-bills" if billtype.lower() == "sale" else "/view-purchase-bills")
+
     if filetype == "csv":
-        path = f"{billtype}_bills.csv"
-        df.to_csv(path, index=False)
-        return send_file(path, as_attachment=True)
+        # Streamed straight from the store with the view page filters; nothing is written to disk
+        rows = iter_bills(file_path, view_filters(request.args), date_range=date_range)
+        compress = request.args.get("gzip") == "1"
+        filename = f"{billtype}_bills.csv" + (".gz" if compress else "")
+        return Response(
+            started(csv_chunks(rows, compress)),
+            mimetype="application/gzip" if compress else "text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
     elif filetype == "excel":
-        path = f"{billtype}_bills_download.xlsx"
-        df.to_excel(path, index=False, engine='openpyxl')
-        return send_file(path, as_attachment=True)
+        rows = iter_bills(file_path, view_filters(request.args), date_range=date_range)
+        chunks = stream_xlsx([(f"{billtype.title()} Bills", rows)], EXPORT_COLUMN_TYPES)
+        return xlsx_response(chunks, f"{billtype}_bills_download.xlsx")
 
     flash("❌ Invalid file type.", "error")
     return redirect("/menu")
@@ -632,307 +794,300 @@ def clear_specific_bills(billtype):
     if "user" not in session:
         return redirect("/")
     try:
-        file_path = "bills.xlsx"
+        file_path = TRANSPORT_FILE
         if os.path.exists(file_path):
-            df = pd.read_excel(file_path, engine='openpyxl')
-            df = df[df['bill_type'].str.lower() != billtype.lower()]
-            df.to_excel(file_path, index=False, engine='openpyxl')
+            clear_bills(file_path, billtype, session["user"])
         flash(f"✅ {billtype.title()} Bills cleared successfully.", "success")
     except Exception as e:
         flash(f"❌ Failed to clear bills: {str(e)}", "error")
     return redirect("/view-bills" if billtype == "sale" else "/view-purchase-bills")
 
+@app.route("/export")
+def export_page():
+    if "user" not in session:
+        flash("⚠️ Please log in first.", "warning")
+        return redirect("/")
+    return render_template("export.html", jobs=export_jobs.recent_jobs(session["user"]),
+                           inline_limit=export_jobs.INLINE_ROW_LIMIT)
+
 @app.route("/download-excel")
+@http_cache.validated(lambda: bill_store.BILL_FILES)
 def download_excel():
+    """Sale, purchase and transport bills in one workbook, optionally limited to from_date..to_date."""
     if "user" not in session:
         flash("⚠️ Please log in first.", "warning")
         return redirect("/")
 
-    file_path = "bills.xlsx"
-    output_path = "sale_purchase_bills_only.xlsx"
-    if os.path.exists(file_path):
-        df = pd.read_excel(file_path, engine='openpyxl')
-        sale_cols = [
-            'bill_type', 'bill_no', 'date', 'mill_name', 'mill_code', 'farmer_name', 'rice_type',
-            'bags', 'ntwt', 'stwt', 'sut_rate', 'price', 'net_bags',
-            'amount', 'commission', 'hamali', 'gunny', 'advance', 'rmc',
-            'grand_total', 'lorry_no', 'mobile_no'
-        ]
-        purchase_cols = [
-            'bill_type', 'bill_no', 'date', 'farmer_name', 'village_name', 'mill_name', 'rice_type',
-            'bags', 'ntwt', 'sut_rate', 'stwt', 'total_ntwt', 'rate',
-            'amount', 'hamali', 'weigh_bridge', 'grand_total', 'lorry_no'
-        ]
-        sale_bills = df[df['bill_type'] == 'Sale'][sale_cols]
-        purchase_bills = df[df['bill_type'] == 'Purchase'][purchase_cols]
-        with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-            if not sale_bills.empty:
-                sale_bills.to_excel(writer, sheet_name='Sale Bills', index=False)
-            if not purchase_bills.empty:
-                purchase_bills.to_excel(writer, sheet_name='Purchase Bills', index=False)
-        return send_file(output_path, as_attachment=True)
-
-    flash("❌ bills.xlsx file not found.", "error")
-    return redirect("/menu")
+    try:
+        date_range = parse_range(request.args)
+    except ValueError as e:
+        flash(f"❌ Invalid date range: {e}", "error")
+        return redirect(url_for("export_page"))
 
-def safe_read_excel(path):
-    if os.path.exists(path):
-        try:
-            return pd.read_excel(path, engine='openpyxl')
-        except Exception as e:
-            print(f"Error reading Excel {path}: {e}")
-            return pd.DataFrame()
-    return pd.DataFrame()
-
-def prep_df(df):
-    if df.empty:
-        return df
-    needed = [
-        "date", "mill_name", "village_name", "farmer_name", "rice_type",
-        "lorry_no", "bags", "ntwt", "net_bags", "amount", "rmc"
-    ]
-    for col in needed:
-        if col not in df.columns:
-            df[col] = pd.NA
-    # Convert date with strict parsing and drop NaT
-    df["date"] = pd.to_datetime(df["date"], format="%d-%m-%Y", errors="coerce")
-    df = df.dropna(subset=["date"])  # Explicitly drop rows with NaT dates
-    for col in ["bags", "ntwt", "net_bags", "amount", "rmc"]:
-        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
-    for col in ["mill_name", "village_name", "farmer_name", "rice_type", "lorry_no"]:
-        df[col] = df[col].astype(str).str.strip()
-        df.loc[df[col].isin(["", "nan", "NaN", "None"]), col] = ""
-    # Log any problematic dates for debugging
-    if df["date"].isna().any():
-        print("Warning: Found NaT values in date column after conversion")
-    return df
-
-def apply_common_filters(df, from_date, to_date, mill, village, farmer, lorry, rice_type):
-    if df.empty:
-        return df
-    if from_date:
-        fdt = pd.to_datetime(from_date, format="%Y-%m-%d", errors="coerce")
-        if pd.notnull(fdt):
-            df = df[df["date"] >= fdt]
-    if to_date:
-        tdt = pd.to_datetime(to_date, format="%Y-%m-%d", errors="coerce")
-        if pd.notnull(tdt):
-            df = df[df["date"] <= tdt]
-    if mill:
-        df = df[df["mill_name"] == mill]
-    if village:
-        df = df[df["village_name"] == village]
-    if farmer:
-        df = df[df["farmer_name"] == farmer]
-    if lorry:
-        df = df[df["lorry_no"] == lorry]
-    if rice_type:
-        df = df[df["rice_type"] == rice_type]
-    return df
-
-def series_to_aligned_lists(s1, s2):
-    idx = s1.index.union(s2.index)
-    idx = sorted(idx)
-    lab = [str(i) for i in idx]
-    a = [float(s1.get(i, 0)) for i in idx]
-    b = [float(s2.get(i, 0)) for i in idx]
-    return lab, a, b
+    rows = export_jobs.count_rows(date_range)
+    if rows <= export_jobs.INLINE_ROW_LIMIT:
+        return xlsx_response(export_jobs.export_chunks(date_range), export_jobs.export_filename(date_range))
+
+    job = export_jobs.start_job(date_range, session["user"], rows)
+    flash(f"⏳ Exporting {rows} bills ({job['range']}) in the background. The download link appears below when it is ready.", "info")
+    return redirect(url_for("export_page"))
+
+@app.route("/export/<job_id>/download")
+def export_download(job_id):
+    if "user" not in session:
+        return redirect("/")
+    job = export_jobs.get_job(job_id, session["user"])
+    if not job or job["status"] != "done" or not os.path.exists(job["path"]):
+        flash("❌ That export is not available.", "error")
+        return redirect(url_for("export_page"))
+    return send_file(os.path.abspath(job["path"]), as_attachment=True, download_name=job["filename"],
+                     mimetype=XLSX_MIMETYPE)
+
+def audit_store(kind):
+    """Audit log store name for a bill kind (sale, purchase, transport), or None."""
+    spec = BILL_KINDS.get(kind)
+    return audit_log.store_name(spec["file"]) if spec else None
+
+@app.route("/api/audit/<kind>/state")
+def audit_state(kind):
+    """The bills of a store as they were at ?at=<ISO date/time> (default now), rebuilt from the audit log."""
+    if "user" not in session:
+        return jsonify({"error": "login required"}), 401
+    store = audit_store(kind)
+    if not store:
+        return jsonify({"error": f"unknown bill kind {kind}"}), 404
+    started = time.perf_counter()
+    try:
+        state = audit_log.state_at(store, request.args.get("at") or None)
+    except ValueError:
+        return jsonify({"error": "at must be an ISO date/time, e.g. 2025-11-01T18:00"}), 400
+    except (OSError, audit_log.AuditError) as e:
+        return jsonify({"error": str(e)}), 404
+    rows = audit_log.visible_rows(state)
+    return jsonify({
+        "store": store, "at": request.args.get("at"), "count": len(rows), "seq": state["seq"],
+        "snapshot_seq": state["snapshot_seq"], "replayed": state["replayed"],
+        "ms": round((time.perf_counter() - started) * 1000, 1), "rows": rows,
+    })
+
+@app.route("/api/audit/<kind>/events")
+def audit_events(kind):
+    """Logged changes of a store, optionally only ?bill_no=... and/or those ?since=<ISO date/time>."""
+    if "user" not in session:
+        return jsonify({"error": "login required"}), 401
+    store = audit_store(kind)
+    if not store:
+        return jsonify({"error": f"unknown bill kind {kind}"}), 404
+    try:
+        found = audit_log.events(store, request.args.get("bill_no") or None, request.args.get("since") or None)
+    except ValueError:
+        return jsonify({"error": "since must be an ISO date/time"}), 400
+    return jsonify({"store": store, "count": len(found), "events": found})
+
+@app.route("/api/audit/verify")
+def audit_verify():
+    """Check the hash chain and snapshots of every audit log."""
+    if "user" not in session:
+        return jsonify({"error": "login required"}), 401
+    results = [audit_log.verify(store) for store in audit_log.known_stores()]
+    return jsonify({"ok": all(r["ok"] for r in results), "stores": results}), 200 if all(r["ok"] for r in results) else 409
 
 @app.route("/analytics")
+@http_cache.validated(lambda: [])
 def analytics():
-    # Load & prep
-    sales_df = prep_df(safe_read_excel(SALE_FILE))
-    purchase_df = prep_df(safe_read_excel(PURCHASE_FILE))
-
-    # ---- Get filters ----
-    from_date = request.args.get("from_date", "")
-    to_date = request.args.get("to_date", "")
-    mill_filter = request.args.get("mill", "")
-    village_filter = request.args.get("village", "")
-    farmer_filter = request.args.get("farmer", "")
-    lorry_filter = request.args.get("lorry", "")
-    rice_type_filter = request.args.get("rice_type", "")
-
-    # ---- Apply filters ----
-    sales_df = apply_common_filters(sales_df, from_date, to_date, mill_filter, village_filter, farmer_filter, lorry_filter, rice_type_filter)
-    purchase_df = apply_common_filters(purchase_df, from_date, to_date, mill_filter, village_filter, farmer_filter, lorry_filter, rice_type_filter)
-
-    # ---- KPIs ----
-    sales_kpi = {
-        "total_bags": float(sales_df["bags"].sum()) if not sales_df.empty else 0,
-        "total_ntwt": float(sales_df["ntwt"].sum()) if not sales_df.empty else 0,
-        "total_net_bags": float(sales_df["net_bags"].sum()) if not sales_df.empty else 0,
-        "total_count": int(len(sales_df)),
-        "total_sales": float(sales_df["amount"].sum()) if not sales_df.empty else 0,
-    }
+    # The page is a shell; its script fetches every widget from /api/analytics/<widget>
+    return render_template("analytics.html", widgets=[name for name in dashboard.WIDGETS if name != "records"],
+                           per_page=dashboard.RECORDS_PER_PAGE)
+
+@app.route("/api/analytics/<widget>")
+@http_cache.validated(lambda widget: [SALE_FILE, PURCHASE_FILE])
+def analytics_widget(widget):
+    """One dashboard widget as JSON for the filters in the query string (see dashboard.FILTERS)."""
+    if widget not in dashboard.WIDGETS:
+        return jsonify({"error": f"unknown widget {widget}"}), 404
+    try:
+        body, hit = dashboard.widget_json(widget, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except StoreCorruptError as e:
+        return jsonify({"error": str(e)}), 503
+    return Response(body, mimetype="application/json", headers={"X-Cache": "HIT" if hit else "MISS"})
 
-    purchase_kpi = {
-        "total_bags": float(purchase_df["bags"].sum()) if not purchase_df.empty else 0,
-        "total_ntwt": float(purchase_df["ntwt"].sum()) if not purchase_df.empty else 0,
-        "total_net_bags": float(purchase_df["net_bags"].sum()) if not purchase_df.empty else 0,
-        "total_count": int(len(purchase_df)),
-        "total_purchase": float(purchase_df["amount"].sum()) if not purchase_df.empty else 0,
-    }
+# Templates rendered once during warm-up so xhtml2pdf has its fonts and CSS parser loaded
+PDF_TEMPLATES = ["bill_template.html", "purchase_bill_template.html", "transportation_bill_template.html"]
 
-    # ---- Dropdowns (from both files) ----
-    combined = pd.concat([sales_df, purchase_df], ignore_index=True) if not sales_df.empty or not purchase_df.empty else pd.DataFrame(columns=["mill_name","village_name","farmer_name","lorry_no","rice_type"])
-    mills = sorted([m for m in combined.get("mill_name", pd.Series()).dropna().unique().tolist() if m])
-    villages = sorted([v for v in combined.get("village_name", pd.Series()).dropna().unique().tolist() if v])
-    farmers = sorted([f for f in combined.get("farmer_name", pd.Series()).dropna().unique().tolist() if f])
-    lorries = sorted([l for l in combined.get("lorry_no", pd.Series()).dropna().unique().tolist() if l])
-    rice_types = sorted([r for r in combined.get("rice_type", pd.Series()).dropna().unique().tolist() if r])
-
-    # ---- 1) Daily bar: totals per day ----
-    if not sales_df.empty:
-        sales_daily = sales_df.groupby(sales_df["date"].dt.date)["amount"].sum()
-    else:
-        sales_daily = pd.Series(dtype=float)
-    if not purchase_df.empty:
-        purchase_daily = purchase_df.groupby(purchase_df["date"].dt.date)["amount"].sum()
-    else:
-        purchase_daily = pd.Series(dtype=float)
-    daily_labels, daily_sales, daily_purchase = series_to_aligned_lists(sales_daily, purchase_daily)
+warmup_state = {"status": "disabled" if not app.config["WARMUP_ON_START"] else "pending", "steps": {}}
 
-    # ---- 2) Weekly bar: totals per ISO week (use week start date) ----
-    if not sales_df.empty:
-        s_week = sales_df.groupby(sales_df["date"].dt.to_period("W").dt.start_time.dt.date)["amount"].sum()
-    else:
-        s_week = pd.Series(dtype=float)
-    if not purchase_df.empty:
-        p_week = purchase_df.groupby(purchase_df["date"].dt.to_period("W").dt.start_time.dt.date)["amount"].sum()
-    else:
-        p_week = pd.Series(dtype=float)
-    weekly_labels, weekly_sales, weekly_purchase = series_to_aligned_lists(s_week, p_week)
+def warm_up():
+    """Pay the cold-start costs (workbook parse, template compile, PDF engine) before the first customer does."""
+    warmup_state["status"] = "running"
+    started = time.perf_counter()
 
-    # ---- 3) Monthly trend: sums per month ----
-    if not sales_df.empty:
-        s_month = sales_df.groupby(sales_df["date"].dt.to_period("M"))["amount"].sum()
-    else:
-        s_month = pd.Series(dtype=float)
-    if not purchase_df.empty:
-        p_month = purchase_df.groupby(purchase_df["date"].dt.to_period("M"))["amount"].sum()
-    else:
-        p_month = pd.Series(dtype=float)
-    month_idx = s_month.index.union(p_month.index)
-    month_idx = sorted(month_idx)
-    trend_labels = [str(m) for m in month_idx]
-    trend_sales = [float(s_month.get(m, 0)) for m in month_idx]
-    trend_purchase = [float(p_month.get(m, 0)) for m in month_idx]
-
-    # ---- 6) Monthly difference: (sales - purchase) per month ----
-    monthly_diff = [float((s_month.get(m, 0) - p_month.get(m, 0))) for m in month_idx]
-
-    # ---- 4) Donut: total bags (sales vs purchase) ----
-    donut_bags = [sales_kpi["total_bags"], purchase_kpi["total_bags"]]
-
-    # ---- 5) Pie: total amount (sales vs purchase) ----
-    pie_amounts = [sales_kpi["total_sales"], purchase_kpi["total_purchase"]]
-
-    # ---- 7) Top 5 farmers by purchase amount ----
-    if not purchase_df.empty and "farmer_name" in purchase_df.columns:
-        top_farmers_df = (purchase_df[purchase_df["farmer_name"] != ""]
-                          .groupby("farmer_name")["amount"].sum()
-                          .sort_values(ascending=False).head(5))
-    else:
-        top_farmers_df = pd.Series(dtype=float)
-    top_farmers_labels = top_farmers_df.index.tolist()
-    top_farmers_values = [float(v) for v in top_farmers_df.values.tolist()]
-
-    # ---- 8) Top 5 mills by sales amount ----
-    if not sales_df.empty and "mill_name" in sales_df.columns:
-        top_mills_df = (sales_df[sales_df["mill_name"] != ""]
-                        .groupby("mill_name")["amount"].sum()
-                        .sort_values(ascending=False).head(5))
-    else:
-        top_mills_df = pd.Series(dtype=float)
-    top_mills_labels = top_mills_df.index.tolist()
-    top_mills_values = [float(v) for v in top_mills_df.values.tolist()]
-
-    # ---- 9) Top 5 villages by total bags purchased ----
-    if not purchase_df.empty and "village_name" in purchase_df.columns:
-        top_villages_df = (purchase_df[purchase_df["village_name"] != ""]
-                           .groupby("village_name")["bags"].sum()
-                           .sort_values(ascending=False).head(5))
-    else:
-        top_villages_df = pd.Series(dtype=float)
-    top_villages_labels = top_villages_df.index.tolist()
-    top_villages_values = [float(v) for v in top_villages_df.values.tolist()]
-
-    # ---- 10) Top 5 trucks by total bags (combined sales+purchase) ----
-    bags_cols = ["lorry_no", "bags"]
-    sp_bags = []
-    if not sales_df.empty:
-        sp_bags.append(sales_df[bags_cols].copy())
-    if not purchase_df.empty:
-        sp_bags.append(purchase_df[bags_cols].copy())
-    if sp_bags:
-        both_bags = pd.concat(sp_bags, ignore_index=True)
-        top_trucks_df = (both_bags[both_bags["lorry_no"] != ""]
-                         .groupby("lorry_no")["bags"].sum()
-                         .sort_values(ascending=False).head(5))
-    else:
-        top_trucks_df = pd.Series(dtype=float)
-    top_trucks_labels = top_trucks_df.index.tolist()
-    top_trucks_values = [float(v) for v in top_trucks_df.values.tolist()]
-
-    # ---- Records tables ----
-    sales_records, purchase_records = [], []
-    if not sales_df.empty:
-        for _, row in sales_df.iterrows():
-            sales_records.append({
-                "date": row["date"].strftime("%d-%m-%Y") if pd.notnull(row["date"]) else "",
-                "mill": row.get("mill_name", ""),
-                "farmer": row.get("farmer_name", ""),
-                "rice_type": row.get("rice_type", ""),
-                "lorry": row.get("lorry_no", ""),
-                "bags": row.get("bags", 0),
-                "ntwt": row.get("ntwt", 0),
-                "amount": row.get("amount", 0),
-                "rmc": row.get("rmc", 0)
-            })
-    if not purchase_df.empty:
-        for _, row in purchase_df.iterrows():
-            purchase_records.append({
-                "date": row["date"].strftime("%d-%m-%Y") if pd.notnull(row["date"]) else "",
-                "mill": row.get("mill_name", ""),
-                "farmer": row.get("farmer_name", ""),
-                "village": row.get("village_name", ""),
-                "rice_type": row.get("rice_type", ""),
-                "lorry": row.get("lorry_no", ""),
-                "bags": row.get("bags", 0),
-                "ntwt": row.get("ntwt", 0),
-                "amount": row.get("amount", 0)
-            })
+    def step(name, fn):
+        t0 = time.perf_counter()
+        try:
+            fn()
+            warmup_state["steps"][name] = round(time.perf_counter() - t0, 3)
+        except Exception as e:
+            warmup_state["steps"][name] = f"failed: {e}"
+            print(f"Warm-up step {name} failed: {e}")
+
+    def load_tables():
+        errors = bill_store.warm()
+        if errors:
+            raise RuntimeError(errors)
+        # Exercise the analytics parsing path on the loaded tables too
+        dashboard.prep_df(dashboard.safe_read_excel(SALE_FILE))
+        dashboard.prep_df(dashboard.safe_read_excel(PURCHASE_FILE))
+
+    def compile_templates():
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            app.jinja_env.get_template(name)
+
+    def render_pdfs():
+        with app.test_request_context():
+            for template in PDF_TEMPLATES:
+                render_bill_pdf(template, {"bill_no": "WARMUP"}, io.BytesIO())
+
+    step("bill_tables", load_tables)
+    step("templates", compile_templates)
+    step("pdf", render_pdfs)
+    step("assets", assets.files)
+    warmup_state["seconds"] = round(time.perf_counter() - started, 3)
+    warmup_state["status"] = "done"
+
+def start_warmup():
+    Thread(target=warm_up, name="warmup", daemon=True).start()
+
+# How often the background job compacts the stores (it also runs once at startup)
+COMPACT_INTERVAL = 6 * 3600
+
+# Reports of the most recent compaction run, shown on /healthz
+compaction_state = {"last_run": None, "reports": []}
+
+def size_change(before, after):
+    """How a rewrite changed a file's size, for the logs: folding amendments in can make it grow."""
+    if after > before:
+        return f"{before} -> {after} bytes ({after - before} bytes grown)"
+    return f"{before} -> {after} bytes ({before - after} bytes reclaimed)"
+
+def compact_stores():
+    """Deduplicate the stores, drop expired deleted bills and archive closed financial years;
+    returns one report per store."""
+    reports = []
+    for path in bill_store.BILL_FILES:
+        try:
+            report = bill_store.compact(path)
+        except Exception as e:
+            print(f"Compaction of {path} failed: {e}")
+            report = {"store": path, "error": str(e)}
+        else:
+            if report.get("conflicts"):
+                print(f"Compaction of {path} skipped: bill number(s) {', '.join(report['conflicts'])} appear on "
+                      f"rows with different details. It resumes once the store has one row per bill number.")
+            elif report["duplicates_removed"] or report["deleted_removed"] or report["amendments_applied"]:
+                print(f"Compacted {path}: {report['amendments_applied']} amended bill(s) folded in, "
+                      f"{report['duplicates_removed']} duplicate(s) and "
+                      f"{report['deleted_removed']} deleted bill(s) removed, "
+                      f"{size_change(report['bytes_before'], report['bytes_after'])}")
+        try:
+            report["archived"] = bill_store.archive_closed_years(path)
+        except Exception as e:
+            print(f"Archiving closed years of {path} failed: {e}")
+            report["archived_error"] = str(e)
+        else:
+            for year, count in report["archived"].items():
+                print(f"Archived financial year {year} of {path}: {count} bill(s) moved to {bill_store.ARCHIVE_DIR}/")
+        reports.append(report)
+    compaction_state.update(last_run=datetime.now().isoformat(timespec="seconds"), reports=reports)
+    return reports
+
+def start_compactor():
+    def loop():
+        while True:
+            compact_stores()
+            time.sleep(COMPACT_INTERVAL)
+    Thread(target=loop, name="compactor", daemon=True).start()
+
+@app.errorhandler(StoreCorruptError)
+def store_corrupt(e):
+    print(f"Store error: {e}")
+    flash(f"❌ {e}", "error")
+    return redirect("/menu")
 
-    return render_template(
-        "analytics.html",
-        # Filters
-        mills=mills, villages=villages, farmers=farmers, lorries=lorries, rice_types=rice_types,
-        # KPIs
-        sales=sales_kpi, purchase=purchase_kpi,
-        # 1) Daily
-        daily_labels=daily_labels, daily_sales=daily_sales, daily_purchase=daily_purchase,
-        # 2) Weekly
-        weekly_labels=weekly_labels, weekly_sales=weekly_sales, weekly_purchase=weekly_purchase,
-        # 3) Monthly trend
-        trend_labels=trend_labels, trend_sales=trend_sales, trend_purchase=trend_purchase,
-        # 6) Monthly difference
-        diff_labels=trend_labels, monthly_diff=monthly_diff,
-        # 4) Donut bags
-        donut_bags=donut_bags,
-        # 5) Pie amounts
-        pie_amounts=pie_amounts,
-        # 7) Top farmers
-        top_farmers_labels=top_farmers_labels, top_farmers_values=top_farmers_values,
-        # 8) Top mills
-        top_mills_labels=top_mills_labels, top_mills_values=top_mills_values,
-        # 9) Top villages
-        top_villages_labels=top_villages_labels, top_villages_values=top_villages_values,
-        # 10) Top trucks
-        top_trucks_labels=top_trucks_labels, top_trucks_values=top_trucks_values,
-        # Tables
-        sales_records=sales_records, purchase_records=purchase_records
-    )
+# Result of the crash-recovery check run at startup, shown on /healthz
+recovery_state = {"ran": False}
+
+def run_recovery():
+    report = bill_store.recover()
+    with excel_lock:
+        report["idempotency"] = idempotency.recover()
+    recovery_state.update(report, ran=True)
+    for path in report["removed"]:
+        print(f"Recovery: removed {path} left by an interrupted write")
+    for path in report["trimmed"]:
+        print(f"Recovery: cut an incomplete last line off {path}")
+    if report["idempotency"]["dropped"]:
+        print(f"Recovery: dropped {report['idempotency']['dropped']} idempotency key(s) of bills that were never saved")
+    for path, reason in report["corrupt"].items():
+        print(f"Recovery: {path} is damaged ({reason}). It will not be read or written until it is "
+              f"restored from a backup (python backup.py list / restore).")
+    return report
+
+# With BILLING_BACKUP_DIR set, the app also takes an incremental backup there this often
+BACKUP_INTERVAL = 3600
+
+backup_state = {"enabled": bool(os.environ.get("BILLING_BACKUP_DIR")), "last_run": None, "last": None, "error": None}
+
+def start_backups():
+    def loop():
+        while True:
+            try:
+                manifest = backup.create(os.environ["BILLING_BACKUP_DIR"])
+                backup_state.update(last={k: manifest[k] for k in ("id", "files_read", "new_chunks", "stored_bytes", "seconds")},
+                                    error=None)
+            except Exception as e:
+                print(f"Backup failed: {e}")
+                backup_state["error"] = str(e)
+            backup_state["last_run"] = datetime.now().isoformat(timespec="seconds")
+            time.sleep(BACKUP_INTERVAL)
+    Thread(target=loop, name="backup", daemon=True).start()
+
+@app.route("/healthz")
+def healthz():
+    """Readiness probe used by launch_app.py: 200 once storage is usable and the bill caches are warm."""
+    storage = bill_store.storage_status()
+    errors = {}
+    # While the warm-up thread is loading the tables, report "starting" rather than parsing them twice
+    if storage["ok"] and warmup_state["status"] != "running" and not bill_store.is_warm():
+        errors = bill_store.warm()
+    caches_warm = not errors and bill_store.is_warm()
+    ready = storage["ok"] and caches_warm
+    body = {
+        "app": APP_ID,
+        "status": "ready" if ready else "starting",
+        "storage": storage,
+        "caches": {"bill_tables": "warm" if caches_warm else "cold"},
+        "warmup": warmup_state,
+        "compaction": compaction_state,
+        "backup": backup_state,
+        "idempotency": idempotency.stats(),
+        "recovery": recovery_state,
+    }
+    if errors:
+        body["errors"] = errors
+    return jsonify(body), 200 if ready else 503
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    debug = True
+    # Under the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+    serving = not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+    if serving:
+        run_recovery()
+    if app.config["WARMUP_ON_START"] and serving:
+        start_warmup()
+    if serving:
+        start_compactor()
+        if backup_state["enabled"]:
+            start_backups()
+    app.run(debug=debug)
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""Fingerprinted, pre-compressed static bundles.
+
+Each bundle in BUNDLES is built once into static/dist/<name>.<hash><ext>, next to a .gz and
+(when the optional `brotli` package is installed) a .br copy. Templates link them with
+asset_url("<bundle>"); because the hash changes whenever the content does, /assets/ serves
+them with a one-year immutable Cache-Control and the service worker precaches them.
+
+init_app() also serves /service-worker.js and /manifest.json from the site root, which the
+templates have always linked to.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from threading import Lock
+
+from flask import Response, abort, render_template, request, send_file, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+
+# Bundle name -> source files (relative to static/), concatenated in order
+BUNDLES = {
+    "chart.js": ["vendor/chart.js/chart.umd.min.js"],
+    "pwa.js": ["js/pwa.js"],
+    "bill-queue.js": ["js/bill_queue.js"],
+    "offline-forms.js": ["js/bill_queue.js", "js/offline_forms.js"],
+    "analytics.js": ["js/analytics.js"],
+    "analytics.css": ["css/analytics.css"],
+}
+
+# Encodings we pre-compress to, preferred first: Content-Encoding -> file suffix
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_lock = Lock()
+_built = {"stamp": None, "files": {}}  # files: bundle name -> fingerprinted file name
+
+
+def _stamp():
+    return tuple(os.stat(os.path.join(STATIC_DIR, src)).st_mtime_ns for srcs in BUNDLES.values() for src in srcs)
+
+
+def _write(path, data):
+    if os.path.exists(path):
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build():
+    """Write every bundle and its compressed copies to static/dist; returns {bundle: file name}."""
+    os.makedirs(DIST_DIR, exist_ok=True)
+    files = {}
+    for name, sources in BUNDLES.items():
+        data = b"\n".join(open(os.path.join(STATIC_DIR, src), "rb").read() for src in sources)
+        stem, ext = os.path.splitext(name)
+        filename = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+        path = os.path.join(DIST_DIR, filename)
+        _write(path, data)
+        _write(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path + ".br", brotli.compress(data, quality=11))
+        files[name] = filename
+    return files
+
+
+def files():
+    """{bundle: fingerprinted file name}, rebuilt when a source file changes."""
+    stamp = _stamp()
+    with _lock:
+        if _built["stamp"] != stamp:
+            _built["files"] = build()
+            _built["stamp"] = stamp
+        return _built["files"]
+
+
+def url(name):
+    """URL of the bundle `name`, e.g. /assets/analytics.3f9c2a1b7d4e.js."""
+    return f"/assets/{files()[name]}"
+
+
+def version():
+    """Short hash over all bundles; names the service worker cache."""
+    return hashlib.sha256("".join(sorted(files().values())).encode()).hexdigest()[:12]
+
+
+def send_asset(filename):
+    """The fingerprinted file `filename`, pre-compressed in the best encoding the client accepts."""
+    if filename not in files().values():
+        abort(404)
+    path = os.path.join(DIST_DIR, filename)
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if name in request.accept_encodings and os.path.exists(path + suffix):
+            path, encoding = path + suffix, name
+            break
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+def init_app(app):
+    """Serve /assets/, /service-worker.js and /manifest.json, and give templates asset_url()."""
+    app.add_url_rule("/assets/<path:filename>", "asset", send_asset)
+    app.context_processor(lambda: {"asset_url": url})
+
+    @app.route("/service-worker.js")
+    def service_worker():
+        # Served from the root so its scope covers the whole app; never cached, so new bundles roll out
+        body = render_template("service-worker.js", cache_name=f"traders-app-{version()}",
+                               assets=[url(name) for name in BUNDLES], queue_script=url("bill-queue.js"))
+        return Response(body, mimetype="application/javascript",
+                        headers={"Cache-Control": "no-cache", "Service-Worker-Allowed": "/"})
+
+    @app.route("/manifest.json")
+    def manifest():
+        return send_from_directory(STATIC_DIR, "manifest.json", mimetype="application/manifest+json")
@@ -0,0 +1,370 @@
+"""Append-only, hash-chained audit log of every change to the bill stores.
+
+Each store has its own log, audit/<store>.audit.jsonl, with one JSON event per line:
+create, amend, delete, restore, clear, compact or archive. Every event carries the SHA-256 of the
+previous event, so editing or dropping a line breaks the chain and verify() reports where.
+
+Every SNAPSHOT_EVERY events the full state of the store is written to audit/snapshots/ together
+with the log offset it covers. Reconstructing a store at a past moment loads the newest
+snapshot taken before that moment and replays only the events after it.
+
+    python audit_log.py verify
+    python audit_log.py state sale --at 2025-11-01T18:00 --csv sale_at_nov1.csv
+    python audit_log.py history SB-20251026-001
+    python audit_log.py snapshot
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+from datetime import date, datetime
+from threading import RLock
+
+AUDIT_DIR = "audit"
+SNAPSHOT_DIR = os.path.join(AUDIT_DIR, "snapshots")
+SNAPSHOT_INDEX = os.path.join(SNAPSHOT_DIR, "index.jsonl")
+
+# Take a snapshot of a store after this many events since its last one
+SNAPSHOT_EVERY = 500
+
+GENESIS = "0" * 64
+
+audit_lock = RLock()
+
+# store -> {"seq", "hash", "snapshot_seq"} of the last event in its log
+_tails = {}
+
+
+class AuditError(Exception):
+    """The log or a snapshot failed its checksum."""
+
+
+def store_name(path):
+    """sale_bills.xlsx -> sale_bills"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def log_path(store):
+    return os.path.join(AUDIT_DIR, f"{store}.audit.jsonl")
+
+
+def _digest(prev, entry):
+    body = json.dumps(entry, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256((prev + body).encode("utf-8")).hexdigest()
+
+
+def _snapshots(store):
+    """Index entries of the snapshots of `store`, oldest first."""
+    if not os.path.exists(SNAPSHOT_INDEX):
+        return []
+    snaps = []
+    with open(SNAPSHOT_INDEX, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry["store"] == store:
+                snaps.append(entry)
+    return snaps
+
+
+def _last_line(path):
+    """The last complete line of `path`, read from the end of the file."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        block = 64 * 1024
+        while True:
+            start = max(0, end - block)
+            f.seek(start)
+            lines = f.read(end - start).splitlines()
+            if len(lines) > 1 or start == 0:
+                return lines[-1].decode("utf-8") if lines else ""
+            block *= 2
+
+
+def _tail(store):
+    if store not in _tails:
+        seq, digest = 0, GENESIS
+        path = log_path(store)
+        if os.path.exists(path) and os.path.getsize(path):
+            last = json.loads(_last_line(path))
+            seq, digest = last["seq"], last["hash"]
+        snaps = _snapshots(store)
+        _tails[store] = {"seq": seq, "hash": digest, "snapshot_seq": snaps[-1]["seq"] if snaps else None}
+    return _tails[store]
+
+
+def has_baseline(store):
+    return _tail(store)["snapshot_seq"] is not None
+
+
+def write_snapshot(store, state):
+    """Store `state` ({"rows": [...], "deleted": [...]}) as the snapshot at the current end of the log."""
+    with audit_lock:
+        tail = _tail(store)
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        path = log_path(store)
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        name = f"{store}-{tail['seq']:012d}.json.gz"
+        payload = json.dumps({"rows": state["rows"], "deleted": sorted(state["deleted"])}, default=str).encode("utf-8")
+        with gzip.open(os.path.join(SNAPSHOT_DIR, name + ".tmp"), "wb") as f:
+            f.write(payload)
+        os.replace(os.path.join(SNAPSHOT_DIR, name + ".tmp"), os.path.join(SNAPSHOT_DIR, name))
+        entry = {"store": store, "seq": tail["seq"], "hash": tail["hash"], "offset": offset, "file": name,
+                 "sha256": hashlib.sha256(payload).hexdigest(),
+                 "at": datetime.now().isoformat(timespec="seconds"), "rows": len(state["rows"])}
+        with open(SNAPSHOT_INDEX, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        tail["snapshot_seq"] = tail["seq"]
+        return entry
+
+
+def record(store, op, user=None, **payload):
+    """Append one event to the log of `store` and return it."""
+    with audit_lock:
+        tail = _tail(store)
+        entry = {"seq": tail["seq"] + 1, "at": datetime.now().isoformat(timespec="seconds"),
+                 "op": op, "user": user, **payload, "prev": tail["hash"]}
+        entry["hash"] = _digest(tail["hash"], entry)
+        os.makedirs(AUDIT_DIR, exist_ok=True)
+        with open(log_path(store), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        tail["seq"], tail["hash"] = entry["seq"], entry["hash"]
+        if tail["snapshot_seq"] is not None and tail["seq"] - tail["snapshot_seq"] >= SNAPSHOT_EVERY:
+            write_snapshot(store, state_at(store))
+        return entry
+
+
+def _keyed(row, keys):
+    return tuple(str(row.get(k)) for k in keys) if keys else json.dumps(row, sort_keys=True, default=str)
+
+
+def _row_day(row):
+    try:
+        return datetime.strptime(str(row.get("date")), "%d-%m-%Y").date()
+    except ValueError:
+        return None
+
+
+def apply_event(state, event):
+    """Apply one logged event to a reconstructed state in place."""
+    rows, deleted = state["rows"], state["deleted"]
+    op = event["op"]
+    if op == "create":
+        rows.extend(dict(r) for r in event["rows"])
+    elif op == "amend":
+        for row in rows:
+            if str(row.get("bill_no")) == event["bill_no"]:
+                row.update(event["values"])
+    elif op == "delete":
+        deleted.update(event["bill_nos"])
+    elif op == "restore":
+        deleted.difference_update(event["bill_nos"])
+    elif op == "clear":
+        rows[:] = [r for r in rows if str(r.get("bill_type", "")).lower() != event["bill_type"]]
+    elif op == "archive":
+        first, last = date.fromisoformat(event["first"]), date.fromisoformat(event["last"])
+        rows[:] = [r for r in rows if not first <= (_row_day(r) or date.min) <= last]
+    elif op == "compact":
+        expired = set(event.get("expired", []))
+        kept = [r for r in rows if str(r.get("bill_no")) not in expired]
+        deleted.difference_update(expired)
+        keys = event.get("dedup_keys")  # None: only rows identical in every column are duplicates
+        last = {_keyed(r, keys): i for i, r in enumerate(kept)}
+        rows[:] = [r for i, r in enumerate(kept) if last[_keyed(r, keys)] == i]
+
+
+def _load_snapshot(snap):
+    with gzip.open(os.path.join(SNAPSHOT_DIR, snap["file"]), "rb") as f:
+        payload = f.read()
+    if hashlib.sha256(payload).hexdigest() != snap["sha256"]:
+        raise AuditError(f"snapshot {snap['file']} does not match its checksum")
+    data = json.loads(payload)
+    return {"rows": data["rows"], "deleted": set(data["deleted"])}
+
+
+def _parse_at(at):
+    """`at` as a naive local datetime, the way event and snapshot times are logged."""
+    if at is None:
+        return None
+    if not isinstance(at, datetime):
+        at = datetime.fromisoformat(str(at))
+    if at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)
+    return at
+
+
+def state_at(store, at=None):
+    """Rebuild `store` as it was at `at` (a datetime or ISO string; None for now).
+
+    Returns {"rows", "deleted", "seq", "snapshot_seq", "replayed"}; "rows" still includes
+    deleted bills, see visible_rows().
+    """
+    at = _parse_at(at)
+    snaps = [s for s in _snapshots(store) if at is None or datetime.fromisoformat(s["at"]) <= at]
+    if not snaps:
+        raise AuditError(f"no snapshot of {store} at or before {at}")
+    snap = snaps[-1]
+    state = _load_snapshot(snap)
+    state.update(seq=snap["seq"], snapshot_seq=snap["seq"], replayed=0)
+    path = log_path(store)
+    if not os.path.exists(path):
+        return state
+    with open(path, encoding="utf-8") as f:
+        f.seek(snap["offset"])
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                break  # torn last line
+            if at is not None and datetime.fromisoformat(event["at"]) > at:
+                break
+            apply_event(state, event)
+            state["seq"] = event["seq"]
+            state["replayed"] += 1
+    return state
+
+
+def visible_rows(state):
+    """Rows of a reconstructed state that were not deleted at that time."""
+    return [r for r in state["rows"] if str(r.get("bill_no")) not in state["deleted"]]
+
+
+def events(store, bill_no=None, since=None):
+    """Logged events of `store`, optionally only those about `bill_no` or after `since`."""
+    since = _parse_at(since)
+    path = log_path(store)
+    if not os.path.exists(path):
+        return []
+    found = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                break
+            if since is not None and datetime.fromisoformat(event["at"]) < since:
+                continue
+            if bill_no is not None and not _mentions(event, str(bill_no)):
+                continue
+            found.append(event)
+    return found
+
+
+def _mentions(event, bill_no):
+    if event.get("bill_no") == bill_no or bill_no in event.get("bill_nos", []):
+        return True
+    return any(str(r.get("bill_no")) == bill_no for r in event.get("rows", []))
+
+
+def verify(store):
+    """Check the hash chain of `store` and the checksums of its snapshots.
+
+    Returns {"store", "events", "snapshots", "ok", "error"}.
+    """
+    result = {"store": store, "events": 0, "snapshots": 0, "ok": True, "error": None}
+    chain = {0: GENESIS}
+    path = log_path(store)
+    prev, expected_seq = GENESIS, 1
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for lineno, line in enumerate(f, 1):
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    return dict(result, ok=False, error=f"line {lineno} is not valid JSON")
+                digest = event.pop("hash", None)
+                if event.get("seq") != expected_seq or event.get("prev") != prev:
+                    return dict(result, ok=False, error=f"chain broken at line {lineno} (seq {event.get('seq')})")
+                if _digest(prev, event) != digest:
+                    return dict(result, ok=False, error=f"event seq {event['seq']} does not match its hash")
+                prev, expected_seq = digest, expected_seq + 1
+                chain[event["seq"]] = digest
+                result["events"] += 1
+    for snap in _snapshots(store):
+        if chain.get(snap["seq"]) != snap["hash"]:
+            return dict(result, ok=False, error=f"snapshot {snap['file']} does not belong to this log")
+        try:
+            _load_snapshot(snap)
+        except (OSError, AuditError) as e:
+            return dict(result, ok=False, error=str(e))
+        result["snapshots"] += 1
+    return result
+
+
+def known_stores():
+    stores = set()
+    if os.path.isdir(AUDIT_DIR):
+        stores.update(n[:-len(".audit.jsonl")] for n in os.listdir(AUDIT_DIR) if n.endswith(".audit.jsonl"))
+    if os.path.exists(SNAPSHOT_INDEX):
+        with open(SNAPSHOT_INDEX, encoding="utf-8") as f:
+            stores.update(json.loads(line)["store"] for line in f if line.strip())
+    return sorted(stores)
+
+
+# Short names accepted on the command line
+STORE_ALIASES = {"sale": "sale_bills", "purchase": "purchase_bills", "transport": "bills"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=".", help="folder the app keeps its stores in")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("verify", help="check the hash chains and snapshot checksums")
+    state = sub.add_parser("state", help="rebuild a store as it was at a point in time")
+    state.add_argument("store", help="sale, purchase, transport or a store name")
+    state.add_argument("--at", help="ISO date/time, e.g. 2025-11-01T18:00 (default: now)")
+    state.add_argument("--csv", help="write the rows to this CSV file instead of printing a summary")
+    history = sub.add_parser("history", help="every logged event that touched a bill")
+    history.add_argument("bill_no")
+    sub.add_parser("snapshot", help="take a snapshot of every store now")
+    args = parser.parse_args(argv)
+    os.chdir(args.dir)
+
+    if args.command == "verify":
+        bad = False
+        for store in known_stores():
+            r = verify(store)
+            bad |= not r["ok"]
+            print(f"{store:<16} {r['events']:>7} events {r['snapshots']:>4} snapshots  "
+                  + ("OK" if r["ok"] else "FAILED: " + r["error"]))
+        sys.exit(1 if bad else 0)
+
+    if args.command == "state":
+        store = STORE_ALIASES.get(args.store, args.store)
+        started = datetime.now()
+        st = state_at(store, args.at)
+        rows = visible_rows(st)
+        took = (datetime.now() - started).total_seconds()
+        if args.csv:
+            import csv
+            columns = list(dict.fromkeys(k for r in rows for k in r))
+            with open(args.csv, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(rows)
+        print(f"{store} at {args.at or 'now'}: {len(rows)} bills (log seq {st['seq']}, snapshot {st['snapshot_seq']} "
+              f"+ {st['replayed']} events replayed in {took * 1000:.0f} ms)" + (f", written to {args.csv}" if args.csv else ""))
+        return
+
+    if args.command == "history":
+        for store in known_stores():
+            for event in events(store, bill_no=args.bill_no):
+                detail = event.get("values") or event.get("bill_nos") or len(event.get("rows", []))
+                print(f"{event['at']}  {store:<16} #{event['seq']:<6} {event['op']:<8} {event.get('user') or '':<10} {detail}")
+        return
+
+    if args.command == "snapshot":
+        for store in known_stores():
+            snap = write_snapshot(store, state_at(store))
+            print(f"{store}: snapshot at seq {snap['seq']} ({snap['rows']} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""Incremental, deduplicated backups of the bill data to a local folder.
+
+The data (bill stores, their journals and histories, archived years, the audit log, users and
+the bill counter) is cut into content-defined chunks. Each chunk is stored once, zlib-compressed,
+under chunks/<first two hex digits>/<sha256>. A backup is a manifest in snapshots/ listing the chunks
+of every file. Files whose size and modification time match the previous backup are not read
+again. A bill appended to a store changes only the chunks around it, so each backup adds
+little to the folder.
+
+Backups read the files without taking the app's lock. If a file changes while it is being
+read, or a workbook is caught half written, the whole set is read again. Bill entry never
+waits for a backup.
+
+    python backup.py create
+    python backup.py list
+    python backup.py verify
+    python backup.py drill
+    python backup.py restore 20251026-180000 --to restored/
+    python backup.py prune --keep 30
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from bill_store import ARCHIVE_DIR, BILL_FILES, journal_path, history_path
+from audit_log import AUDIT_DIR
+
+# Backups go outside the OneDrive folder the app runs in, unless BILLING_BACKUP_DIR says otherwise
+DEFAULT_REPO = os.environ.get("BILLING_BACKUP_DIR") or os.path.join(os.path.expanduser("~"), "BillingBackups")
+
+# Files kept next to the stores that are not bill stores themselves
+EXTRA_FILES = ["bill_counter.txt", "users.json", "users.xlsx", "idempotency_keys.jsonl"]
+
+# Content-defined chunking: a chunk ends where the rolling hash of the last WINDOW bytes has its
+# low bits all zero (about every 64 KB), but never before MIN_CHUNK or after MAX_CHUNK bytes
+WINDOW = 64
+CHUNK_MASK = (1 << 16) - 1
+MIN_CHUNK = 16 * 1024
+MAX_CHUNK = 256 * 1024
+SCAN_BLOCK = 1024 * 1024
+_GEAR = np.random.default_rng(20250918).integers(0, 2 ** 63, 256, dtype=np.uint64)
+
+# Tries at reading every file without any of them changing in between
+READ_ATTEMPTS = 5
+
+# prune() leaves chunks this recent alone, since a backup running at the same time may need them
+GC_GRACE_SECONDS = 3600
+
+
+class BackupError(Exception):
+    """A backup could not be taken, or a stored one is damaged."""
+
+
+def data_files(root="."):
+    """Paths (relative to `root`, with / separators) of every file a backup covers."""
+    names = []
+    for store in BILL_FILES:
+        names += [store, journal_path(store), history_path(store)]
+    names += EXTRA_FILES
+    found = [n for n in names if os.path.isfile(os.path.join(root, n))]
+    for folder in (AUDIT_DIR, ARCHIVE_DIR):
+        for dirpath, _, filenames in os.walk(os.path.join(root, folder)):
+            for name in filenames:
+                if not name.endswith(".tmp"):
+                    found.append(os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "/"))
+    return sorted(found)
+
+
+def chunk_ends(data):
+    """End offsets of the content-defined chunks of `data`."""
+    n = len(data)
+    if n <= MIN_CHUNK:
+        return [n] if n else []
+    arr = np.frombuffer(data, dtype=np.uint8)
+    candidates = []
+    for start in range(0, n, SCAN_BLOCK):
+        lo = max(0, start - WINDOW)
+        sums = np.concatenate((np.zeros(1, dtype=np.uint64), np.cumsum(_GEAR[arr[lo:start + SCAN_BLOCK]], dtype=np.uint64)))
+        first = max(start, WINDOW - 1) - lo  # first window end inside this block, in block coordinates
+        # Sum of the gear values of the WINDOW bytes ending at each position; uint64 wraps, which is fine
+        window = sums[first + 1:] - sums[first + 1 - WINDOW:len(sums) - WINDOW]
+        candidates.append(np.flatnonzero((window & np.uint64(CHUNK_MASK)) == 0) + lo + first + 1)
+    ends, pos = [], 0
+    for end in np.concatenate(candidates).tolist():
+        if end - pos < MIN_CHUNK:
+            continue
+        while end - pos > MAX_CHUNK:
+            pos += MAX_CHUNK
+            ends.append(pos)
+        ends.append(end)
+        pos = end
+    while n - pos > MAX_CHUNK:
+        pos += MAX_CHUNK
+        ends.append(pos)
+    if pos < n:
+        ends.append(n)
+    return ends
+
+
+def _chunk_path(repo, digest):
+    return os.path.join(repo, "chunks", digest[:2], digest)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _put_chunk(repo, chunk):
+    """Store `chunk` unless the repo already has it; returns (digest, compressed bytes written)."""
+    digest = hashlib.sha256(chunk).hexdigest()
+    path = _chunk_path(repo, digest)
+    if os.path.exists(path):
+        return digest, 0
+    packed = zlib.compress(chunk, 6)
+    _write_atomic(path, packed)
+    return digest, len(packed)
+
+
+def _get_chunk(repo, digest):
+    with open(_chunk_path(repo, digest), "rb") as f:
+        chunk = zlib.decompress(f.read())
+    if hashlib.sha256(chunk).hexdigest() != digest:
+        raise BackupError(f"chunk {digest} is damaged")
+    return chunk
+
+
+def snapshots(repo):
+    """Manifest ids of the backups in `repo`, oldest first."""
+    folder = os.path.join(repo, "snapshots")
+    if not os.path.isdir(folder):
+        return []
+    return sorted(n[:-len(".json")] for n in os.listdir(folder) if n.endswith(".json"))
+
+
+def load_manifest(repo, snapshot_id):
+    with open(os.path.join(repo, "snapshots", snapshot_id + ".json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _stats(root, names):
+    stats = {}
+    for name in names:
+        try:
+            st = os.stat(os.path.join(root, name))
+            stats[name] = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            stats[name] = None
+    return stats
+
+
+def _read_consistent(root, previous):
+    """({name: (size, mtime_ns)}, {name: bytes}) for every data file, read so that no file changed
+    while the set was being read. Files unchanged since `previous` (manifest entries by name) are
+    not read at all."""
+    for attempt in range(READ_ATTEMPTS):
+        names = data_files(root)
+        before = _stats(root, names)
+        contents = {}
+        for name in names:
+            old = previous.get(name)
+            if before[name] is None or (old and (old["size"], old["mtime_ns"]) == before[name]):
+                continue
+            try:
+                with open(os.path.join(root, name), "rb") as f:
+                    contents[name] = f.read()
+            except FileNotFoundError:
+                pass  # removed since the listing; the second stat below notices and retries
+        if _stats(root, names) == before and all(_complete(n, d) for n, d in contents.items()):
+            return {n: s for n, s in before.items() if s is not None}, contents
+        time.sleep(0.2 * (attempt + 1))
+    raise BackupError(f"data files kept changing during {READ_ATTEMPTS} attempts; try again")
+
+
+def _complete(name, data):
+    """False for a workbook caught in the middle of being written."""
+    if not name.endswith(".xlsx"):
+        return True
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            return z.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+
+def create(repo=DEFAULT_REPO, root="."):
+    """Back up the data files in `root` to `repo` and return the new manifest."""
+    t0 = time.perf_counter()
+    ids = snapshots(repo)
+    previous = {f["path"]: f for f in load_manifest(repo, ids[-1])["files"]} if ids else {}
+    stats, contents = _read_consistent(root, previous)
+
+    files, new_chunks, stored = [], 0, 0
+    for name, (size, mtime_ns) in sorted(stats.items()):
+        if name not in contents:
+            files.append(previous[name])
+            continue
+        data = contents[name]
+        chunks, pos = [], 0
+        for end in chunk_ends(data):
+            digest, written = _put_chunk(repo, data[pos:end])
+            chunks.append([digest, end - pos])
+            new_chunks += bool(written)
+            stored += written
+            pos = end
+        files.append({"path": name, "size": size, "mtime_ns": mtime_ns,
+                      "sha256": hashlib.sha256(data).hexdigest(), "chunks": chunks})
+
+    snapshot_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    n = 2
+    while snapshot_id in ids:
+        snapshot_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{n}"
+        n += 1
+    manifest = {
+        "id": snapshot_id,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "source": os.path.abspath(root),
+        "files": files,
+        "total_bytes": sum(f["size"] for f in files),
+        "files_read": len(contents),
+        "new_chunks": new_chunks,
+        "stored_bytes": stored,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+    # The manifest goes last: a backup interrupted before this point leaves only unreferenced chunks
+    _write_atomic(os.path.join(repo, "snapshots", snapshot_id + ".json"), json.dumps(manifest, indent=1).encode("utf-8"))
+    return manifest
+
+
+def verify(repo=DEFAULT_REPO, snapshot_id=None):
+    """Check every chunk of one backup (default: all of them) against its checksum and every file
+    against its own. Returns {"snapshots", "chunks", "bytes", "errors"}."""
+    ids = [snapshot_id] if snapshot_id else snapshots(repo)
+    checked, errors, total = set(), [], 0
+    for sid in ids:
+        try:
+            manifest = load_manifest(repo, sid)
+        except (OSError, ValueError) as e:
+            errors.append(f"{sid}: manifest unreadable ({e})")
+            continue
+        for entry in manifest["files"]:
+            digest = hashlib.sha256()
+            try:
+                for chunk_digest, size in entry["chunks"]:
+                    chunk = _get_chunk(repo, chunk_digest)
+                    if len(chunk) != size:
+                        raise BackupError(f"chunk {chunk_digest} has the wrong size")
+                    digest.update(chunk)
+                    if chunk_digest not in checked:
+                        checked.add(chunk_digest)
+                        total += size
+            except (OSError, zlib.error, BackupError) as e:
+                errors.append(f"{sid}: {entry['path']}: {e}")
+                continue
+            if digest.hexdigest() != entry["sha256"]:
+                errors.append(f"{sid}: {entry['path']} does not match its checksum")
+    return {"snapshots": len(ids), "chunks": len(checked), "bytes": total, "errors": errors}
+
+
+def restore(repo, snapshot_id, target, force=False):
+    """Write the files of backup `snapshot_id` into the folder `target`; returns the manifest.
+
+    Refuses to overwrite files that already exist in `target` unless `force` is set, so a
+    restore cannot clobber the live stores by accident.
+    """
+    manifest = load_manifest(repo, snapshot_id)
+    existing = [f["path"] for f in manifest["files"] if os.path.exists(os.path.join(target, f["path"]))]
+    if existing and not force:
+        raise BackupError(f"{target} already has {', '.join(existing[:3])}{'...' if len(existing) > 3 else ''}; use --force to overwrite")
+    for entry in manifest["files"]:
+        path = os.path.join(target, *entry["path"].split("/"))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        digest = hashlib.sha256()
+        with open(path + ".tmp", "wb") as f:
+            for chunk_digest, _ in entry["chunks"]:
+                chunk = _get_chunk(repo, chunk_digest)
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if digest.hexdigest() != entry["sha256"]:
+            os.remove(path + ".tmp")
+            raise BackupError(f"{entry['path']} restored from {snapshot_id} does not match its checksum")
+        if os.path.exists(path):
+            os.chmod(path, 0o644)  # archived years are read-only
+        os.replace(path + ".tmp", path)
+        os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+    return manifest
+
+
+def drill(repo=DEFAULT_REPO, snapshot_id=None):
+    """Restore a backup (default: the latest) into a scratch folder, open every bill store in it,
+    and time both steps. The result is appended to drills.jsonl in the repo and returned."""
+    import xlsx_reader
+
+    snapshot_id = snapshot_id or (snapshots(repo) or [None])[-1]
+    if not snapshot_id:
+        raise BackupError(f"no backups in {repo}")
+    scratch = tempfile.mkdtemp(prefix="billing-restore-drill-")
+    result = {"snapshot": snapshot_id, "at": datetime.now().isoformat(timespec="seconds"), "ok": False}
+    try:
+        t0 = time.perf_counter()
+        manifest = restore(repo, snapshot_id, scratch)
+        result["restore_seconds"] = round(time.perf_counter() - t0, 3)
+        result["files"] = len(manifest["files"])
+        result["bytes"] = manifest["total_bytes"]
+        t0 = time.perf_counter()
+        result["rows"] = {}
+        for store in BILL_FILES:
+            path = os.path.join(scratch, store)
+            if os.path.exists(path):
+                result["rows"][store] = len(xlsx_reader.read_xlsx(path))
+        result["open_seconds"] = round(time.perf_counter() - t0, 3)
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(repo, exist_ok=True)
+    with open(os.path.join(repo, "drills.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+    return result
+
+
+def prune(repo=DEFAULT_REPO, keep=30):
+    """Delete all but the newest `keep` backups and the chunks no remaining backup uses.
+
+    Returns (backups removed, chunks removed, bytes freed).
+    """
+    ids = snapshots(repo)
+    doomed = ids[:-keep] if keep else ids
+    for sid in doomed:
+        os.remove(os.path.join(repo, "snapshots", sid + ".json"))
+    used = {c[0] for sid in snapshots(repo) for f in load_manifest(repo, sid)["files"] for c in f["chunks"]}
+    removed, freed = 0, 0
+    cutoff = time.time() - GC_GRACE_SECONDS
+    chunk_root = os.path.join(repo, "chunks")
+    for dirpath, _, filenames in os.walk(chunk_root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if name not in used and os.path.getmtime(path) < cutoff:
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+    return len(doomed), removed, freed
+
+
+def _mb(n):
+    return f"{n / 1024 / 1024:.2f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repo", default=DEFAULT_REPO, help=f"backup folder (default {DEFAULT_REPO})")
+    parser.add_argument("--data", default=".", help="folder the app keeps its stores in")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("create", help="take a backup now")
+    sub.add_parser("list", help="list the backups")
+    check = sub.add_parser("verify", help="check the chunks and files of one or all backups")
+    check.add_argument("snapshot", nargs="?")
+    run_drill = sub.add_parser("drill", help="restore into a scratch folder, open the stores, report the time")
+    run_drill.add_argument("snapshot", nargs="?")
+    back = sub.add_parser("restore", help="restore a backup into a folder")
+    back.add_argument("snapshot")
+    back.add_argument("--to", required=True, help="folder to restore into")
+    back.add_argument("--force", action="store_true", help="overwrite files that exist there")
+    trim = sub.add_parser("prune", help="delete old backups and unused chunks")
+    trim.add_argument("--keep", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "create":
+            m = create(args.repo, args.data)
+            print(f"Backup {m['id']}: {len(m['files'])} files, {_mb(m['total_bytes'])}; read {m['files_read']} changed files, "
+                  f"stored {m['new_chunks']} new chunks ({_mb(m['stored_bytes'])}) in {m['seconds']} s")
+        elif args.command == "list":
+            for sid in snapshots(args.repo):
+                m = load_manifest(args.repo, sid)
+                print(f"{sid}  {len(m['files']):>3} files  {_mb(m['total_bytes']):>10}  +{_mb(m['stored_bytes'])}")
+        elif args.command == "verify":
+            r = verify(args.repo, args.snapshot)
+            print(f"{r['snapshots']} backups, {r['chunks']} chunks ({_mb(r['bytes'])}) checked: "
+                  + ("OK" if not r["errors"] else f"{len(r['errors'])} problems"))
+            for error in r["errors"]:
+                print("  " + error)
+            sys.exit(1 if r["errors"] else 0)
+        elif args.command == "drill":
+            r = drill(args.repo, args.snapshot)
+            if not r["ok"]:
+                print(f"Restore drill of {r['snapshot']} FAILED: {r['error']}")
+                sys.exit(1)
+            rows = ", ".join(f"{k}: {v}" for k, v in r["rows"].items())
+            print(f"Restore drill of {r['snapshot']}: {r['files']} files ({_mb(r['bytes'])}) restored in "
+                  f"{r['restore_seconds']} s, stores opened in {r['open_seconds']} s ({rows})")
+        elif args.command == "restore":
+            m = restore(args.repo, args.snapshot, args.to, args.force)
+            print(f"Restored {len(m['files'])} files of {m['id']} into {args.to}")
+        elif args.command == "prune":
+            backups, chunks, freed = prune(args.repo, args.keep)
+            print(f"Removed {backups} backups and {chunks} unused chunks ({_mb(freed)})")
+    except (BackupError, OSError) as e:
+        print(f"Backup {args.command} failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Deterministic synthetic bill data for benchmarks.
+
+Produces sale, purchase and transport tables with the same columns the routes in app.py
+write, with skewed (Zipf-like) popularity of mills, farmers, villages and lorries and a
+kharif/rabi seasonal spread of dates. The same (kind, rows, seed) always gives the same rows.
+
+    python benchmarks/datagen.py --rows 10000 --out /tmp/bench_data
+"""
+import argparse
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+MILLS = [
+    "ASHOKA RICE INDUSTRIES", "SHREE NARAYANA RICE INDUSTRIES", "NANDI RICE INDUSTRIES",
+    "NARAYANA RICE MILL", "SRI LAKSHMI RICE MILL", "VENKATESHWARA AGRO FOODS", "BASAVA RICE MILL",
+    "GANGA PARBOILED RICE MILL", "SRI RAMA RICE INDUSTRIES", "MAHALAXMI RICE MILL",
+    "KRISHNA AGRO INDUSTRIES", "SRI SAI RICE MILL", "TUNGABHADRA RICE MILL", "ANNAPURNA RICE MILL",
+    "VIJAYA RICE INDUSTRIES", "SHIVA SHAKTI RICE MILL", "RAGHAVENDRA RICE MILL", "KAVERI AGRO FOODS",
+    "HANUMAN RICE MILL", "SRI DURGA RICE INDUSTRIES",
+]
+MILL_CODES = [f"M{i + 1:02d}" for i in range(len(MILLS))]
+VILLAGES = [
+    "SAINAGAR", "KEMBHAVI", "SHORAPUR", "HUNASAGI", "SHAHAPUR", "GURMITKAL", "WADAGERA", "SAIDAPUR",
+    "KAKKERA", "HATTIKUNI", "NAIKAL", "DORANAHALLI", "RANGAMPET", "BALICHAKRA", "KONKAL", "YELHERI",
+    "MUDNAL", "ALLIPUR", "THANGADGI", "KODEKAL", "RAJANKOLLUR", "DEVAPUR", "SIRUGUPPA", "SINDHANUR",
+    "MANVI", "LINGASUGUR", "DEVADURGA", "RAICHUR", "YADGIR", "HOSPET",
+]
+FIRST_NAMES = [
+    "ARJUN", "BASAVARAJ", "CHANNAPPA", "DEVAPPA", "ESHWAR", "GANGADHAR", "HANUMANTH", "IRANNA",
+    "JAGADISH", "KALLAPPA", "LAXMAN", "MALLIKARJUN", "NINGAPPA", "PARAMESH", "RAMESH", "SHARANAPPA",
+    "SIDDAPPA", "THIPPANNA", "UMESH", "VEERESH", "VIJAYREDDY", "YALLAPPA", "MAHADEV", "SANGAPPA",
+]
+LAST_NAMES = [
+    "PATIL", "GOUDA", "REDDY", "NAIK", "KULKARNI", "HIREMATH", "BIRADAR", "POLICE PATIL", "DESAI",
+    "MALI", "HOSAMANI", "KATTIMANI", "TALWAR", "MUDHOL", "JOSHI", "HUGAR",
+]
+RICE_TYPES = ["RNR", "SONA MASURI", "BPT", "HMT", "PADDY", "IR64", "KAVERI SONA", "GANGAVATHI SONA"]
+RICE_WEIGHTS = [30, 25, 12, 10, 10, 6, 4, 3]
+STATE_CODES = ["KA 33", "KA 32", "KA 36", "TS 05", "TS 34", "TS 35", "AP 21"]
+
+# Relative bill volume per calendar month (Apr..Mar): kharif harvest Oct-Dec, rabi Apr-May
+MONTH_WEIGHTS = {4: 8, 5: 7, 6: 2, 7: 1, 8: 1, 9: 3, 10: 12, 11: 16, 12: 14, 1: 8, 2: 4, 3: 4}
+
+# Keep per-day bill counts well under the 3-digit sequence of the bill numbers
+BILLS_PER_DAY = 120
+
+
+def _zipf_weights(n, s=1.1):
+    w = 1.0 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+
+def _people(rng, n):
+    first = rng.choice(FIRST_NAMES, n)
+    last = rng.choice(LAST_NAMES, n)
+    return np.char.add(np.char.add(first.astype(str), " "), last.astype(str))
+
+
+def _lorries(rng, n):
+    states = rng.choice(STATE_CODES, n)
+    series = rng.choice(list("ABCDEFGHJK"), n)
+    nums = rng.integers(1000, 9999, n)
+    return np.array([f"{s} {a} {d}" for s, a, d in zip(states, series, nums)])
+
+
+def _dates(rng, rows, start):
+    """Sorted dates spread over enough days for `rows` bills, weighted by season."""
+    days = max(30, -(-rows // (BILLS_PER_DAY // 2)))
+    calendar = pd.date_range(start, periods=days, freq="D")
+    weights = np.array([MONTH_WEIGHTS[d.month] for d in calendar], dtype=float)
+    picks = rng.choice(days, rows, p=weights / weights.sum())
+    picks.sort()
+    return calendar[picks]
+
+
+def _bill_numbers(prefix, dates):
+    day_str = dates.strftime("%Y%m%d")
+    seq = pd.Series(day_str).groupby(day_str).cumcount().to_numpy() + 1
+    return np.array([f"{prefix}-{d}-{str(n).zfill(3)}" for d, n in zip(day_str, seq)])
+
+
+def generate(kind, rows, seed=42, start=date(2023, 4, 1)):
+    """Return a DataFrame of `rows` synthetic bills of `kind` ("sale", "purchase" or "transport")."""
+    rng = np.random.default_rng([seed, ["sale", "purchase", "transport"].index(kind)])
+    dates = _dates(rng, rows, start)
+    farmers = _people(np.random.default_rng(seed), 2000)
+    lorries = _lorries(np.random.default_rng(seed + 1), 300)
+
+    mill_idx = rng.choice(len(MILLS), rows, p=_zipf_weights(len(MILLS)))
+    mills = np.array(MILLS)[mill_idx]
+    farmer = farmers[rng.choice(len(farmers), rows, p=_zipf_weights(len(farmers), 0.8))]
+    village = np.array(VILLAGES)[rng.choice(len(VILLAGES), rows, p=_zipf_weights(len(VILLAGES)))]
+    lorry = lorries[rng.choice(len(lorries), rows, p=_zipf_weights(len(lorries), 0.9))]
+    rice = rng.choice(RICE_TYPES, rows, p=np.array(RICE_WEIGHTS) / sum(RICE_WEIGHTS))
+    bags = np.clip(rng.normal(520, 90, rows).round(), 50, 800).astype(int)
+    ntwt = (bags * rng.normal(75.5, 1.5, rows)).round().astype(int)
+    date_str = dates.strftime("%d-%m-%Y")
+
+    if kind == "sale":
+        calc_type = rng.choice([1, 2, 3], rows, p=[0.5, 0.4, 0.1])
+        sut_rate = np.where(calc_type == 2, rng.choice([1, 2], rows), 0)
+        stwt = bags * sut_rate
+        net_bags = np.select(
+            [calc_type == 1, calc_type == 2],
+            [ntwt / 77, (ntwt - stwt) / 75],
+            (ntwt - (ntwt / 1000) * 5) / 100,
+        )
+        price = rng.integers(1800, 2600, rows)
+        amount = net_bags * price
+        commission = np.where(rng.random(rows) < 0.6, amount / 100, 0)
+        hamali = bags * np.where(rng.random(rows) < 0.5, rng.choice([3, 4, 5], rows), 0)
+        gunny = bags * np.where(rng.random(rows) < 0.3, rng.choice([20, 25], rows), 0)
+        advance = np.where(rng.random(rows) < 0.4, rng.choice([2000, 5000, 10000], rows), 0)
+        rmc = np.where(rng.random(rows) < 0.2, (amount * 0.006).round(), 0)
+        return pd.DataFrame({
+            "bill_type": "Sale",
+            "bill_no": _bill_numbers("SB", dates),
+            "date": date_str,
+            "mill_name": mills,
+            "mill_code": np.array(MILL_CODES)[mill_idx],
+            "farmer_name": farmer,
+            "rice_type": rice,
+            "bags": bags,
+            "ntwt": ntwt.astype(float),
+            "stwt": stwt.round(2),
+            "sut_rate": sut_rate.astype(float),
+            "price": price.astype(float),
+            "net_bags": net_bags.round(2),
+            "amount": amount.round(2),
+            "commission": commission.round(2),
+            "hamali": hamali.round(2).astype(float),
+            "gunny": gunny.round(2).astype(float),
+            "advance": advance.astype(float),
+            "rmc": rmc.astype(float),
+            "grand_total": (amount + commission + hamali + gunny + advance + rmc).round(2),
+            "lorry_no": lorry,
+            "mobile_no": rng.integers(6000000000, 9999999999, rows),
+        })
+
+    if kind == "purchase":
+        sut_rate = rng.choice([1.0, 1.5, 2.0], rows)
+        stwt = bags * sut_rate
+        total_ntwt = (ntwt - stwt) / 75
+        rate = rng.integers(1700, 2400, rows).astype(float)
+        amount = total_ntwt * rate
+        hamali = rng.choice([3.0, 4.0, 5.0, 8.0], rows) * bags
+        weigh_bridge = rng.choice([100.0, 150.0, 200.0], rows)
+        return pd.DataFrame({
+            "bill_type": "Purchase",
+            "bill_no": _bill_numbers("PB", dates),
+            "date": date_str,
+            "farmer_name": farmer,
+            "village_name": village,
+            "mill_name": mills,
+            "rice_type": rice,
+            "bags": bags,
+            "ntwt": ntwt.astype(float),
+            "sut_rate": sut_rate,
+            "stwt": stwt,
+            "total_ntwt": total_ntwt.round(2),
+            "rate": rate,
+            "amount": amount.round(2),
+            "hamali": hamali.round(2),
+            "weigh_bridge": weigh_bridge,
+            "grand_total": (amount - hamali - weigh_bridge).round(2),
+            "lorry_no": lorry,
+        })
+
+    if kind == "transport":
+        freight = rng.choice([950.0, 1050.0, 1150.0, 1250.0, 1400.0], rows)
+        bill_no = _bill_numbers("TB", dates)
+        return pd.DataFrame({
+            "bill_type": "Transportation",
+            "bill_no": bill_no,
+            "date": date_str,
+            "ref": bill_no,
+            "ms": mills,
+            "from_location": village,
+            "to_location": rng.choice(["HYDERABAD", "BENGALURU", "SIRUGUPPA", "RAICHUR", "KURNOOL"], rows),
+            "bags": bags,
+            "kgs": ntwt.astype(float),
+            "rice_type": rice,
+            "lorry_no": lorry,
+            "lorry_freight": freight,
+            "zero_charge": 0.0,
+            "advance": rng.choice([0.0, 2000.0, 5000.0], rows),
+            "mobile_no": rng.integers(6000000000, 9999999999, rows),
+            "freight_in_words": "",
+        })
+
+    raise ValueError(f"Unknown bill kind: {kind}")
+
+
+STORE_FILES = {"sale": "sale_bills.xlsx", "purchase": "purchase_bills.xlsx", "transport": "bills.xlsx"}
+
+
+def write_stores(directory, rows, seed=42):
+    """Write all three stores with `rows` bills each into `directory`, named like the live files."""
+    os.makedirs(directory, exist_ok=True)
+    for kind, name in STORE_FILES.items():
+        generate(kind, rows, seed).to_excel(os.path.join(directory, name), index=False, engine="openpyxl")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="bills per store (1k to 1M)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", required=True, help="directory to write the xlsx stores into")
+    args = parser.parse_args()
+    write_stores(args.out, args.rows, args.seed)
+    print(f"Wrote {args.rows} bills per store to {args.out}")
@@ -0,0 +1,136 @@
+"""Fault injection: kill the process in the middle of saving bills and check the store survives.
+
+A child process keeps appending sale bills to a store (each append rewrites the workbook) and
+deleting every other one (an append to the journal). The parent kills it at a random moment
+with SIGKILL (TerminateProcess on Windows), runs the startup recovery check and then checks
+that the store opens, that every bill written before the kill is still there exactly once,
+and that every journal line parses.
+
+--mode unsafe repeats the experiment with a plain df.to_excel() over the store, the way bills
+were saved before writes went through a temp file and a rename, for comparison.
+
+    python benchmarks/fault_injection.py --trials 20 --rows 20000
+    python benchmarks/fault_injection.py --trials 20 --rows 20000 --mode unsafe
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import datagen  # noqa: E402
+
+PREFIX = "FI-"
+
+
+def child(directory, mode):
+    """Append FI-000000, FI-000001, ... forever; tombstone the odd ones."""
+    os.chdir(directory)
+    import pandas as pd
+    import bill_store
+
+    path = bill_store.SALE_FILE
+    existing = bill_store.read_bills(path, include_deleted=True)["bill_no"].astype(str)
+    i = int(existing[existing.str.startswith(PREFIX)].str[len(PREFIX):].astype(int).max() + 1) \
+        if existing.str.startswith(PREFIX).any() else 0
+    while True:
+        row = {"bill_type": "Sale", "bill_no": f"{PREFIX}{i:06d}", "date": "26-10-2025", "mill_name": "FAULT",
+               "farmer_name": "INJECTION", "rice_type": "RNR", "bags": 1, "ntwt": 1.0, "price": 1.0}
+        if mode == "safe":
+            bill_store.append_bills(path, [row], "fault")
+            if i % 2:
+                bill_store.delete_bills(path, [row["bill_no"]], "fault")
+        else:
+            df = pd.concat([pd.read_excel(path, engine="openpyxl"), pd.DataFrame([row])], ignore_index=True)
+            df.to_excel(path, index=False, engine="openpyxl")
+        i += 1
+
+
+def check(directory):
+    """(ok, detail) for the store in `directory` after a kill."""
+    os.chdir(directory)
+    import bill_store
+
+    bill_store._table_cache.clear()
+    bill_store._journal_cache.clear()
+    bill_store._live_cache.clear()
+    report = bill_store.recover()
+    path = bill_store.SALE_FILE
+    try:
+        df = bill_store.read_bills(path, include_deleted=True)
+    except bill_store.StoreCorruptError as e:
+        return False, f"store unreadable: {str(e)[:80]}", report
+    numbers = df["bill_no"].astype(str)
+    written = sorted(numbers[numbers.str.startswith(PREFIX)])
+    expected = [f"{PREFIX}{i:06d}" for i in range(len(written))]
+    if written != expected:
+        return False, f"{len(written)} test bills, but not FI-000000..{len(written) - 1:06d} exactly once", report
+    jpath = bill_store.journal_path(path)
+    if os.path.exists(jpath):
+        with open(jpath, encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                try:
+                    json.loads(line)
+                except ValueError:
+                    return False, f"journal line {n} does not parse", report
+    return True, f"{len(written)} test bills intact", report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=20000, help="size of the store being rewritten")
+    parser.add_argument("--mode", choices=["safe", "unsafe"], default="safe")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.mode)
+        return
+
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp(prefix="billing-fault-")
+    datagen.generate("sale", args.rows).to_excel(os.path.join(directory, "sale_bills.xlsx"), index=False, engine="openpyxl")
+    good = os.path.join(directory, "last_good.xlsx")
+    shutil.copy(os.path.join(directory, "sale_bills.xlsx"), good)
+    # Rough time of one save, so kills land anywhere within a write
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import pandas as pd, sys; "
+                    "pd.read_excel(sys.argv[1], engine='openpyxl').to_excel(sys.argv[2], index=False, engine='openpyxl')",
+                    good, os.path.join(directory, "probe.xlsx")], check=True)
+    save_seconds = time.perf_counter() - started
+    os.remove(os.path.join(directory, "probe.xlsx"))
+    print(f"Store of {args.rows} bills in {directory}; one save takes about {save_seconds:.1f} s; mode {args.mode}")
+
+    failures, mid_write = 0, 0
+    for trial in range(1, args.trials + 1):
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", directory, "--mode", args.mode])
+        time.sleep(save_seconds * rng.uniform(1.5, 4.0))
+        proc.kill()
+        proc.wait()
+        torn = os.path.exists(os.path.join(directory, "sale_bills.xlsx.tmp"))
+        mid_write += torn
+        ok, detail, report = check(directory)
+        failures += not ok
+        repaired = len(report["removed"]) + len(report["trimmed"])
+        print(f"trial {trial:>3}: {'OK  ' if ok else 'FAIL'} {detail}"
+              + (" (killed mid-write)" if torn else "") + (f", recovery cleaned {repaired} file(s)" if repaired else ""))
+        if ok:
+            shutil.copy(os.path.join(directory, "sale_bills.xlsx"), good)
+        else:
+            shutil.copy(good, os.path.join(directory, "sale_bills.xlsx"))  # carry on from the last good store
+    print(f"{args.trials} kills ({mid_write} with a write in progress): {failures} damaged or inconsistent stores")
+    shutil.rmtree(directory, ignore_errors=True)
+    sys.exit(1 if failures and args.mode == "safe" else 0)
+
+
+if __name__ == "__main__":
+    main()
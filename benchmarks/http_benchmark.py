@@ -0,0 +1,217 @@
+"""Bytes on the wire and page latency over a slow link, with and without compression and 304s.
+
+Starts the app on synthetic stores in a scratch folder, behind a local TCP proxy that adds the
+round-trip time and caps the bandwidth of a rural mobile connection (default 1 Mbit/s, 150 ms).
+Then fetches the view pages, the dashboard and its widgets, and an export:
+
+- identity: Accept-Encoding: identity, as before the compression middleware,
+- gzip and br: compressed (br only when the brotli package is installed),
+- revalidate: a repeat visit sending the ETag from the first one, answered 304 while the stores
+  are unchanged.
+
+    python benchmarks/http_benchmark.py --rows 10000
+    python benchmarks/http_benchmark.py --rows 10000 --kbps 256 --rtt 400
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import pandas as pd  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import datagen  # noqa: E402
+from run_benchmarks import prepare_stores  # noqa: E402
+
+USER = "bench"
+
+
+class ThrottledProxy:
+    """TCP proxy to `upstream` adding `rtt` seconds of latency and serialising each direction at
+    `bandwidth` bytes/s: a chunk arrives one-way-delay after it was sent, and no sooner than the
+    previous chunk plus its transmission time."""
+
+    def __init__(self, upstream, bandwidth, rtt):
+        self.upstream, self.bandwidth, self.one_way = upstream, bandwidth, rtt / 2
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            server = socket.create_connection(self.upstream)
+            for src, dst in ((client, server), (server, client)):
+                pending = queue.Queue()
+                threading.Thread(target=self._read, args=(src, pending), daemon=True).start()
+                threading.Thread(target=self._deliver, args=(dst, pending), daemon=True).start()
+
+    @staticmethod
+    def _read(src, pending):
+        while True:
+            try:
+                data = src.recv(16384)
+            except OSError:
+                data = b""
+            pending.put((time.perf_counter(), data))
+            if not data:
+                return
+
+    def _deliver(self, dst, pending):
+        free_at = 0.0
+        while True:
+            sent_at, data = pending.get()
+            if not data:
+                try:
+                    dst.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                return
+            free_at = max(sent_at + self.one_way, free_at) + len(data) / self.bandwidth
+            time.sleep(max(0.0, free_at - time.perf_counter()))
+            try:
+                dst.sendall(data)
+            except OSError:
+                return
+
+
+def fetch(port, path, headers):
+    """(status, bytes received incl. headers, seconds, response headers) of one GET on a new connection."""
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+    conn.request("GET", path, headers=headers)
+    resp = conn.getresponse()
+    body = resp.read()  # http.client does not decode, so this is the size on the wire
+    seconds = time.perf_counter() - t0
+    conn.close()
+    head = sum(len(k) + len(v) + 4 for k, v in resp.getheaders()) + 17
+    return resp.status, head + len(body), seconds, resp
+
+
+def login(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    conn.request("POST", "/", body=urlencode({"username": USER, "password": USER}),
+                 headers={"Content-Type": "application/x-www-form-urlencoded"})
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader("Set-Cookie", "").split(";")[0]
+    if resp.status != 302 or not cookie:
+        raise SystemExit("login failed")
+    # Show the "Login successful" flash once: pages with a message waiting are never answered 304
+    conn.request("GET", "/menu", headers={"Cookie": cookie})
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    return (resp.getheader("Set-Cookie") or cookie).split(";")[0]
+
+
+def pages(rows, seed, widgets):
+    """{name: [paths]}: what a clerk loads for each page."""
+    sales = datagen.generate("sale", rows, seed)
+    last_day = datetime.strptime(sales["date"].iloc[-1], "%d-%m-%Y")
+    month = {"from_date": (last_day - pd.Timedelta(days=30)).strftime("%Y-%m-%d"),
+             "to_date": last_day.strftime("%Y-%m-%d")}
+    mill = sales["mill_name"].mode()[0]
+    dashboard = ["/analytics"] + [f"/api/analytics/{w}" for w in widgets if w != "records"]
+    dashboard += ["/api/analytics/records?kind=sale", "/api/analytics/records?kind=purchase"]
+    return {
+        "view_sale_month": ["/view-bills?" + urlencode(month)],
+        "view_purchase_month": ["/view-purchase-bills?" + urlencode(month)],
+        "view_sale_mill": ["/view-bills?" + urlencode({"mill_name": mill})],
+        "dashboard": dashboard,
+        "export_excel_month": ["/download/sale/excel?" + urlencode(month)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="bills per synthetic store")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--kbps", type=float, default=1000, help="link bandwidth in kbit/s each way")
+    parser.add_argument("--rtt", type=float, default=150, help="round-trip time in ms")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="also write the results as JSON here")
+    args = parser.parse_args()
+
+    import app as app_module
+    import bill_store
+    import http_cache
+    logging.getLogger("billing.timing").setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    modes = {"identity": {"Accept-Encoding": "identity"}, "gzip": {"Accept-Encoding": "gzip"}}
+    if http_cache.brotli is not None:
+        modes["br"] = {"Accept-Encoding": "gzip, br"}
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="bench-http-")
+    try:
+        prepare_stores(args.rows, args.seed, workdir)
+        os.chdir(workdir)
+        with open("users.json", "w") as f:
+            json.dump({USER: USER}, f)
+        bill_store._table_cache.clear()
+        server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        proxy = ThrottledProxy(("127.0.0.1", server.server_port), args.kbps * 1000 / 8, args.rtt / 1000)
+        cookie = login(proxy.port)
+
+        print(f"{args.rows} bills per store, link {args.kbps:g} kbit/s, RTT {args.rtt:g} ms, median of {args.repeat}\n")
+        print(f"{'page':<22}{'mode':<12}{'bytes':>12}{'saved':>8}{'ms':>10}{'vs identity':>13}")
+        results = {}
+        for name, paths in pages(args.rows, args.seed, app_module.dashboard.WIDGETS).items():
+            # Warm the server-side caches so the rows compare the transfer, not the first parse
+            for path in paths:
+                fetch(server.server_port, path, {"Cookie": cookie})
+            etags = {}
+            results[name] = {}
+            for mode, headers in list(modes.items()) + [("revalidate", None)]:
+                runs, size = [], 0
+                for _ in range(args.repeat):
+                    total_bytes, total_seconds = 0, 0.0
+                    # A browser fetches the dashboard's widgets side by side; the timing here is sequential
+                    for path in paths:
+                        sent = dict(headers or {**modes["gzip"], "If-None-Match": etags.get(path, "")}, Cookie=cookie)
+                        status, nbytes, seconds, resp = fetch(proxy.port, path, sent)
+                        if status not in (200, 304):
+                            raise SystemExit(f"{path} answered {status}")
+                        if mode == "gzip":
+                            etags[path] = resp.getheader("ETag") or ""
+                        total_bytes += nbytes
+                        total_seconds += seconds
+                    runs.append(total_seconds)
+                    size = total_bytes
+                ms = statistics.median(runs) * 1000
+                results[name][mode] = {"bytes": size, "ms": round(ms, 1)}
+                base = results[name]["identity"]
+                print(f"{name:<22}{mode:<12}{size:>12,}{1 - size / base['bytes']:>8.0%}{ms:>10.0f}"
+                      f"{ms / base['ms'] - 1:>+13.0%}")
+            print()
+        server.shutdown()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"rows": args.rows, "kbps": args.kbps, "rtt_ms": args.rtt, "results": results}, f, indent=2)
+        print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
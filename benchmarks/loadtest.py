@@ -0,0 +1,238 @@
+"""Load test: simulated counter clerks submitting bills concurrently against a running server.
+
+Each clerk logs in through "/" with its own session, then loops over a weighted mix of
+sale/purchase/transport bill POSTs and /view-bills and /analytics GETs (the dashboard page and
+all its widgets). At the end it reports p50/p95/p99 latency and throughput per operation, and
+checks the stores for invariants: every bill number handed out is unique and every bill that
+was acknowledged is in its store.
+
+    python app.py                                   # or any multi-worker server on the same folder
+    python benchmarks/loadtest.py --clerks 8 --duration 60 --data-dir .
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, build_opener
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import datagen  # noqa: E402
+from dashboard import WIDGETS as ANALYTICS_WIDGETS  # noqa: E402
+
+# Relative weight of each operation in the traffic mix
+MIX = {
+    "sale_bill": 30,
+    "purchase_bill": 30,
+    "transport_bill": 10,
+    "view_bills": 20,
+    "analytics": 10,
+}
+BILL_OPS = {"sale_bill": "sale", "purchase_bill": "purchase", "transport_bill": "transport"}
+
+
+def sale_form(rng):
+    return {
+        "mill_name": rng.choice(datagen.MILLS), "mill_code": rng.choice(datagen.MILL_CODES),
+        "farmer_name": f"{rng.choice(datagen.FIRST_NAMES)} {rng.choice(datagen.LAST_NAMES)}",
+        "rice_type": rng.choice(datagen.RICE_TYPES), "bags": str(rng.randint(200, 700)),
+        "ntwt": str(rng.randint(15000, 52000)), "price": str(rng.randint(1800, 2600)),
+        "calc_type": rng.choice(["1", "2", "3"]), "sut_rate": "1", "commission": rng.choice(["yes", "no"]),
+        "hamali": "yes", "hamali_rate": "4", "advance": "0", "rmc": "0",
+        "lorry_no": f"KA 33 A {rng.randint(1000, 9999)}", "mobile_no": str(rng.randint(6000000000, 9999999999)),
+    }
+
+
+def purchase_form(rng):
+    return {
+        "farmer_name": f"{rng.choice(datagen.FIRST_NAMES)} {rng.choice(datagen.LAST_NAMES)}",
+        "village_name": rng.choice(datagen.VILLAGES), "mill_name": rng.choice(datagen.MILLS),
+        "rice_type": rng.choice(datagen.RICE_TYPES), "bags": str(rng.randint(200, 700)),
+        "ntwt": str(rng.randint(15000, 52000)), "sut_rate": "1.5", "rate": str(rng.randint(1700, 2400)),
+        "hamali_rate": "4", "weigh_bridge": "150", "lorry_no": f"KA 32 B {rng.randint(1000, 9999)}",
+    }
+
+
+def transport_form(rng):
+    return {
+        "ms": rng.choice(datagen.MILLS), "from_location": rng.choice(datagen.VILLAGES),
+        "to_location": "HYDERABAD", "bags": str(rng.randint(200, 700)), "kgs": str(rng.randint(15000, 52000)),
+        "rice_type": rng.choice(datagen.RICE_TYPES), "lorry_no": f"TS 05 C {rng.randint(1000, 9999)}",
+        "lorry_freight": "1150", "advance": "2000", "mobile_no": str(rng.randint(6000000000, 9999999999)),
+    }
+
+
+FORMS = {"sale_bill": ("/sale-bill", sale_form), "purchase_bill": ("/purchase-bill", purchase_form),
+         "transport_bill": ("/transportation-bill", transport_form)}
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.issued = defaultdict(list)  # store kind -> bill numbers acknowledged by the server
+
+    def add(self, op, seconds, ok, bill_no=None):
+        with self.lock:
+            self.latencies[op].append(seconds)
+            if not ok:
+                self.errors[op] += 1
+            if bill_no:
+                self.issued[BILL_OPS[op]].append(bill_no)
+
+
+def clerk(idx, args, deadline, results):
+    rng = random.Random(args.seed * 1000 + idx)
+    opener = build_opener(HTTPCookieProcessor(CookieJar()))
+    base = args.base_url.rstrip("/")
+    login = urlencode({"username": args.user, "password": args.password}).encode()
+    with opener.open(base + "/", login, timeout=30) as resp:
+        if not resp.geturl().endswith("/menu"):
+            raise SystemExit(f"clerk {idx}: login as {args.user!r} failed")
+
+    ops, weights = zip(*MIX.items())
+    done = 0
+    while time.monotonic() < deadline and (not args.requests or done < args.requests):
+        op = rng.choices(ops, weights)[0]
+        t0 = time.perf_counter()
+        ok, bill_no = False, None
+        try:
+            if op in FORMS:
+                path, make_form = FORMS[op]
+                with opener.open(base + path, urlencode(make_form(rng)).encode(), timeout=120) as resp:
+                    body = resp.read()
+                    # A saved bill answers with its PDF; a rejected one redirects back to the form
+                    ok = resp.headers.get_content_type() == "application/pdf" and body.startswith(b"%PDF")
+                    m = re.search(r'filename="?([^";]+)\.pdf', resp.headers.get("Content-Disposition", ""))
+                    bill_no = m.group(1) if ok and m else None
+            else:
+                # The dashboard page fetches its widgets from the analytics API
+                paths = ["/view-bills"] if op == "view_bills" else \
+                    ["/analytics"] + [f"/api/analytics/{name}" for name in ANALYTICS_WIDGETS]
+                ok = True
+                for path in paths:
+                    with opener.open(base + path, timeout=120) as resp:
+                        resp.read()
+                        ok = ok and resp.status == 200
+        except (HTTPError, URLError, OSError):
+            ok = False
+        results.add(op, time.perf_counter() - t0, ok, bill_no)
+        done += 1
+        if args.think:
+            time.sleep(rng.uniform(0, 2 * args.think))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def store_snapshot(data_dir):
+    """Bill numbers currently in each store, read through bill_store from the server's data folder."""
+    import bill_store
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    try:
+        bill_store._table_cache.clear()
+        snap = {}
+        for kind, path in (("sale", bill_store.SALE_FILE), ("purchase", bill_store.PURCHASE_FILE),
+                           ("transport", bill_store.TRANSPORT_FILE)):
+            df = bill_store.read_bills(path)
+            snap[kind] = df["bill_no"].astype(str).tolist() if "bill_no" in df.columns else []
+        return snap
+    finally:
+        os.chdir(cwd)
+
+
+def check_invariants(before, after, results):
+    """Return a list of invariant violations (empty when the run was clean)."""
+    problems = []
+    for kind in ("sale", "purchase", "transport"):
+        issued = results.issued[kind]
+        issued_set = set(issued)
+        new_rows = len(after[kind]) - len(before[kind])
+        dupes = {b for b, n in Counter(issued).items() if n > 1}
+        if dupes:
+            problems.append(f"{kind}: {len(dupes)} bill number(s) issued twice, e.g. {sorted(dupes)[:3]}")
+        collided = issued_set & set(before[kind])
+        if collided:
+            problems.append(f"{kind}: {len(collided)} new bill(s) reuse existing numbers, e.g. {sorted(collided)[:3]}")
+        stored = set(after[kind])
+        missing = [b for b in issued if b not in stored]
+        if missing:
+            problems.append(f"{kind}: {len(missing)} acknowledged bill(s) missing from the store, e.g. {missing[:3]}")
+        if new_rows != len(issued):
+            problems.append(f"{kind}: store grew by {new_rows} row(s) but {len(issued)} bill(s) were acknowledged")
+        stored_new = [b for b in after[kind] if b in issued_set]
+        if len(stored_new) != len(set(stored_new)):
+            problems.append(f"{kind}: duplicate rows for newly issued bill numbers in the store")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--clerks", type=int, default=4, help="concurrent simulated clerks")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="stop each clerk after N requests (0 = no limit)")
+    parser.add_argument("--think", type=float, default=0.0, help="mean think time between requests, seconds")
+    parser.add_argument("--user", default="admin")
+    parser.add_argument("--password", default="traders123")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--data-dir", default=REPO,
+                        help="folder the server keeps its stores in, for the invariant checks")
+    parser.add_argument("--skip-invariants", action="store_true")
+    args = parser.parse_args()
+
+    before = None if args.skip_invariants else store_snapshot(args.data_dir)
+    results = Results()
+    started = time.perf_counter()
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=clerk, args=(i, args, deadline, results)) for i in range(args.clerks)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(v) for v in results.latencies.values())
+    print(f"\n{args.clerks} clerks, {elapsed:.1f}s, {total} requests, {total / elapsed:.1f} req/s "
+          f"({datetime.now():%d-%m-%Y %H:%M})\n")
+    print(f"{'operation':<16}{'count':>7}{'errors':>8}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    everything = []
+    for op in MIX:
+        lat = sorted(results.latencies.get(op, []))
+        everything += lat
+        print(f"{op:<16}{len(lat):>7}{results.errors.get(op, 0):>8}{len(lat) / elapsed:>8.2f}"
+              f"{percentile(lat, 50) * 1000:>10.1f}{percentile(lat, 95) * 1000:>10.1f}{percentile(lat, 99) * 1000:>10.1f}")
+    everything.sort()
+    print(f"{'all':<16}{len(everything):>7}{sum(results.errors.values()):>8}{len(everything) / elapsed:>8.2f}"
+          f"{percentile(everything, 50) * 1000:>10.1f}{percentile(everything, 95) * 1000:>10.1f}"
+          f"{percentile(everything, 99) * 1000:>10.1f}")
+
+    if args.skip_invariants:
+        return
+    problems = check_invariants(before, store_snapshot(args.data_dir), results)
+    if problems:
+        print("\nINVARIANT VIOLATIONS:")
+        for p in problems:
+            print("  - " + p)
+        sys.exit(1)
+    print("\nInvariants OK: no duplicate bill numbers, no lost rows.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Check that bill numbers stay unique through edits and compaction.
+
+Replays, in a scratch folder, sequences that once lost or reissued bills:
+
+- edit-date: create SB-<day>-001 and -002, edit -002 to the next day, compact, create another
+  bill on the first day, compact again. The edit has to be refused (a bill keeps the day its
+  number was issued for), the new bill has to get -003, and no bill may disappear.
+- dedup-conflict: a store holding an exact copy of one bill and two different rows under another
+  number. Compaction has to report the conflict and leave every row in place.
+
+Exits non-zero when a check fails.
+
+    python benchmarks/numbering_check.py
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import pandas as pd  # noqa: E402
+
+DAY, NEXT_DAY = "2026-10-10", "2026-10-11"
+
+SALE_FORM = {
+    "date_mode": "manual", "manual_date": DAY,
+    "mill_name": "CHECK MILL", "mill_code": "M01", "farmer_name": "CHECK FARMER", "rice_type": "BPT",
+    "bags": "500", "ntwt": "38000", "price": "2100", "calc_type": "2", "sut_rate": "1",
+    "commission": "yes", "hamali": "yes", "hamali_rate": "4", "lorry_no": "KA 33 A 1234",
+    "mobile_no": "9876543210",
+}
+
+failures = []
+
+
+def check(ok, what):
+    print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+    if not ok:
+        failures.append(what)
+
+
+def sale_bill_nos(bill_store):
+    df = bill_store.read_bills(bill_store.SALE_FILE, include_deleted=True)
+    return sorted(df["bill_no"].astype(str)) if "bill_no" in df.columns else []
+
+
+def edit_date(app_module, bill_store, client):
+    print("edit-date")
+    day = DAY.replace("-", "")
+    for _ in range(2):
+        client.post("/sale-bill", data=SALE_FORM)
+    check(sale_bill_nos(bill_store) == [f"SB-{day}-001", f"SB-{day}-002"], "two bills created on the first day")
+
+    edited = f"SB-{day}-002"
+    with app_module.app.test_request_context():
+        values = app_module.edit_form_values("sale", bill_store.find_bill(bill_store.SALE_FILE, edited))
+    client.post(f"/bill/{edited}/edit", data=dict(values, price="2200"))
+    check(float(bill_store.find_bill(bill_store.SALE_FILE, edited)["price"]) == 2200, "an edit on the same day is saved")
+    client.post(f"/bill/{edited}/edit", data=dict(values, date=NEXT_DAY))
+    check(bill_store.find_bill(bill_store.SALE_FILE, edited)["date"] == "10-10-2026",
+          "moving the bill to another day is refused")
+
+    app_module.compact_stores()
+    client.post("/sale-bill", data=SALE_FORM)
+    reports = app_module.compact_stores()
+    check(sale_bill_nos(bill_store) == [f"SB-{day}-001", f"SB-{day}-002", f"SB-{day}-003"],
+          "the next bill of the day gets a new number")
+    sale = next(r for r in reports if r["store"] == bill_store.SALE_FILE)
+    check(not sale.get("duplicates_removed"), "compaction removes no bill")
+
+
+def dedup_conflict(app_module, bill_store):
+    print("dedup-conflict")
+    path = bill_store.SALE_FILE
+    bill_store.write_bills(path, pd.DataFrame([
+        {"bill_no": "SB-20261012-001", "date": "12-10-2026", "price": 2100.0},
+        {"bill_no": "SB-20261012-001", "date": "12-10-2026", "price": 2100.0},
+        {"bill_no": "SB-20261012-002", "date": "12-10-2026", "price": 2100.0},
+        {"bill_no": "SB-20261012-002", "date": "12-10-2026", "price": 2300.0},
+    ]))
+    report = bill_store.compact(path)
+    check(report.get("conflicts") == ["SB-20261012-002"], "the two different -002 rows are reported")
+    check(len(bill_store.read_bills(path, include_deleted=True)) == 4, "no row is removed while they conflict")
+
+    bill_store.write_bills(path, bill_store.read_bills(path).iloc[:3])
+    report = bill_store.compact(path)
+    check(not report.get("conflicts") and report["duplicates_removed"] == 1, "then the exact copy is removed")
+    check(sale_bill_nos(bill_store) == ["SB-20261012-001", "SB-20261012-002"], "and both bills are kept")
+
+
+def main():
+    import app as app_module
+    import bill_store
+    logging.getLogger("billing.timing").setLevel(logging.WARNING)
+    app_module.app.config["PROFILING_ENABLED"] = False
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="numbering-check-")
+    try:
+        os.chdir(workdir)
+        with open("users.json", "w") as f:
+            json.dump({"check": "check"}, f)
+        bill_store._table_cache.clear()
+        client = app_module.app.test_client()
+        client.post("/", data={"username": "check", "password": "check"})
+        edit_date(app_module, bill_store, client)
+        dedup_conflict(app_module, bill_store)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print(f"\n{len(failures)} check(s) failed")
+        sys.exit(1)
+    print("\nAll checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Time opening a synthetic sale_bills.xlsx with every installed xlsx reader backend.
+
+The store is generated once with datagen (cached under benchmarks/.data) and read --repeat times
+by each backend from xlsx_reader, the way bill_store opens a store.
+
+    python benchmarks/reader_benchmark.py --rows 100000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import datagen  # noqa: E402
+import xlsx_reader  # noqa: E402
+
+DATA_CACHE = os.path.join(HERE, ".data")
+
+
+def sale_store(rows, seed):
+    """Path of the generated sale store with `rows` bills, written on first use."""
+    path = os.path.join(DATA_CACHE, f"reader-{rows}-{seed}", datagen.STORE_FILES["sale"])
+    if not os.path.exists(path):
+        print(f"generating {rows} sale bills (cached in {os.path.dirname(path)}) ...")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            datagen.generate("sale", rows, seed).to_excel(f, index=False, engine="openpyxl")
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    path = sale_store(args.rows, args.seed)
+    print(f"{path}: {os.path.getsize(path) / 1e6:.1f} MB, readers installed: {', '.join(xlsx_reader.available())}")
+    results = {}
+    for name in xlsx_reader.available():
+        runs = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            df = xlsx_reader.read_xlsx(path, reader=name)
+            runs.append(time.perf_counter() - t0)
+        results[name] = {"rows": len(df), "median": statistics.median(runs), "min": min(runs), "runs": runs}
+        print(f"{name:>9}: median {results[name]['median']:.2f} s, min {results[name]['min']:.2f} s "
+              f"({len(df) / results[name]['median']:,.0f} rows/s)")
+    if "calamine" in results:
+        print(f"calamine is {results['openpyxl']['median'] / results['calamine']['median']:.1f}x faster than openpyxl")
+    else:
+        print("python-calamine is not installed; pip install python-calamine to compare")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"rows": args.rows, "seed": args.seed, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
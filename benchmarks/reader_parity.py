@@ -0,0 +1,98 @@
+"""Check that every installed xlsx reader backend reads workbooks exactly like openpyxl.
+
+Compares columns, dtypes and values of the DataFrames, and the day numbers bill_store derives
+from the date column, for:
+
+- synthetic sale, purchase and transport stores from datagen,
+- an edge-case workbook written the way older files and hand-edited ledgers look: real Excel
+  date and datetime cells mixed with dd-mm-YYYY text, times, blanks, booleans, numbers stored
+  as text, numeric bill numbers and Kannada text,
+- any workbooks given with --file (for example the live stores).
+
+Exits non-zero on the first mismatch.
+
+    python benchmarks/reader_parity.py --rows 2000 --file sale_bills.xlsx
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, datetime, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import numpy as np  # noqa: E402
+import openpyxl  # noqa: E402
+
+import bill_store  # noqa: E402
+import datagen  # noqa: E402
+import xlsx_reader  # noqa: E402
+
+
+def edge_case_workbook(path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["bill_no", "date", "saved_at", "bags", "ntwt", "price", "mobile_no", "paid", "remarks", "farmer_name", "time"])
+    ws.append(["SB-20251026-001", "26-10-2025", datetime(2025, 10, 26, 9, 15), 10, 800.5, 2150, 9876543210, True,
+               None, "ಬಸವರಾಜ", time(10, 30)])
+    ws.append([261025002, date(2025, 10, 27), datetime(2025, 10, 27), 11.0, 800, 2150.75, "09876543210", False,
+               "paid cash", "RAMESH", None])
+    ws.append(["SB-20251028-003", None, None, None, 1e-7, None, None, None, "", None, time(0, 0)])
+    ws.append(["SB-20251029-004", "31-02-2025", datetime(1900, 3, 1), -3, 0, 0.1 + 0.2, 0, None, "=SUM(1,2)", " ", None])
+    ws["B3"].number_format = "dd-mm-yyyy"
+    wb.save(path)
+
+
+def compare(path, name):
+    """List of differences between `name` and openpyxl reading `path`."""
+    expected = xlsx_reader.read_xlsx(path, reader="openpyxl")
+    got = xlsx_reader.read_xlsx(path, reader=name)
+    problems = []
+    if list(got.columns) != list(expected.columns):
+        return [f"columns {list(got.columns)} != {list(expected.columns)}"]
+    for column in expected.columns:
+        if got[column].dtype != expected[column].dtype:
+            problems.append(f"{column}: dtype {got[column].dtype} != {expected[column].dtype}")
+        elif not got[column].equals(expected[column]):
+            diff = (got[column].astype(str) != expected[column].astype(str)).to_numpy().nonzero()[0][:3]
+            problems.append(f"{column}: rows {list(diff)} read as {list(got[column].iloc[diff])}, "
+                            f"openpyxl gives {list(expected[column].iloc[diff])}")
+    if "date" in expected.columns:
+        days = bill_store._date_index((path, name), got)[0]
+        expected_days = bill_store._date_index((path, "openpyxl"), expected)[0]
+        if not np.array_equal(days, expected_days):
+            problems.append("date: different day numbers in the date index")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="bills per synthetic store")
+    parser.add_argument("--file", action="append", default=[], help="extra workbook to check (repeatable)")
+    args = parser.parse_args()
+
+    others = [name for name in xlsx_reader.available() if name != "openpyxl"]
+    if not others:
+        print("Only openpyxl is installed; nothing to compare (pip install python-calamine)")
+        return
+    with tempfile.TemporaryDirectory(prefix="billing-readers-") as directory:
+        datagen.write_stores(directory, args.rows)
+        files = [os.path.join(directory, name) for name in datagen.STORE_FILES.values()]
+        edge = os.path.join(directory, "edge_cases.xlsx")
+        edge_case_workbook(edge)
+        failures = 0
+        for path in files + [edge] + args.file:
+            for name in others:
+                problems = compare(path, name)
+                failures += bool(problems)
+                label = path if path in args.file else os.path.basename(path)
+                print(f"{'OK  ' if not problems else 'FAIL'} {name} {label}")
+                for problem in problems:
+                    print(f"     {problem}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Time the core billing operations against synthetic stores of increasing size.
+
+Runs entirely in-process with the Flask test client, inside a scratch copy of the stores, so the
+live workbooks are never touched. Results are written as JSON and can be compared against a
+previous run to flag regressions:
+
+    python benchmarks/run_benchmarks.py --rows 1000 10000
+    python benchmarks/run_benchmarks.py --rows 1000 10000 --baseline benchmarks/results/abc1234.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+import pandas as pd  # noqa: E402
+
+import datagen  # noqa: E402
+
+DATA_CACHE = os.path.join(HERE, ".data")
+RESULTS_DIR = os.path.join(HERE, "results")
+
+# Operations that render many PDFs are repeated fewer times
+HEAVY_OPS = {"pdf_merged_100"}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def prepare_stores(rows, seed, workdir):
+    """Copy generated stores for `rows` into `workdir`, generating them once per (rows, seed)."""
+    cached = os.path.join(DATA_CACHE, f"{rows}-{seed}")
+    if not os.path.isdir(cached):
+        print(f"  generating {rows} bills per store (cached in {cached}) ...")
+        datagen.write_stores(cached + ".tmp", rows, seed)
+        os.replace(cached + ".tmp", cached)
+    for name in datagen.STORE_FILES.values():
+        shutil.copy2(os.path.join(cached, name), os.path.join(workdir, name))
+
+
+def time_op(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return {
+        "first": runs[0],
+        "median": statistics.median(runs),
+        "min": min(runs),
+        "runs": runs,
+    }
+
+
+def expect_ok(resp, what):
+    if resp.status_code != 200:
+        raise RuntimeError(f"{what} returned {resp.status_code}")
+    return resp
+
+
+def run_size(app_module, rows, seed, repeat):
+    """Benchmark every operation on stores of `rows` bills; returns {op: timings}."""
+    app = app_module.app
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = "benchmark"
+
+    sales = datagen.generate("sale", rows, seed)
+    mill = sales["mill_name"].mode()[0]
+    rice = sales["rice_type"].mode()[0]
+    last_day = datetime.strptime(sales["date"].iloc[-1], "%d-%m-%Y")
+    month_ago = (last_day - pd.Timedelta(days=30)).strftime("%Y-%m-%d")
+    one_id = [sales["bill_no"].iloc[-1]]
+    hundred_ids = sales["bill_no"].iloc[-100:].tolist()
+
+    sale_form = {
+        "date_mode": "manual", "manual_date": last_day.strftime("%Y-%m-%d"),
+        "mill_name": mill, "mill_code": "M01", "farmer_name": "BENCH FARMER", "rice_type": rice,
+        "bags": "500", "ntwt": "38000", "price": "2100", "calc_type": "2", "sut_rate": "1",
+        "commission": "yes", "hamali": "yes", "hamali_rate": "4", "lorry_no": "KA 33 A 1234",
+        "mobile_no": "9876543210",
+    }
+
+    def analytics(query):
+        """The dashboard as a browser loads it: the page, every widget and the first page of both record tables."""
+        app_module.dashboard.clear_cache()  # time the computation, not the reuse between runs
+        expect_ok(client.get("/analytics", query_string=query), "analytics")
+        for widget in app_module.dashboard.WIDGETS:
+            extra = [{"kind": "sale"}, {"kind": "purchase"}] if widget == "records" else [{}]
+            for params in extra:
+                expect_ok(client.get(f"/api/analytics/{widget}", query_string={**query, **params}), f"analytics {widget}")
+
+    ops = {
+        "view_filtered": lambda: expect_ok(client.get(
+            "/view-bills", query_string={"mill_name": mill, "rice_type": rice}), "view"),
+        "analytics": lambda: analytics({}),
+        "analytics_filtered": lambda: analytics({"from_date": month_ago, "mill": mill}),
+        "generate_bill_no": lambda: app_module.generate_bill_no(app_module.SALE_FILE, last_day),
+        "export_csv": lambda: expect_ok(client.get("/download/sale/csv"), "csv export").get_data(),
+        "export_excel": lambda: expect_ok(client.get("/download/sale/excel"), "excel export").get_data(),
+        "pdf_single": lambda: expect_ok(client.post(
+            "/download-selected-bills/sale", data={"download_ids": one_id}), "pdf"),
+        "pdf_merged_100": lambda: expect_ok(client.post(
+            "/download-selected-bills/sale", data={"download_ids": hundred_ids}), "merged pdf"),
+        # Last, because it grows the store
+        "save_bill": lambda: expect_ok(client.post("/sale-bill", data=sale_form), "save bill"),
+    }
+
+    results = {}
+    for name, fn in ops.items():
+        results[name] = time_op(fn, min(repeat, 3) if name in HEAVY_OPS else repeat)
+        print(f"  {name:<20} median {results[name]['median'] * 1000:9.1f} ms"
+              f"   first {results[name]['first'] * 1000:9.1f} ms")
+    return results
+
+
+def compare(current, baseline, threshold):
+    """Print per-operation changes against `baseline`; returns the list of regressions."""
+    regressions = []
+    print(f"\n{'rows':>8}  {'operation':<20} {'baseline':>10} {'current':>10} {'change':>8}")
+    for size, ops in current["results"].items():
+        for op, timing in ops.items():
+            base = baseline["results"].get(size, {}).get(op)
+            if not base:
+                continue
+            change = timing["median"] / base["median"] - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append((size, op, change))
+            print(f"{size:>8}  {op:<20} {base['median'] * 1000:8.1f}ms {timing['median'] * 1000:8.1f}ms"
+                  f" {change:+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000], help="store sizes to run (1k to 1M)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="result JSON path (default: benchmarks/results/<git rev>.json)")
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="median slowdown that counts as a regression (default 0.25 = 25%%)")
+    args = parser.parse_args()
+
+    import app as app_module
+    import bill_store
+    # Keep the per-request log lines out of the benchmark output
+    logging.getLogger("billing.timing").setLevel(logging.WARNING)
+    logging.getLogger("xhtml2pdf").setLevel(logging.ERROR)
+
+    revision = git_revision()
+    current = {
+        "meta": {
+            "revision": revision,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": {},
+    }
+
+    cwd = os.getcwd()
+    for rows in args.rows:
+        print(f"[{rows} rows]")
+        workdir = tempfile.mkdtemp(prefix=f"bench-{rows}-")
+        try:
+            prepare_stores(rows, args.seed, workdir)
+            os.chdir(workdir)
+            bill_store._table_cache.clear()
+            current["results"][str(rows)] = run_size(app_module, rows, args.seed, args.repeat)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"\nResults written to {out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Calculation rules for sale, purchase and transport bills.
+
+Each compute_* function turns the submitted form fields into the row stored for the bill (without
+its bill number), so creating a bill and amending one always derive the totals the same way.
+The infer_*_inputs functions go the other way and rebuild the form fields from a stored row,
+for prefilling the edit form.
+"""
+from num2words import num2words
+
+
+class BillInputError(ValueError):
+    """The form is incomplete or inconsistent; the message is shown to the clerk as is."""
+
+
+def _require(data, fields):
+    for field in fields:
+        if not data.get(field):
+            raise BillInputError(f"⚠️ Missing required field: {field.replace('_', ' ').title()}")
+
+
+def compute_sale_bill(data, selected_date):
+    _require(data, ["mill_name", "farmer_name", "rice_type", "bags", "ntwt", "price", "calc_type", "lorry_no", "mobile_no"])
+
+    bags = int(data["bags"])
+    ntwt = float(data["ntwt"])
+    price = float(data["price"])
+    calc_type = data["calc_type"]
+
+    stwt = 0
+    sut_rate = 0
+    if calc_type == "1":
+        net_bags = ntwt / 77
+    elif calc_type == "2":
+        sut_rate = float(data.get("sut_rate", 0))
+        if sut_rate == 0:
+            raise BillInputError("⚠️ Sut Rate is required for Option 2.")
+        stwt = bags * sut_rate
+        net_bags = (ntwt - stwt) / 75
+    elif calc_type == "3":
+        net_bags = (ntwt - (ntwt / 1000) * 5) / 100
+    else:
+        raise BillInputError("⚠️ Invalid calculation type.")
+
+    amount = net_bags * price
+    commission = amount / 100 if data.get("commission") == "yes" else 0
+    hamali_rate = float(data.get("hamali_rate", 0)) if data.get("hamali") == "yes" else 0
+    hamali = bags * hamali_rate
+    gunny_rate = float(data.get("gunny_rate", 0)) if data.get("gunny_bags") == "yes" else 0
+    gunny = bags * gunny_rate
+    advance = float(data.get("advance", 0))
+    rmc = float(data.get("rmc", 0))
+    grand_total = amount + commission + hamali + gunny + advance + rmc
+
+    return {
+        "bill_type": "Sale",
+        "bill_no": None,
+        "date": selected_date.strftime("%d-%m-%Y"),
+        "mill_name": data["mill_name"].upper(),
+        "mill_code": data.get("mill_code", "").upper(),
+        "farmer_name": data["farmer_name"].upper(),
+        "rice_type": data["rice_type"].upper(),
+        "bags": bags,
+        "ntwt": ntwt,
+        "stwt": round(stwt, 2),
+        "sut_rate": sut_rate,
+        "price": price,
+        "net_bags": round(net_bags, 2),
+        "amount": round(amount, 2),
+        "commission": round(commission, 2),
+        "hamali": round(hamali, 2),
+        "gunny": round(gunny, 2),
+        "advance": round(advance, 2),
+        "rmc": round(rmc, 2),
+        "grand_total": round(grand_total, 2),
+        "lorry_no": data["lorry_no"].upper(),
+        "mobile_no": data["mobile_no"]
+    }
+
+
+def compute_purchase_bill(data, selected_date):
+    _require(data, ["farmer_name", "village_name", "mill_name", "rice_type", "bags", "ntwt", "sut_rate", "rate", "hamali_rate", "weigh_bridge", "lorry_no"])
+
+    bags = int(data["bags"])
+    ntwt = float(data["ntwt"])
+    sut_rate = float(data["sut_rate"])
+    stwt = bags * sut_rate
+    total_ntwt = (ntwt - stwt) / 75
+    rate = float(data["rate"])
+    amount = total_ntwt * rate
+    hamali_rate = float(data["hamali_rate"])
+    hamali = hamali_rate * bags
+    weigh_bridge = float(data["weigh_bridge"])
+    grand_total = amount - hamali - weigh_bridge
+
+    return {
+        "bill_type": "Purchase",
+        "bill_no": None,
+        "date": selected_date.strftime("%d-%m-%Y"),
+        "farmer_name": data["farmer_name"].upper(),
+        "village_name": data["village_name"].upper(),
+        "mill_name": data["mill_name"].upper(),
+        "rice_type": data["rice_type"].upper(),
+        "bags": bags,
+        "ntwt": ntwt,
+        "sut_rate": sut_rate,
+        "stwt": stwt,
+        "total_ntwt": round(total_ntwt, 2),
+        "rate": rate,
+        "amount": round(amount, 2),
+        "hamali": round(hamali, 2),
+        "weigh_bridge": round(weigh_bridge, 2),
+        "grand_total": round(grand_total, 2),
+        "lorry_no": data["lorry_no"].upper()
+    }
+
+
+def freight_in_words(lorry_freight):
+    whole_part = int(lorry_freight)
+    decimal_part = int((lorry_freight % 1) * 100)
+    rupees_in_words = num2words(whole_part, lang='en_IN').replace('-', ' ').title()
+    paise_in_words = num2words(decimal_part, lang='en_IN').replace('-', ' ').title() if decimal_part > 0 else "Zero"
+    return f"{rupees_in_words} Rupees and {paise_in_words} Paise Only"
+
+
+def compute_transport_bill(data, selected_date):
+    _require(data, ["ms", "from_location", "to_location", "bags", "kgs", "rice_type", "lorry_no", "lorry_freight", "mobile_no"])
+
+    bags = int(data["bags"])
+    kgs = float(data["kgs"])
+    lorry_freight = float(data["lorry_freight"])
+    zero_charge = float(data.get("zero_charge", 0.0))  # Ensure default value
+    advance = float(data.get("advance", 0.0))
+
+    return {
+        "bill_type": "Transportation",
+        "bill_no": None,
+        "date": selected_date.strftime("%d-%m-%Y"),
+        "ref": None,
+        "ms": data["ms"].upper(),
+        "from_location": data["from_location"].upper(),
+        "to_location": data["to_location"].upper(),
+        "bags": bags,
+        "kgs": kgs,
+        "rice_type": data["rice_type"].upper(),
+        "lorry_no": data["lorry_no"].upper(),
+        "lorry_freight": round(lorry_freight, 2),
+        "zero_charge": round(zero_charge, 2),
+        "advance": round(advance, 2),
+        "mobile_no": data["mobile_no"],
+        "freight_in_words": freight_in_words(lorry_freight)
+    }
+
+
+def _num(bill, key):
+    try:
+        value = float(bill.get(key) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if value != value else value  # NaN from an empty cell
+
+
+def _rate(total, bags):
+    return round(total / bags, 2) if bags else 0
+
+
+def infer_sale_inputs(bill):
+    """Form fields that reproduce the stored sale bill `bill` through compute_sale_bill."""
+    bags = _num(bill, "bags")
+    ntwt = _num(bill, "ntwt")
+    net_bags = _num(bill, "net_bags")
+    if _num(bill, "sut_rate") or _num(bill, "stwt"):
+        calc_type = "2"
+    elif ntwt and abs(net_bags - ntwt / 77) <= abs(net_bags - (ntwt - ntwt / 1000 * 5) / 100):
+        calc_type = "1"
+    else:
+        calc_type = "3"
+    return {
+        "calc_type": calc_type,
+        "sut_rate": _num(bill, "sut_rate") or (_rate(_num(bill, "stwt"), bags) if calc_type == "2" else ""),
+        "commission": "yes" if _num(bill, "commission") else "no",
+        "hamali": "yes" if _num(bill, "hamali") else "no",
+        "hamali_rate": _rate(_num(bill, "hamali"), bags),
+        "gunny_bags": "yes" if _num(bill, "gunny") else "no",
+        "gunny_rate": _rate(_num(bill, "gunny"), bags),
+    }
+
+
+def infer_purchase_inputs(bill):
+    """Form fields that reproduce the stored purchase bill `bill` through compute_purchase_bill."""
+    return {"hamali_rate": _rate(_num(bill, "hamali"), _num(bill, "bags"))}
+
+
+def infer_transport_inputs(bill):
+    return {}
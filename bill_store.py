@@ -0,0 +1,1033 @@
+import hashlib
+import json
+import os
+import re
+import time
+import zipfile
+from datetime import date, datetime, timedelta
+from threading import RLock
+
+import numpy as np
+import pandas as pd
+
+import audit_log
+import xlsx_reader
+from timing import span
+
+# Files for bills
+SALE_FILE = "sale_bills.xlsx"
+PURCHASE_FILE = "purchase_bills.xlsx"
+TRANSPORT_FILE = "bills.xlsx"
+BILL_FILES = [SALE_FILE, PURCHASE_FILE, TRANSPORT_FILE]
+
+# Re-entrant so a route can hold it across generate_bill_no() and the append that follows
+excel_lock = RLock()
+
+# Parsed bill tables: path -> ((mtime_ns, size), DataFrame)
+_table_cache = {}
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+class StoreCorruptError(Exception):
+    """A store exists but cannot be read. It has to be restored from a backup, never treated as
+    empty: the next save would overwrite every bill in it."""
+
+
+def _table(path):
+    """The cached table for `path`, parsed only when the file changed. Callers must not modify it."""
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    stamp = _stamp(path)
+    cached = _table_cache.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    try:
+        with span("storage_read"):
+            df = xlsx_reader.read_xlsx(path)
+    except Exception as e:
+        raise StoreCorruptError(f"{path} is damaged and cannot be read ({e}). "
+                                "Restore it from a backup (python backup.py list / restore).") from e
+    _table_cache[path] = (stamp, df)
+    return df
+
+
+# Deleted bills can be restored for this long; after that compaction drops them from the store
+DELETE_RETENTION = timedelta(days=7)
+
+# Parsed journals: path -> ((mtime_ns, size) of the journal, tombstones, amendments, purged)
+_journal_cache = {}
+
+# Tables with the journal applied: path -> (raw table, journal stamp, live table)
+_live_cache = {}
+
+
+def journal_path(path):
+    """Side file next to the store `path` that records deletes, restores and amendments, one JSON line each."""
+    return os.path.splitext(path)[0] + ".journal.jsonl"
+
+
+def history_path(path):
+    """Append-only record of every amendment made to bills of the store `path`."""
+    return os.path.splitext(path)[0] + ".history.jsonl"
+
+
+def _journal_entries(path):
+    """(tombstones, amendments, purged) recorded in the journal of `path`.
+
+    tombstones maps bill_no -> delete entry for bills that are deleted and not restored;
+    amendments maps bill_no -> {column: value} with all its amendments applied in order;
+    purged maps bill_no -> purge marker left by compaction (see compact()).
+    """
+    jpath = journal_path(path)
+    if not os.path.exists(jpath):
+        return {}, {}, {}
+    stamp = _stamp(jpath)
+    cached = _journal_cache.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1:]
+    tombstones, amendments, purged = {}, {}, {}
+    with open(jpath, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a torn last line from a crash mid-append
+            bill_no = str(entry.get("bill_no"))
+            if entry.get("op") == "delete":
+                tombstones[bill_no] = entry
+            elif entry.get("op") == "restore":
+                tombstones.pop(bill_no, None)
+            elif entry.get("op") == "amend":
+                amendments.setdefault(bill_no, {}).update(entry["values"])
+            elif entry.get("op") == "purged":
+                purged[bill_no] = entry
+    _journal_cache[path] = (stamp, tombstones, amendments, purged)
+    return tombstones, amendments, purged
+
+
+def _journal(path):
+    """(tombstones, amendments) recorded in the journal of `path`, see _journal_entries()."""
+    return _journal_entries(path)[:2]
+
+
+def purged_bills(path):
+    """Numbers of deleted bills that compaction removed from `path` for good (the highest per day).
+    Bill numbering counts them, so a number is never issued twice."""
+    return set(_journal_entries(path)[2])
+
+
+def _tombstones(path):
+    """{bill_no: delete entry} for the bills of `path` that are deleted and not restored."""
+    return _journal(path)[0]
+
+
+def durable_replace(tmp, path):
+    """Move the fully written file `tmp` over `path` so that after a crash `path` holds either
+    its old or its new contents: flush `tmp` to disk, rename it, then flush the directory entry."""
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if os.name != "nt":  # Windows cannot open a directory to fsync it; its rename is journaled by NTFS
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _append_lines(file_path, entries):
+    if not entries:
+        return
+    with open(file_path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _append_journal(path, entries):
+    _append_lines(journal_path(path), entries)
+
+
+def _jsonable(value):
+    """`value` from a DataFrame cell as a plain JSON value."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.isoformat()
+    return value
+
+
+def _same(old, new):
+    """True when a stored cell and a newly computed value mean the same thing."""
+    old, new = _jsonable(old), _jsonable(new)
+    if old in (None, "") or new in (None, ""):
+        return old in (None, "") and new in (None, "")
+    try:
+        return abs(float(old) - float(new)) < 1e-9
+    except (TypeError, ValueError):
+        return str(old) == str(new)
+
+
+def _assign(df, rows, col, value):
+    """Set `col` of `rows` to `value`, widening the column's dtype when it cannot hold the value."""
+    if col not in df.columns:
+        df[col] = pd.Series([None] * len(df), index=df.index, dtype=object)
+    column = df[col]
+    numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if value is None:
+        if pd.api.types.is_integer_dtype(column):
+            df[col] = column.astype(float)
+    elif pd.api.types.is_integer_dtype(column) and not (numeric and float(value).is_integer()):
+        df[col] = column.astype(float if numeric else object)
+    elif pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column) and not numeric:
+        df[col] = column.astype(object)
+    elif not pd.api.types.is_numeric_dtype(column) and numeric and column.dtype != object:
+        df[col] = column.astype(object)
+    df.loc[rows, col] = value
+
+
+def _apply_amendments(df, amendments):
+    """Copy of `df` with every row of an amended bill updated."""
+    df = df.copy()
+    keys = df["bill_no"].astype(str)
+    hits = keys[keys.isin(amendments.keys())]
+    for bill_no, rows in hits.groupby(hits).groups.items():
+        for col, value in amendments[bill_no].items():
+            _assign(df, rows, col, value)
+    return df
+
+
+def _live(path):
+    """The cached table for `path` with the journal applied: deleted bills left out, amendments
+    filled in. Callers must not modify it."""
+    df = _table(path)
+    tombstones, amendments = _journal(path)
+    if not (tombstones or amendments) or "bill_no" not in df.columns:
+        return df
+    jstamp = _journal_cache[path][0]
+    cached = _live_cache.get(path)
+    if cached and cached[0] is df and cached[1] == jstamp:
+        return cached[2]
+    live = df
+    if tombstones:
+        live = live[~live["bill_no"].astype(str).isin(tombstones.keys())]
+    if amendments:
+        live = _apply_amendments(live, amendments)
+    _live_cache[path] = (df, jstamp, live)
+    return live
+
+
+def read_bills(path, include_deleted=False):
+    """Return the bills stored in `path`, parsing the workbook only when it changed on disk.
+
+    Deleted bills are left out unless `include_deleted` is set (bill numbering needs them, so a
+    restored bill never clashes with a newer one).
+    """
+    return (_table(path) if include_deleted else _live(path)).copy()
+
+
+def store_version(path):
+    """Changes whenever the bills of `path` may have changed: its workbook, its journal or the
+    archive manifest. Cheap (three stat calls), for caches and validators built on the bills."""
+    version = []
+    for file_path in (path, journal_path(path), ARCHIVE_MANIFEST):
+        try:
+            version.append(_stamp(file_path))
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+def _records(df):
+    return [{col: _jsonable(value) for col, value in row.items()} for row in df.to_dict("records")]
+
+
+def _audit_state(path):
+    """The store `path` in the shape the audit log snapshots: every row with amendments applied,
+    and the bill numbers that are deleted."""
+    df = _table(path)
+    tombstones, amendments = _journal(path)
+    if amendments and "bill_no" in df.columns:
+        df = _apply_amendments(df, amendments)
+    return {"rows": _records(df), "deleted": set(tombstones)}
+
+
+def _audit_baseline(path):
+    """Snapshot the store before its first audited change, so the log has a state to replay from."""
+    store = audit_log.store_name(path)
+    try:
+        if not audit_log.has_baseline(store):
+            audit_log.write_snapshot(store, _audit_state(path))
+    except Exception as e:
+        print(f"Audit snapshot of {path} failed: {e}")
+
+
+def _audit(path, op, user, **payload):
+    # The change itself is already saved; a failing audit write must not turn it into an error page
+    try:
+        audit_log.record(audit_log.store_name(path), op, user, **payload)
+    except Exception as e:
+        print(f"Audit log write for {path} failed: {e}")
+
+
+def append_bills(path, rows, user=None):
+    """Add `rows` (a list of dicts) to the end of the store, keeping deleted bills restorable."""
+    with excel_lock:
+        check_open(path, rows)
+        _audit_baseline(path)
+        df = pd.DataFrame(rows)
+        existing = _table(path)
+        if len(existing.columns):
+            df = pd.concat([existing, df], ignore_index=True)
+        write_bills(path, df)
+        _audit(path, "create", user, rows=[{k: _jsonable(v) for k, v in row.items()} for row in rows])
+
+
+def clear_bills(path, bill_type, user=None):
+    """Remove every bill of `bill_type` from the store; returns how many rows went."""
+    with excel_lock:
+        _audit_baseline(path)
+        df = _table(path)
+        if "bill_type" not in df.columns:
+            return 0
+        match = df["bill_type"].astype(str).str.lower() == bill_type.lower()
+        if not match.any():
+            return 0
+        write_bills(path, df[~match])
+        _audit(path, "clear", user, bill_type=bill_type.lower(), rows=_records(df[match]))
+    return int(match.sum())
+
+
+def delete_bills(path, bill_nos, user=None):
+    """Tombstone `bill_nos` in the journal of `path`; the workbook itself is not rewritten.
+
+    Returns the number of bills deleted (unknown or already deleted numbers are skipped).
+    """
+    with excel_lock:
+        _audit_baseline(path)
+        live = _live(path)
+        present = set(live["bill_no"].astype(str)) if "bill_no" in live.columns else set()
+        targets = [b for b in dict.fromkeys(str(b) for b in bill_nos) if b in present]
+        at = datetime.now().isoformat(timespec="seconds")
+        _append_journal(path, [{"op": "delete", "bill_no": b, "at": at, "user": user} for b in targets])
+        if targets:
+            _audit(path, "delete", user, bill_nos=targets)
+    return len(targets)
+
+
+def deleted_bills(path):
+    """Delete entries that can still be restored, newest first, each with a `restore_until` datetime."""
+    now = datetime.now()
+    entries = []
+    for entry in _tombstones(path).values():
+        until = datetime.fromisoformat(entry["at"]) + DELETE_RETENTION
+        if until > now:
+            entries.append(dict(entry, restore_until=until))
+    return sorted(entries, key=lambda e: e["at"], reverse=True)
+
+
+def restore_bills(path, bill_nos, user=None):
+    """Undo the deletion of `bill_nos` that are still within DELETE_RETENTION; returns how many."""
+    with excel_lock:
+        _audit_baseline(path)
+        restorable = {e["bill_no"] for e in deleted_bills(path)}
+        targets = [b for b in dict.fromkeys(str(b) for b in bill_nos) if b in restorable]
+        at = datetime.now().isoformat(timespec="seconds")
+        _append_journal(path, [{"op": "restore", "bill_no": b, "at": at, "user": user} for b in targets])
+        if targets:
+            _audit(path, "restore", user, bill_nos=targets)
+    return len(targets)
+
+
+def find_bill(path, bill_no):
+    """The current row of bill `bill_no` in `path` as a dict, or None when there is no such live bill."""
+    live = _live(path)
+    if "bill_no" not in live.columns:
+        return None
+    rows = live[live["bill_no"].astype(str) == str(bill_no)]
+    return rows.iloc[-1].to_dict() if len(rows) else None
+
+
+def bill_history(path, bill_no):
+    """Amendments of bill `bill_no`, oldest first. Version 1 is the bill as created."""
+    hpath = history_path(path)
+    if not os.path.exists(hpath):
+        return []
+    history = []
+    with open(hpath, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("bill_no") == str(bill_no):
+                history.append(entry)
+    return history
+
+
+def amend_bill(path, bill_no, values, user=None):
+    """Change the columns in `values` for bill `bill_no`, recording a new version in its history.
+
+    Like a delete, this only appends to the journal; compaction folds it into the workbook later.
+    Returns (version, {column: [old, new]}), with an empty dict and no new version when nothing
+    actually changed. Raises KeyError when the bill does not exist or is deleted.
+    """
+    with excel_lock:
+        check_open(path, [values])
+        _audit_baseline(path)
+        current = find_bill(path, bill_no)
+        if current is None:
+            raise KeyError(bill_no)
+        changes = {col: [_jsonable(current.get(col)), _jsonable(value)]
+                   for col, value in values.items() if not _same(current.get(col), value)}
+        version = len(bill_history(path, bill_no)) + 1
+        if not changes:
+            return version, {}
+        version += 1
+        at = datetime.now().isoformat(timespec="seconds")
+        _append_journal(path, [{"op": "amend", "bill_no": str(bill_no), "at": at, "user": user,
+                                "values": {col: new for col, (old, new) in changes.items()}}])
+        _append_lines(history_path(path), [{"bill_no": str(bill_no), "version": version, "at": at,
+                                            "user": user, "changes": changes}])
+        _audit(path, "amend", user, bill_no=str(bill_no), version=version,
+               values={col: new for col, (old, new) in changes.items()})
+    return version, changes
+
+
+# Bill numbers issued by generate_bill_no: the day part (SB-20251026) and the sequence number
+BILL_NO_RE = re.compile(r"^((?:SB|PB|TB)-\d{8})-(\d{3,})$")
+
+
+def _high_water(entries):
+    """Of {bill_no: entry}, keep the entry with the highest sequence number of each day. Numbers in
+    other formats are dropped: numbering never looks at them."""
+    top = {}
+    for bill_no, entry in entries.items():
+        m = BILL_NO_RE.match(bill_no)
+        if m and (m.group(1) not in top or int(m.group(2)) > top[m.group(1)][0]):
+            top[m.group(1)] = (int(m.group(2)), bill_no, entry)
+    return {bill_no: entry for _, bill_no, entry in top.values()}
+
+
+# Columns that identify a bill. Compaction only removes rows that are identical in every column;
+# rows sharing these columns but differing elsewhere are two bills under one number, a conflict
+# it reports and leaves for a person to sort out. Legacy transport bills reuse numbers, so no
+# key is checked for them.
+UNIQUE_KEYS = {SALE_FILE: ["bill_no"], PURCHASE_FILE: ["bill_no"], TRANSPORT_FILE: None}
+
+
+def compact(path):
+    """Rewrite the store with pending amendments folded in, without duplicate rows and without
+    bills deleted longer ago than DELETE_RETENTION, trim its journal, and refresh the cached table.
+
+    Returns a report of what was reclaimed. When two different rows share a bill number (see
+    UNIQUE_KEYS), nothing is rewritten: the report lists them under "conflicts" instead.
+    """
+    t0 = time.perf_counter()
+    report = {"store": path, "rows_before": 0, "rows_after": 0, "duplicates_removed": 0,
+              "deleted_removed": 0, "amendments_applied": 0, "bytes_before": 0, "bytes_after": 0}
+    if not os.path.exists(path):
+        return report
+    with excel_lock:
+        _audit_baseline(path)
+        report["bytes_before"] = os.path.getsize(path)
+        df = _table(path)
+        report["rows_before"] = len(df)
+
+        tombstones, amendments, purged = _journal_entries(path)
+        cutoff = datetime.now() - DELETE_RETENTION
+        expired = {b for b, e in tombstones.items() if datetime.fromisoformat(e["at"]) < cutoff}
+        if expired and "bill_no" in df.columns:
+            keep = ~df["bill_no"].astype(str).isin(expired)
+            report["deleted_removed"] = int((~keep).sum())
+            df = df[keep]
+        if amendments and "bill_no" in df.columns:
+            df = _apply_amendments(df, amendments)
+            report["amendments_applied"] = len(amendments)
+
+        if len(df.columns):
+            deduped = df.drop_duplicates(keep="last")
+            report["duplicates_removed"] = len(df) - len(deduped)
+            df = deduped
+        keys = UNIQUE_KEYS.get(path)
+        if keys and set(keys) <= set(df.columns):
+            clashing = df[df.duplicated(subset=keys, keep=False)]
+            if len(clashing):
+                # Deleting either row would lose a bill; leave the store exactly as it is
+                report.update(conflicts=sorted(set(clashing["bill_no"].astype(str))), duplicates_removed=0,
+                              deleted_removed=0, amendments_applied=0, rows_after=report["rows_before"],
+                              bytes_after=report["bytes_before"], seconds=round(time.perf_counter() - t0, 3))
+                return report
+
+        if report["deleted_removed"] or report["duplicates_removed"] or report["amendments_applied"]:
+            write_bills(path, df.reset_index(drop=True))
+        if expired or amendments:
+            # Keep only the tombstones still inside the restore window; amendments are in the workbook now.
+            # Purged bills leave a marker (only the highest number of each day is needed), or
+            # generate_bill_no would hand their numbers out again and the new bill would inherit
+            # the old one's history.
+            at = datetime.now().isoformat(timespec="seconds")
+            purged = _high_water({**purged, **{b: {"op": "purged", "bill_no": b, "at": at} for b in expired}})
+            jpath = journal_path(path)
+            with open(jpath + ".tmp", "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps(e) + "\n" for e in purged.values()))
+                f.write("".join(json.dumps(e) + "\n" for b, e in tombstones.items() if b not in expired))
+            durable_replace(jpath + ".tmp", jpath)
+        # Rebuild the parsed table and its live view from the file as it now stands
+        _table(path)
+        _live(path)
+        if report["deleted_removed"] or report["duplicates_removed"]:
+            # Amendments need no event (they are logged already); rows removed do. The snapshot
+            # after it means later reconstructions start from the compacted store itself.
+            _audit(path, "compact", None, expired=sorted(expired), dedup_keys=None)
+            try:
+                audit_log.write_snapshot(audit_log.store_name(path), _audit_state(path))
+            except Exception as e:
+                print(f"Audit snapshot of {path} failed: {e}")
+        report["rows_after"] = len(df)
+        report["bytes_after"] = os.path.getsize(path)
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    return report
+
+
+# Closed financial years are moved out of the store into read-only partitions under archive/
+ARCHIVE_DIR = "archive"
+ARCHIVE_MANIFEST = os.path.join(ARCHIVE_DIR, "manifest.json")
+
+# A financial year (April to March) is archived once it ended this long ago, when the accounts
+# for it are settled
+ARCHIVE_AFTER = timedelta(days=183)
+
+# Parsed manifest: ((mtime_ns, size), {store: {year: entry}})
+_manifest_cache = {}
+
+
+class ClosedYearError(ValueError):
+    """A change to bills of a financial year that is archived and read-only."""
+
+
+def financial_year(day):
+    """'2025-26' for any day from 1 April 2025 to 31 March 2026."""
+    start = day.year if day.month >= 4 else day.year - 1
+    return f"{start}-{str(start + 1)[-2:]}"
+
+
+def year_bounds(year):
+    """(1 April, 31 March) of the financial year '2025-26'."""
+    start = int(year[:4])
+    return date(start, 4, 1), date(start + 1, 3, 31)
+
+
+def _manifest():
+    if not os.path.exists(ARCHIVE_MANIFEST):
+        return {}
+    stamp = _stamp(ARCHIVE_MANIFEST)
+    cached = _manifest_cache.get("manifest")
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with open(ARCHIVE_MANIFEST, encoding="utf-8") as f:
+        manifest = json.load(f)
+    _manifest_cache["manifest"] = (stamp, manifest)
+    return manifest
+
+
+def archived_years(path):
+    """{year: manifest entry} of the archived financial years of the store `path`."""
+    return _manifest().get(path, {})
+
+
+def partitions(path, date_range=None):
+    """Files that hold bills of the store `path` dated within `date_range` (None: any date):
+    the overlapping archived years, oldest first, then the store itself with the open years."""
+    first, last = date_range or (None, None)
+    files = []
+    for year, entry in sorted(archived_years(path).items()):
+        start, end = year_bounds(year)
+        if (not first or end >= first) and (not last or start <= last):
+            files.append(entry["file"])
+    return files + [path]
+
+
+_BILL_NO_DAY = re.compile(r"^[A-Z]+-(\d{8})-\d+$")
+
+
+def bill_no_day(bill_no):
+    """The day in a bill number like SB-20251026-001, or None for numbers without one."""
+    match = _BILL_NO_DAY.match(str(bill_no))
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def check_open(path, rows):
+    """Raise ClosedYearError when any of `rows` is dated in an archived year of `path`."""
+    closed = archived_years(path)
+    if not closed:
+        return
+    for row in rows:
+        try:
+            day = datetime.strptime(str(row.get("date")), "%d-%m-%Y").date()
+        except ValueError:
+            continue
+        if financial_year(day) in closed:
+            raise ClosedYearError(f"Financial year {financial_year(day)} is archived and read-only; "
+                                  f"a bill dated {row.get('date')} cannot be added to it.")
+
+
+def mark_archived(path, bills):
+    """Set bill["archived"] on each of `bills` (dicts of the store `path`): True when it is dated
+    in an archived year, so the view pages show it without edit and delete controls."""
+    closed = archived_years(path)
+    for bill in bills:
+        try:
+            day = datetime.strptime(str(bill.get("date")), "%d-%m-%Y").date()
+        except ValueError:
+            day = None
+        bill["archived"] = bool(closed) and day is not None and financial_year(day) in closed
+    return bills
+
+
+def _write_manifest(manifest):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with open(ARCHIVE_MANIFEST + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    durable_replace(ARCHIVE_MANIFEST + ".tmp", ARCHIVE_MANIFEST)
+
+
+def archive_year(path, year, user=None):
+    """Move the bills of financial year `year` out of the store `path` into a read-only partition.
+
+    The partition is written and recorded in the manifest before the bills are removed from the
+    store, so a crash in between leaves them in both places; finish_archiving() then drops the
+    leftovers from the store. Returns the number of bills archived.
+    """
+    with excel_lock:
+        if year in archived_years(path):
+            return 0
+        _audit_baseline(path)
+        df = _table(path)
+        if "date" not in df.columns or not len(df):
+            return 0
+        first, last = year_bounds(year)
+        days = _date_index((path, True), df)[0]
+        inside = (days >= _epoch_day(first)) & (days <= _epoch_day(last))
+        if not inside.any():
+            return 0
+
+        stem = os.path.splitext(os.path.basename(path))[0]
+        target = os.path.join(ARCHIVE_DIR, stem, f"FY{year}.xlsx")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        part = df[inside].reset_index(drop=True)
+        with open(target + ".tmp", "wb") as f:
+            part.to_excel(f, index=False, engine='openpyxl')
+        if os.path.exists(target):
+            os.chmod(target, 0o644)
+        durable_replace(target + ".tmp", target)
+        os.chmod(target, 0o444)  # read-only, on Windows as well
+        with open(target, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+
+        manifest = dict(_manifest())
+        manifest[path] = dict(manifest.get(path, {}), **{year: {
+            "file": target, "rows": len(part), "first": first.isoformat(), "last": last.isoformat(),
+            "sha256": digest, "archived_at": datetime.now().isoformat(timespec="seconds"), "user": user,
+        }})
+        _write_manifest(manifest)
+
+        write_bills(path, df[~inside].reset_index(drop=True))
+        _audit(path, "archive", user, year=year, first=first.isoformat(), last=last.isoformat(), rows=len(part))
+        try:
+            audit_log.write_snapshot(audit_log.store_name(path), _audit_state(path))
+        except Exception as e:
+            print(f"Audit snapshot of {path} failed: {e}")
+    return len(part)
+
+
+def finish_archiving(path):
+    """Drop bills of archived years that are still in the store after an interrupted archive."""
+    with excel_lock:
+        closed = archived_years(path)
+        df = _table(path)
+        if not closed or "date" not in df.columns or not len(df):
+            return 0
+        days = _date_index((path, True), df)[0]
+        leftover = np.zeros(len(df), dtype=bool)
+        for year in closed:
+            first, last = year_bounds(year)
+            leftover |= (days >= _epoch_day(first)) & (days <= _epoch_day(last))
+        if leftover.any():
+            write_bills(path, df[~leftover].reset_index(drop=True))
+        return int(leftover.sum())
+
+
+def archive_closed_years(path, user=None):
+    """Archive every financial year of `path` that ended more than ARCHIVE_AFTER ago.
+
+    A year with bills deleted or amended since the last compaction waits for the next run, so
+    nothing restorable or unsaved is moved. Returns {year: bills archived}.
+    """
+    done = {}
+    finish_archiving(path)
+    df = _table(path)
+    if "date" not in df.columns or not len(df):
+        return done
+    tombstones, amendments = _journal(path)
+    pending = {str(b) for b in list(tombstones) + list(amendments)}
+    days = _date_index((path, True), df)[0]
+    valid = days[days != NO_DAY]
+    if not len(valid):
+        return done
+    years = sorted({financial_year(date(1970, 1, 1) + timedelta(days=int(d))) for d in np.unique(valid)})
+    for year in years:
+        first, last = year_bounds(year)
+        if datetime.now().date() - last < ARCHIVE_AFTER:
+            continue
+        inside = (days >= _epoch_day(first)) & (days <= _epoch_day(last))
+        if pending and "bill_no" in df.columns and df.loc[inside, "bill_no"].astype(str).isin(pending).any():
+            continue
+        done[year] = archive_year(path, year, user)
+        df = _table(path)
+        days = _date_index((path, True), df)[0]
+    return done
+
+
+# Filters offered on the view pages, by store column
+VIEW_FILTERS = ["date", "bill_no", "mill_name", "farmer_name", "rice_type"]
+
+
+def view_filters(args):
+    """The view-page filters set in `args`, with a YYYY-MM-DD date turned into the stored dd-mm-YYYY."""
+    filters = {key: args.get(key) for key in VIEW_FILTERS if args.get(key)}
+    if "date" in filters:
+        try:
+            filters["date"] = datetime.strptime(filters["date"], "%Y-%m-%d").strftime("%d-%m-%Y")
+        except ValueError:
+            pass  # already in the stored format
+    return filters
+
+
+def parse_range(args):
+    """(first, last) dates from the from_date/to_date (YYYY-MM-DD) arguments; either may be None."""
+    bounds = []
+    for key, label in (("from_date", "From"), ("to_date", "To")):
+        value = (args.get(key) or "").strip()
+        try:
+            bounds.append(datetime.strptime(value, "%Y-%m-%d").date() if value else None)
+        except ValueError:
+            raise ValueError(f"{label} date must be a date like 2025-10-26") from None
+    first, last = bounds
+    if first and last and first > last:
+        raise ValueError("From date is after To date")
+    return first, last
+
+
+# Epoch day of rows whose date is empty or not dd-mm-YYYY; sorts before every real day
+NO_DAY = np.iinfo(np.int64).min
+
+# Date index per table: (path, include_deleted) -> (table, day of each row, row positions
+# ordered by day, the days in that order)
+_date_cache = {}
+
+
+def _epoch_day(day):
+    return (day - date(1970, 1, 1)).days
+
+
+def _date_index(key, df):
+    """(days, order, sorted_days) for `df`, built once per version of the table.
+
+    Bills are stored with dd-mm-YYYY text dates, which is what the PDFs, bill numbers and the
+    existing workbooks use, so the native epoch-day column lives here next to the cached table
+    rather than in the file. Each distinct date string is parsed once.
+    """
+    cached = _date_cache.get(key)
+    if cached and cached[0] is df:
+        return cached[1:]
+    codes, uniques = pd.factorize(df["date"])
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format="%d-%m-%Y", errors="coerce")
+    unique_days = np.where(parsed.isna(), NO_DAY, parsed.to_numpy().astype("datetime64[D]").astype(np.int64))
+    days = np.where(codes >= 0, unique_days[codes] if len(unique_days) else NO_DAY, NO_DAY)
+    order = np.argsort(days, kind="stable")
+    index = (days, order, days[order])
+    _date_cache[key] = (df,) + index
+    return index
+
+
+def _split_date_filter(filters, date_range):
+    """(other filters, first, last): an exact date filter in `filters` narrows `date_range`."""
+    filters = dict(filters or {})
+    first, last = date_range or (None, None)
+    if "date" in filters:
+        try:
+            day = datetime.strptime(filters["date"], "%d-%m-%Y").date()
+        except ValueError:
+            day = None  # not a real date: compared as text
+        if day:
+            del filters["date"]
+            first, last = max(first or day, day), min(last or day, day)
+    return filters, first, last
+
+
+def _select_table(table_path, filters, first, last, include_deleted=False):
+    """(table, positions, days) for the rows of one file matching `filters` and first..last.
+
+    `positions` are the matching row positions in store order, or None when every row matches;
+    `days` is the date index of the table, or None when it was not needed. The date range is
+    answered by binary search on the date index, so only the rows inside it are looked at.
+    Returns positions of length 0 when a filter column is missing.
+    """
+    df = _table(table_path) if include_deleted else _live(table_path)
+    nothing = np.empty(0, dtype=np.int64)
+    if not len(df.columns):
+        return df, nothing, None
+
+    positions, days = None, None
+    if first or last:
+        if "date" not in df.columns:
+            return df, nothing, None
+        days, order, sorted_days = _date_index((table_path, include_deleted), df)
+        lo = np.searchsorted(sorted_days, _epoch_day(first) if first else NO_DAY + 1, "left")
+        hi = np.searchsorted(sorted_days, _epoch_day(last), "right") if last else len(sorted_days)
+        positions = np.sort(order[lo:max(lo, hi)])
+
+    for col, value in filters.items():
+        if col not in df.columns:
+            return df, nothing, days
+        column = df[col] if positions is None else df[col].take(positions)
+        if col == "bill_no":
+            column = column.astype(str)
+        hits = (column == value).to_numpy()
+        positions = np.flatnonzero(hits) if positions is None else positions[hits]
+    return df, positions, days
+
+
+def _selections(path, filters=None, date_range=None, include_deleted=False, archived=True):
+    """[(file, table, positions, days)] over the partitions of `path` the query can touch.
+
+    Archived financial years are only opened when the date range reaches into them, and not at
+    all when `archived` is False.
+    """
+    filters, first, last = _split_date_filter(filters, date_range)
+    files = partitions(path, (first, last)) if archived else [path]
+    return [(f,) + _select_table(f, filters, first, last, include_deleted) for f in files]
+
+
+def _picked(table_path, df, positions, days, include_deleted, parse_dates):
+    out = df.copy() if positions is None else df.take(positions)
+    if parse_dates and "date" in out.columns:
+        if days is None:
+            days = _date_index((table_path, include_deleted), df)[0]
+        picked = days if positions is None else days[positions]
+        values = picked.astype("datetime64[D]")
+        values[picked == NO_DAY] = np.datetime64("NaT")
+        out["date"] = values.astype("datetime64[ns]")
+    return out
+
+
+def select_bills(path, filters=None, date_range=None, include_deleted=False, parse_dates=False, archived=True):
+    """The bills of `path` matching `filters` and `date_range` as a new DataFrame, archived
+    years first and then the open store, each in store order.
+
+    With `parse_dates` the "date" column holds datetimes taken from the date index (NaT where
+    the stored date is unreadable) instead of the stored text.
+    """
+    parts = [_picked(f, df, positions, days, include_deleted, parse_dates)
+             for f, df, positions, days in _selections(path, filters, date_range, include_deleted, archived)]
+    parts = [p for p in parts if len(p.columns)] or parts
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat([p for p in parts if len(p)] or parts[-1:], ignore_index=True)
+
+
+def count_bills(path, filters=None, date_range=None):
+    """Number of bills in `path` matching `filters` and `date_range`."""
+    return sum(len(df) if positions is None else len(positions)
+               for _, df, positions, _ in _selections(path, filters, date_range))
+
+
+# Rows copied out of the cached table at a time while streaming a filtered selection
+ITER_BLOCK = 10000
+
+
+def iter_bills(path, filters=None, columns=None, date_range=None):
+    """Iterate over the column names, then every bill matching `filters` and `date_range` as a tuple.
+
+    `columns` picks and orders the columns; ones the store does not have come out as None.
+    Unfiltered rows are read one at a time from the cached table; a filtered selection is copied
+    out ITER_BLOCK rows at a time, so memory use does not grow with the size of the store.
+
+    The store and its partitions are opened by this call, not when the first row is asked for:
+    a damaged store raises StoreCorruptError here, before a streamed download has sent its headers.
+    """
+    selections = [s for s in _selections(path, filters, date_range) if len(s[1].columns)]
+    if columns is None and selections:
+        # The open store's columns first, then any that only older partitions have
+        columns = list(dict.fromkeys(c for s in reversed(selections) for c in s[1].columns))
+    return _iter_rows(selections, columns)
+
+
+def _iter_rows(selections, columns):
+    if columns is None:
+        return
+    yield tuple(columns)
+    for _, df, positions, _ in selections:
+        picks = [df.columns.get_loc(c) if c in df.columns else None for c in columns]
+        same = picks == list(range(len(df.columns)))
+        if positions is None:
+            blocks = [df]
+        else:
+            blocks = (df.take(positions[i:i + ITER_BLOCK]) for i in range(0, len(positions), ITER_BLOCK))
+        for block in blocks:
+            for row in block.itertuples(index=False, name=None):
+                yield row if same else tuple(None if i is None else row[i] for i in picks)
+
+
+def select_bill_nos(path, bill_nos):
+    """The bills numbered `bill_nos` in `path`, looked up only in the partitions of the days their
+    numbers carry (every partition for numbers without a date)."""
+    wanted = {str(b) for b in bill_nos}
+    days = [bill_no_day(b) for b in wanted]
+    if all(days) and days:
+        files = list(dict.fromkeys(f for d in days for f in partitions(path, (d, d))))
+    else:
+        files = partitions(path)
+    parts = []
+    for f in files:
+        df = _live(f)
+        if "bill_no" in df.columns:
+            parts.append(df[df["bill_no"].astype(str).isin(wanted)])
+    parts = [p for p in parts if len(p)]
+    return pd.concat(parts, ignore_index=True) if len(parts) > 1 else (parts[0].copy() if parts else pd.DataFrame())
+
+
+def write_bills(path, df):
+    """Write `df` as the whole store and keep the cached table in step with the file.
+
+    The workbook is written to <path>.tmp and only then renamed over the store, so a crash or
+    power cut mid-write leaves the previous store in place rather than a truncated one.
+    """
+    tmp = path + ".tmp"
+    with span("storage_write"):
+        with open(tmp, "wb") as f:
+            df.to_excel(f, index=False, engine='openpyxl')
+        durable_replace(tmp, path)
+    _table_cache[path] = (_stamp(path), df.copy())
+
+
+def is_warm():
+    """True when every existing store is parsed and cached at its current on-disk version."""
+    for path in BILL_FILES:
+        if not os.path.exists(path):
+            continue
+        cached = _table_cache.get(path)
+        if not cached or cached[0] != _stamp(path):
+            return False
+    return True
+
+
+def warm():
+    """Parse every store into the cache. Returns {path: error} for stores that failed to load."""
+    errors = {}
+    for path in BILL_FILES:
+        try:
+            live = _live(path)
+            if "date" in live.columns:
+                _date_index((path, False), live)
+        except Exception as e:
+            errors[path] = str(e)
+    return errors
+
+
+def _trim_torn_line(file_path):
+    """Cut an incomplete last line (from a crash mid-append) off `file_path`, so the next append
+    starts on a line of its own. Returns True when something was cut."""
+    with open(file_path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if not end:
+            return False
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return False
+        pos = end
+        while pos > 0:
+            start = max(0, pos - 64 * 1024)
+            f.seek(start)
+            cut = f.read(pos - start).rfind(b"\n")
+            if cut >= 0:
+                f.truncate(start + cut + 1)
+                return True
+            pos = start
+        f.truncate(0)
+        return True
+
+
+def _workbook_ok(path):
+    """True when `path` is a complete workbook (every part of it matches its CRC)."""
+    try:
+        with zipfile.ZipFile(path) as z:
+            return z.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+
+def recover():
+    """Startup check after a possible crash.
+
+    Removes the .tmp files of interrupted writes (the stores themselves are only ever replaced
+    whole, so they are intact), cuts torn last lines off the journals, histories and audit
+    logs, and checks every store and archived partition. A damaged store is reported, and reading or writing it
+    raises StoreCorruptError until it is restored; it is never treated as empty.
+
+    Returns {"ok", "removed", "trimmed", "corrupt": {path: reason}}.
+    """
+    report = {"ok": True, "removed": [], "trimmed": [], "corrupt": {}}
+    logs = [p for store in BILL_FILES for p in (journal_path(store), history_path(store))]
+    if os.path.isdir(audit_log.AUDIT_DIR):
+        for dirpath, _, names in os.walk(audit_log.AUDIT_DIR):
+            for name in names:
+                if name.endswith(".tmp"):
+                    os.remove(os.path.join(dirpath, name))
+                    report["removed"].append(os.path.join(dirpath, name))
+                elif name.endswith(".jsonl"):
+                    logs.append(os.path.join(dirpath, name))
+    leftovers = [p + ".tmp" for p in BILL_FILES + [journal_path(store) for store in BILL_FILES] + [ARCHIVE_MANIFEST]]
+    partitions_on_disk = []
+    for dirpath, _, names in os.walk(ARCHIVE_DIR):
+        leftovers += [os.path.join(dirpath, n) for n in names if n.endswith(".tmp")]
+        partitions_on_disk += [os.path.join(dirpath, n) for n in names if n.endswith(".xlsx")]
+    for path in leftovers:
+        if os.path.exists(path):
+            os.remove(path)
+            report["removed"].append(path)
+    for path in logs:
+        if os.path.exists(path) and _trim_torn_line(path):
+            report["trimmed"].append(path)
+    for path in BILL_FILES + partitions_on_disk:
+        if os.path.exists(path) and not _workbook_ok(path):
+            report["corrupt"][path] = "not a complete workbook"
+            report["ok"] = False
+    return report
+
+
+def storage_status():
+    """Cheap readiness check of the data directory and the bill workbooks."""
+    files = {}
+    ok = os.access(".", os.W_OK)
+    for path in BILL_FILES:
+        if not os.path.exists(path):
+            files[path] = "missing"
+        elif zipfile.is_zipfile(path):
+            files[path] = "ok"
+        else:
+            files[path] = "corrupt"
+            ok = False
+    return {"ok": ok, "writable": os.access(".", os.W_OK), "files": files}
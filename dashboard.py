@@ -0,0 +1,427 @@
+"""Data behind the analytics dashboard.
+
+The dashboard page fetches each widget (KPIs, the time series, the top-5 charts and the record
+tables) from /api/analytics/<widget> in parallel. All widgets of one filter combination share
+the same filtered sale and purchase bills, loaded once and kept for the next few requests, so a
+widget only pays for its own aggregation. Finished answers are kept in a size-bounded LRU cache
+until the stores change, so the filter combinations people keep coming back to cost a lookup.
+"""
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from bill_store import SALE_FILE, PURCHASE_FILE, StoreCorruptError, select_bills, store_version
+
+# Query parameters of the dashboard, in the order of the filter key
+FILTERS = ["from_date", "to_date", "mill", "village", "farmer", "lorry", "rice_type"]
+
+# Filtered (sales, purchase) frames: (filter key, store versions) -> frames, oldest first
+_frames_cache = {}
+_frames_lock = Lock()
+FRAMES_KEEP = 4
+
+# Points a time-series widget sends at most, unless the page asks for another number (?points=N)
+MAX_POINTS = 120
+POINTS_RANGE = (12, 1000)
+
+# Resolutions of the time series, finest first, with their length in days
+RESOLUTION_DAYS = {"day": 1, "week": 7, "month": 30.44}
+
+RECORDS_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+# Widget answers as JSON: (widget, filter key, widget parameters, store versions) -> body,
+# least recently used first, bounded by the total size of the bodies
+_results = OrderedDict()
+_results_lock = Lock()
+CACHE_BYTES = int(float(os.environ.get("BILLING_ANALYTICS_CACHE_MB", "32")) * 1024 * 1024)
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+# Query parameters, other than the filters, that change a widget's answer
+WIDGET_PARAMS = ["points", "resolution", "downsample", "kind", "page", "per_page"]
+
+
+def filter_key(args):
+    """The dashboard filters in `args` (a request's query args) as a tuple in FILTERS order.
+    Dates are normalized to YYYY-MM-DD, or "" when missing or invalid (they are ignored then)."""
+    key = [(args.get(name) or "").strip() for name in FILTERS]
+    key[:2] = [day.isoformat() if day else "" for day in analytics_range(key[0], key[1])]
+    return tuple(key)
+
+
+def safe_read_excel(path, date_range=None):
+    """Bills of `path` within `date_range`, with the date column already parsed."""
+    if os.path.exists(path):
+        try:
+            return select_bills(path, date_range=date_range, parse_dates=True)
+        except StoreCorruptError:
+            raise  # showing zeros for a damaged store would hide the damage
+        except Exception as e:
+            print(f"Error reading Excel {path}: {e}")
+            return pd.DataFrame()
+    return pd.DataFrame()
+
+
+def prep_df(df):
+    if df.empty:
+        return df
+    needed = [
+        "date", "mill_name", "village_name", "farmer_name", "rice_type",
+        "lorry_no", "bags", "ntwt", "net_bags", "amount", "rmc"
+    ]
+    for col in needed:
+        if col not in df.columns:
+            df[col] = pd.NA
+    # Convert date with strict parsing (safe_read_excel has done it already) and drop NaT
+    if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df["date"] = pd.to_datetime(df["date"], format="%d-%m-%Y", errors="coerce")
+    df = df.dropna(subset=["date"])  # Explicitly drop rows with NaT dates
+    for col in ["bags", "ntwt", "net_bags", "amount", "rmc"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+    for col in ["mill_name", "village_name", "farmer_name", "rice_type", "lorry_no"]:
+        df[col] = df[col].astype(str).str.strip()
+        df.loc[df[col].isin(["", "nan", "NaN", "None"]), col] = ""
+    # Log any problematic dates for debugging
+    if df["date"].isna().any():
+        print("Warning: Found NaT values in date column after conversion")
+    return df
+
+
+def analytics_range(from_date, to_date):
+    """(first, last) dates for the analytics filters; a bound that is not a valid YYYY-MM-DD is ignored."""
+    bounds = []
+    for value in (from_date, to_date):
+        try:
+            bounds.append(datetime.strptime(value, "%Y-%m-%d").date() if value else None)
+        except ValueError:
+            bounds.append(None)
+    return tuple(bounds)
+
+
+def apply_common_filters(df, mill, village, farmer, lorry, rice_type):
+    # The date range is applied while reading (safe_read_excel), by binary search on the date index
+    if df.empty:
+        return df
+    if mill:
+        df = df[df["mill_name"] == mill]
+    if village:
+        df = df[df["village_name"] == village]
+    if farmer:
+        df = df[df["farmer_name"] == farmer]
+    if lorry:
+        df = df[df["lorry_no"] == lorry]
+    if rice_type:
+        df = df[df["rice_type"] == rice_type]
+    return df
+
+
+def frames(key):
+    """(sales_df, purchase_df) for the filter key, prepared and filtered. Callers must not modify them."""
+    cache_key = (key, store_version(SALE_FILE), store_version(PURCHASE_FILE))
+    # One lock, so the widgets of a page that arrive together load the bills once between them
+    with _frames_lock:
+        if cache_key in _frames_cache:
+            return _frames_cache[cache_key]
+        from_date, to_date, mill, village, farmer, lorry, rice_type = key
+        date_range = analytics_range(from_date, to_date)
+        sales_df = prep_df(safe_read_excel(SALE_FILE, date_range))
+        purchase_df = prep_df(safe_read_excel(PURCHASE_FILE, date_range))
+        result = (apply_common_filters(sales_df, mill, village, farmer, lorry, rice_type),
+                  apply_common_filters(purchase_df, mill, village, farmer, lorry, rice_type))
+        _frames_cache[cache_key] = result
+        while len(_frames_cache) > FRAMES_KEEP:
+            _frames_cache.pop(next(iter(_frames_cache)))
+        return result
+
+
+def series_to_aligned_lists(s1, s2):
+    idx = s1.index.union(s2.index).sort_values()
+    lab = [str(i) for i in idx]
+    a = s1.reindex(idx, fill_value=0).astype(float).tolist()
+    b = s2.reindex(idx, fill_value=0).astype(float).tolist()
+    return lab, a, b
+
+
+def _period(df, resolution):
+    """Group key of each bill for `resolution`: its day, the start of its ISO week, or its month."""
+    if resolution == "week":
+        return df["date"].dt.to_period("W").dt.start_time.dt.date
+    return df["date"].dt.to_period("D" if resolution == "day" else "M")
+
+
+def _points(args):
+    try:
+        points = int(args.get("points", MAX_POINTS))
+    except ValueError:
+        raise ValueError("points must be a whole number")
+    return min(max(points, POINTS_RANGE[0]), POINTS_RANGE[1])
+
+
+def _resolution(args, sales_df, purchase_df, points):
+    """The resolution asked for, or with ?resolution=auto the finest one that fits the range in `points`."""
+    resolution = args.get("resolution", "auto")
+    if resolution != "auto":
+        if resolution not in RESOLUTION_DAYS:
+            raise ValueError(f"resolution must be auto or one of {', '.join(RESOLUTION_DAYS)}")
+        return resolution
+    first, last = analytics_range(args.get("from_date", ""), args.get("to_date", ""))
+    dates = [df["date"] for df in (sales_df, purchase_df) if not df.empty]
+    if dates:
+        first = first or min(d.min() for d in dates).date()
+        last = last or max(d.max() for d in dates).date()
+    if not (first and last):
+        return "day"
+    days = (last - first).days + 1
+    for resolution, length in RESOLUTION_DAYS.items():
+        if days / length <= points:
+            return resolution
+    return "month"
+
+
+def bucket_sums(labels, columns, points):
+    """Sum runs of consecutive points into `points` buckets, each labelled by its first point.
+    For bar charts: the totals stay the same, only coarser."""
+    starts = np.linspace(0, len(labels), points, endpoint=False).astype(int)
+    return [labels[i] for i in starts], [np.add.reduceat(np.asarray(c, dtype=float), starts).tolist() for c in columns]
+
+
+def lttb(values, points):
+    """Positions of the `points` values that Largest-Triangle-Three-Buckets keeps for a line chart:
+    the first and last, and from each bucket in between the value making the largest triangle
+    with the value kept before it and the average of the next bucket. Peaks and dips survive."""
+    y = np.asarray(values, dtype=float)
+    n = len(y)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    keep = [0]
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = (hi + next_hi - 1) / 2, y[hi:next_hi].mean()
+        a = keep[-1]
+        x = np.arange(lo, hi)
+        area = np.abs((a - next_x) * (y[lo:hi] - y[a]) - (a - x) * (next_y - y[a]))
+        keep.append(lo + int(area.argmax()))
+    keep.append(n - 1)
+    return np.array(keep)
+
+
+def downsample(labels, columns, points, method="bucket"):
+    """At most about `points` aligned points of `columns` (lists of values per label)."""
+    if len(labels) <= points:
+        return labels, columns
+    if method == "lttb":
+        # Keep what either series needs, so both stay aligned on the same labels
+        keep = np.unique(np.concatenate([lttb(c, max(points // len(columns), 3)) for c in columns]))
+        return [labels[i] for i in keep], [np.asarray(c, dtype=float)[keep].tolist() for c in columns]
+    if method == "bucket":
+        return bucket_sums(labels, columns, points)
+    raise ValueError("downsample must be bucket or lttb")
+
+
+def _time_series(sales_df, purchase_df, args, resolution, method):
+    """Sales and purchase totals per `resolution` period (None: from ?resolution), downsampled
+    to the ?points asked for."""
+    points = _points(args)
+    resolution = resolution or _resolution(args, sales_df, purchase_df, points)
+    by = lambda df: _period(df, resolution)  # noqa: E731
+    labels, sales, purchase = series_to_aligned_lists(_amount_by(sales_df, by), _amount_by(purchase_df, by))
+    periods = len(labels)
+    labels, (sales, purchase) = downsample(labels, [sales, purchase], points, args.get("downsample", method))
+    return {"resolution": resolution, "periods": periods, "downsampled": len(labels) < periods,
+            "labels": labels, "sales": sales, "purchase": purchase}
+
+
+def _amount_by(df, by):
+    return df.groupby(by(df))["amount"].sum() if not df.empty else pd.Series(dtype=float)
+
+
+def _top(df, column, value, n=5):
+    """Labels and values of the `n` largest sums of `value` per non-empty `column`."""
+    if df.empty or column not in df.columns:
+        return {"labels": [], "values": []}
+    top = df[df[column] != ""].groupby(column)[value].sum().sort_values(ascending=False).head(n)
+    return {"labels": top.index.tolist(), "values": [float(v) for v in top.values.tolist()]}
+
+
+def kpis(sales_df, purchase_df, args):
+    return {
+        "sales": {
+            "total_bags": float(sales_df["bags"].sum()) if not sales_df.empty else 0,
+            "total_ntwt": float(sales_df["ntwt"].sum()) if not sales_df.empty else 0,
+            "total_net_bags": float(sales_df["net_bags"].sum()) if not sales_df.empty else 0,
+            "total_count": int(len(sales_df)),
+            "total_sales": float(sales_df["amount"].sum()) if not sales_df.empty else 0,
+        },
+        "purchase": {
+            "total_bags": float(purchase_df["bags"].sum()) if not purchase_df.empty else 0,
+            "total_ntwt": float(purchase_df["ntwt"].sum()) if not purchase_df.empty else 0,
+            "total_net_bags": float(purchase_df["net_bags"].sum()) if not purchase_df.empty else 0,
+            "total_count": int(len(purchase_df)),
+            "total_purchase": float(purchase_df["amount"].sum()) if not purchase_df.empty else 0,
+        },
+    }
+
+
+def options(sales_df, purchase_df, args):
+    """Values for the filter dropdowns, from both stores."""
+    combined = pd.concat([sales_df, purchase_df], ignore_index=True) if not sales_df.empty or not purchase_df.empty else pd.DataFrame(columns=["mill_name","village_name","farmer_name","lorry_no","rice_type"])
+    return {
+        "mills": sorted([m for m in combined.get("mill_name", pd.Series()).dropna().unique().tolist() if m]),
+        "villages": sorted([v for v in combined.get("village_name", pd.Series()).dropna().unique().tolist() if v]),
+        "farmers": sorted([f for f in combined.get("farmer_name", pd.Series()).dropna().unique().tolist() if f]),
+        "lorries": sorted([l for l in combined.get("lorry_no", pd.Series()).dropna().unique().tolist() if l]),
+        "rice_types": sorted([r for r in combined.get("rice_type", pd.Series()).dropna().unique().tolist() if r]),
+    }
+
+
+def daily(sales_df, purchase_df, args):
+    """Totals over time. With ?resolution=auto (the default) per day, week or month, whichever
+    fits the range in ?points bars; longer histories are summed into ?points buckets."""
+    return _time_series(sales_df, purchase_df, args, None, "bucket")
+
+
+def weekly(sales_df, purchase_df, args):
+    """Totals per ISO week, labelled with the week's start date."""
+    return _time_series(sales_df, purchase_df, args, "week", "bucket")
+
+
+def monthly(sales_df, purchase_df, args):
+    """Sums per month (a line chart, so long histories are thinned out with LTTB)."""
+    return _time_series(sales_df, purchase_df, args, "month", "lttb")
+
+
+def diff(sales_df, purchase_df, args):
+    """Sales minus purchase per month."""
+    series = _time_series(sales_df, purchase_df, args, "month", "bucket")
+    values = (np.asarray(series.pop("sales")) - np.asarray(series.pop("purchase"))).tolist()
+    return {**series, "values": values}
+
+
+def top_farmers(sales_df, purchase_df, args):
+    return _top(purchase_df, "farmer_name", "amount")
+
+
+def top_mills(sales_df, purchase_df, args):
+    return _top(sales_df, "mill_name", "amount")
+
+
+def top_villages(sales_df, purchase_df, args):
+    return _top(purchase_df, "village_name", "bags")
+
+
+def top_trucks(sales_df, purchase_df, args):
+    """Top lorries by bags over sales and purchases together."""
+    parts = [df[["lorry_no", "bags"]] for df in (sales_df, purchase_df) if not df.empty]
+    return _top(pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(), "lorry_no", "bags")
+
+
+# Columns of the record tables: output name -> bill column
+RECORD_COLUMNS = {
+    "sale": {"mill": "mill_name", "farmer": "farmer_name", "rice_type": "rice_type", "lorry": "lorry_no",
+             "bags": "bags", "ntwt": "ntwt", "amount": "amount", "rmc": "rmc"},
+    "purchase": {"mill": "mill_name", "farmer": "farmer_name", "village": "village_name", "rice_type": "rice_type",
+                 "lorry": "lorry_no", "bags": "bags", "ntwt": "ntwt", "amount": "amount"},
+}
+
+
+def records(sales_df, purchase_df, args):
+    """One page of the sale or purchase records table: ?kind=sale|purchase&page=1&per_page=50."""
+    kind = args.get("kind", "sale")
+    if kind not in RECORD_COLUMNS:
+        raise ValueError("kind must be sale or purchase")
+    try:
+        page = max(int(args.get("page", 1)), 1)
+        per_page = min(max(int(args.get("per_page", RECORDS_PER_PAGE)), 1), MAX_PER_PAGE)
+    except ValueError:
+        raise ValueError("page and per_page must be whole numbers")
+    df = sales_df if kind == "sale" else purchase_df
+    total = len(df)
+    part = df.iloc[(page - 1) * per_page:page * per_page]
+    rows = []
+    if total:
+        columns = RECORD_COLUMNS[kind]
+        part = part[list(columns.values())].rename(columns={col: name for name, col in columns.items()})
+        part = part.astype(object).where(part.notna(), "")  # NaN is not valid JSON
+        rows = part.to_dict("records")
+        for row, day in zip(rows, df["date"].iloc[(page - 1) * per_page:page * per_page]):
+            row["date"] = day.strftime("%d-%m-%Y") if pd.notnull(day) else ""
+    return {"kind": kind, "page": page, "per_page": per_page, "total": total,
+            "pages": max((total + per_page - 1) // per_page, 1), "rows": rows}
+
+
+WIDGETS = {
+    "kpis": kpis, "options": options, "daily": daily, "weekly": weekly, "monthly": monthly, "diff": diff,
+    "top-farmers": top_farmers, "top-mills": top_mills, "top-villages": top_villages, "top-trucks": top_trucks,
+    "records": records,
+}
+
+
+def widget(name, args):
+    """JSON-ready data of the widget `name` for the filters in `args`. Raises KeyError for an
+    unknown widget and ValueError for bad parameters."""
+    compute = WIDGETS[name]
+    sales_df, purchase_df = frames(filter_key(args))
+    return compute(sales_df, purchase_df, args)
+
+
+def widget_json(name, args):
+    """(JSON body, cache hit) of the widget `name` for `args`, from the result cache when the
+    same widget was asked for with the same filters since the stores last changed."""
+    key = (name, filter_key(args), tuple(args.get(param, "") for param in WIDGET_PARAMS),
+           store_version(SALE_FILE), store_version(PURCHASE_FILE))
+    with _results_lock:
+        body = _results.get(key)
+        if body is not None:
+            _results.move_to_end(key)
+            cache_stats["hits"] += 1
+            return body, True
+        cache_stats["misses"] += 1
+    body = json.dumps(widget(name, args), separators=(",", ":"))
+    if len(body) <= CACHE_BYTES:
+        with _results_lock:
+            if key not in _results:
+                _results[key] = body
+                cache_stats["bytes"] += len(body)
+            while cache_stats["bytes"] > CACHE_BYTES:
+                _, old = _results.popitem(last=False)
+                cache_stats["bytes"] -= len(old)
+                cache_stats["evictions"] += 1
+    return body, False
+
+
+def clear_cache():
+    """Forget every cached result and filtered frame."""
+    with _results_lock:
+        _results.clear()
+        cache_stats["bytes"] = 0
+    with _frames_lock:
+        _frames_cache.clear()
+
+
+def metrics_lines():
+    """Result cache counters for /metrics."""
+    with _results_lock:
+        stats, entries = dict(cache_stats), len(_results)
+    return [
+        "# HELP billing_analytics_cache_requests_total Analytics widget requests answered from the result cache (hit) or computed (miss).",
+        "# TYPE billing_analytics_cache_requests_total counter",
+        f'billing_analytics_cache_requests_total{{result="hit"}} {stats["hits"]}',
+        f'billing_analytics_cache_requests_total{{result="miss"}} {stats["misses"]}',
+        "# HELP billing_analytics_cache_evictions_total Results dropped to stay within the cache size.",
+        "# TYPE billing_analytics_cache_evictions_total counter",
+        f"billing_analytics_cache_evictions_total {stats['evictions']}",
+        "# HELP billing_analytics_cache_bytes Size of the cached results.",
+        "# TYPE billing_analytics_cache_bytes gauge",
+        f"billing_analytics_cache_bytes {stats['bytes']}",
+        f"billing_analytics_cache_limit_bytes {CACHE_BYTES}",
+        "# HELP billing_analytics_cache_entries Number of cached results.",
+        "# TYPE billing_analytics_cache_entries gauge",
+        f"billing_analytics_cache_entries {entries}",
+    ]
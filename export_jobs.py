@@ -0,0 +1,155 @@
+"""One workbook with the sale, purchase and transport bills, each read from its own store.
+
+Small date ranges are streamed straight back to the browser. Larger ones run as a background
+job that writes into exports/, and the export page links to the file once the job has finished.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+
+from bill_store import SALE_FILE, PURCHASE_FILE, TRANSPORT_FILE, count_bills, iter_bills
+from xlsx_stream import stream_xlsx
+
+EXPORT_DIR = "exports"
+
+# Ranges with more bills than this are exported in the background
+INLINE_ROW_LIMIT = 20000
+
+# Finished export files (and their jobs) are removed after this long
+EXPORT_RETENTION = timedelta(hours=24)
+
+# Excel cell types for exported columns; bill numbers, phone and lorry numbers stay text
+EXPORT_COLUMN_TYPES = {
+    "bill_type": "text", "bill_no": "text", "ref": "text", "date": "date",
+    "mobile_no": "text", "lorry_no": "text", "mill_code": "text",
+    "bags": "int",
+    "ntwt": "number", "stwt": "number", "sut_rate": "number", "net_bags": "number",
+    "total_ntwt": "number", "kgs": "number",
+    "price": "money", "rate": "money", "amount": "money", "commission": "money", "hamali": "money",
+    "gunny": "money", "advance": "money", "rmc": "money", "grand_total": "money",
+    "weigh_bridge": "money", "lorry_freight": "money", "zero_charge": "money",
+}
+
+SALE_EXPORT_COLUMNS = [
+    'bill_type', 'bill_no', 'date', 'mill_name', 'mill_code', 'farmer_name', 'rice_type',
+    'bags', 'ntwt', 'stwt', 'sut_rate', 'price', 'net_bags',
+    'amount', 'commission', 'hamali', 'gunny', 'advance', 'rmc',
+    'grand_total', 'lorry_no', 'mobile_no'
+]
+PURCHASE_EXPORT_COLUMNS = [
+    'bill_type', 'bill_no', 'date', 'farmer_name', 'village_name', 'mill_name', 'rice_type',
+    'bags', 'ntwt', 'sut_rate', 'stwt', 'total_ntwt', 'rate',
+    'amount', 'hamali', 'weigh_bridge', 'grand_total', 'lorry_no'
+]
+TRANSPORT_EXPORT_COLUMNS = [
+    'bill_type', 'bill_no', 'date', 'ref', 'ms', 'from_location', 'to_location', 'bags', 'kgs',
+    'rice_type', 'lorry_no', 'lorry_freight', 'zero_charge', 'advance', 'mobile_no', 'freight_in_words'
+]
+
+# Sheet name, store and columns of each sheet in the export
+EXPORT_SHEETS = [
+    ("Sale Bills", SALE_FILE, SALE_EXPORT_COLUMNS),
+    ("Purchase Bills", PURCHASE_FILE, PURCHASE_EXPORT_COLUMNS),
+    ("Transport Bills", TRANSPORT_FILE, TRANSPORT_EXPORT_COLUMNS),
+]
+
+# job id -> job dict; see start_job()
+_jobs = {}
+_jobs_lock = Lock()
+
+
+def range_label(date_range):
+    first, last = date_range
+    if not first and not last:
+        return "all dates"
+    return f"{first.strftime('%d-%m-%Y') if first else 'start'} to {last.strftime('%d-%m-%Y') if last else 'today'}"
+
+
+def export_filename(date_range):
+    first, last = date_range
+    if not first and not last:
+        return "bills_export_all.xlsx"
+    return f"bills_export_{first or 'start'}_to_{last or 'today'}.xlsx"
+
+
+def count_rows(date_range):
+    """Total bills across all sheets for `date_range`."""
+    return sum(count_bills(path, date_range=date_range) for _, path, _ in EXPORT_SHEETS)
+
+
+def export_chunks(date_range):
+    """Yield the bytes of the multi-sheet workbook for `date_range`."""
+    sheets = [(name, iter_bills(path, columns=columns, date_range=date_range))
+              for name, path, columns in EXPORT_SHEETS]
+    return stream_xlsx(sheets, EXPORT_COLUMN_TYPES)
+
+
+def start_job(date_range, user, rows):
+    """Start a background export of `date_range` and return its job."""
+    prune()
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "running",
+        "user": user,
+        "range": range_label(date_range),
+        "rows": rows,
+        "filename": export_filename(date_range),
+        "path": None,
+        "error": None,
+        "started": datetime.now(),
+        "finished": None,
+    }
+    with _jobs_lock:
+        _jobs[job["id"]] = job
+    Thread(target=_run, args=(job, date_range), name=f"export-{job['id'][:8]}", daemon=True).start()
+    return job
+
+
+def _run(job, date_range):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"{job['id']}.xlsx")
+    try:
+        with open(path + ".part", "wb") as f:
+            for chunk in export_chunks(date_range):
+                f.write(chunk)
+        os.replace(path + ".part", path)
+        job.update(status="done", path=path)
+    except Exception as e:
+        print(f"Export {job['id']} failed: {e}")
+        if os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+        job.update(status="failed", error=str(e))
+    job["finished"] = datetime.now()
+
+
+def get_job(job_id, user):
+    """The job `job_id` if it belongs to `user`, else None."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    return job if job and job["user"] == user else None
+
+
+def recent_jobs(user):
+    """Jobs of `user`, newest first."""
+    with _jobs_lock:
+        jobs = [j for j in _jobs.values() if j["user"] == user]
+    return sorted(jobs, key=lambda j: j["started"], reverse=True)
+
+
+def prune():
+    """Forget jobs older than EXPORT_RETENTION and delete old files, including ones left by an earlier run."""
+    cutoff = datetime.now() - EXPORT_RETENTION
+    with _jobs_lock:
+        old = [j for j in _jobs.values() if j["finished"] and j["finished"] < cutoff]
+        for job in old:
+            del _jobs[job["id"]]
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        if datetime.fromtimestamp(os.path.getmtime(path)) < cutoff:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Could not remove old export {path}: {e}")
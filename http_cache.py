@@ -0,0 +1,172 @@
+"""Response compression and HTTP validators.
+
+CompressionMiddleware wraps the WSGI app and compresses HTML, JSON, CSS, JS and other text
+responses of at least MIN_SIZE bytes (BILLING_COMPRESS_MIN_BYTES, default 1024). It uses brotli
+when the optional `brotli` package is installed and the client accepts it, and gzip otherwise.
+Streamed responses (the CSV and Excel downloads, which have no Content-Length) and responses
+that already carry a Content-Encoding (the pre-compressed /assets/ bundles, .csv.gz downloads)
+pass through untouched.
+
+validated(stores) makes a GET view conditional on the bill stores it reads. The response carries
+a weak ETag built from bill_store.store_version() and a Last-Modified from the newest of those
+files. A request whose If-None-Match still matches gets 304 Not Modified without running the
+view. Last-Modified is for information only: If-Modified-Since has one-second resolution and
+knows nothing of the user, the URL or the day, so it never produces a 304 on its own.
+"""
+import functools
+import gzip
+import hashlib
+import os
+import time
+import uuid
+from datetime import date, datetime, timezone
+
+from flask import Response, make_response, request, session
+from werkzeug.http import parse_accept_header
+
+import bill_store
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+MIN_SIZE = int(os.environ.get("BILLING_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # dynamic responses: most of the gain of 11 at a fraction of the CPU
+
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "application/manifest+json",
+                "image/svg+xml")
+
+# Part of every ETag, so a restart (new templates or code) never answers 304 for an old page
+APP_TOKEN = uuid.uuid4().hex[:8]
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(headers, *names):
+    names = {n.lower() for n in names}
+    return [(k, v) for k, v in headers if k.lower() not in names]
+
+
+def _encoding(environ):
+    """Best encoding the client accepts: "br", "gzip" or None."""
+    accepted = parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING", ""))
+    if brotli is not None and accepted["br"] > 0:
+        return "br"
+    if accepted["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """WSGI middleware compressing eligible responses (see the module docstring)."""
+
+    def __init__(self, app, min_size=MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    def _eligible(self, status, headers):
+        content_type = _header(headers, "Content-Type") or ""
+        length = _header(headers, "Content-Length")
+        return (status.startswith("200")
+                and content_type.startswith(COMPRESSIBLE)
+                and _header(headers, "Content-Encoding") is None
+                and "no-transform" not in (_header(headers, "Cache-Control") or "")
+                and length is not None and int(length) >= self.min_size)
+
+    def __call__(self, environ, start_response):
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured.update(status=status, headers=headers, exc_info=exc_info)
+            return lambda data: None  # Flask never uses the legacy write()
+
+        app_iter = self.app(environ, capture)
+        status, headers = captured["status"], captured["headers"]
+        content_type = _header(headers, "Content-Type") or ""
+        if content_type.startswith(COMPRESSIBLE) and _header(headers, "Content-Encoding") is None:
+            # The body differs by Accept-Encoding whether or not this particular one is compressed
+            vary = _header(headers, "Vary")
+            if not vary or "accept-encoding" not in vary.lower():
+                headers = _without(headers, "Vary") + [("Vary", f"{vary}, Accept-Encoding" if vary else "Accept-Encoding")]
+
+        encoding = _encoding(environ)
+        if encoding is None or environ.get("REQUEST_METHOD") == "HEAD" or not self._eligible(status, headers):
+            start_response(status, headers, captured["exc_info"])
+            return app_iter
+
+        t0 = time.perf_counter()
+        try:
+            body = b"".join(app_iter)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+        packed = compress(body, encoding)
+        if len(packed) >= len(body):
+            start_response(status, headers, captured["exc_info"])
+            return [body]
+
+        headers = _without(headers, "Content-Length") + [("Content-Length", str(len(packed))),
+                                                        ("Content-Encoding", encoding)]
+        etag = _header(headers, "ETag")
+        if etag and not etag.startswith("W/"):
+            # A strong ETag names one exact byte sequence; the compressed body is a different one
+            headers = _without(headers, "ETag") + [("ETag", "W/" + etag)]
+        timing = _header(headers, "Server-Timing")
+        if timing is not None:
+            headers = _without(headers, "Server-Timing") + [
+                ("Server-Timing", f"{timing}, compress;dur={(time.perf_counter() - t0) * 1000:.1f}")]
+        start_response(status, headers, captured["exc_info"])
+        return [packed]
+
+
+def _not_modified(etag):
+    return bool(request.if_none_match) and request.if_none_match.contains_weak(etag)
+
+
+def validated(stores):
+    """Decorator: answer GETs of the view with validators from the bill stores `stores(**view_args)`
+    returns, and with 304 while the ETag the browser sends back still matches.
+
+    Only used on views whose output depends on nothing but the URL, the logged-in user and those
+    stores. Pages carrying flashed messages are always rendered in full.
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def conditional_view(*args, **kwargs):
+            if request.method != "GET" or "user" not in session or session.get("_flashes"):
+                return view(*args, **kwargs)
+            versions = [bill_store.store_version(path) for path in stores(**kwargs)]
+            # The day counts too: Recently Deleted drops bills as they age past the retention
+            etag = hashlib.sha256(repr((APP_TOKEN, session["user"], request.full_path, date.today(), versions))
+                                  .encode("utf-8")).hexdigest()[:24]
+            stamps = [stamp[0] for version in versions for stamp in version if stamp]
+            last_modified = datetime.fromtimestamp(max(stamps) // 10**9, timezone.utc) if stamps else None
+
+            if _not_modified(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            # The pages sit behind the login: only the browser may keep them, and it asks every time
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return conditional_view
+    return decorate
@@ -0,0 +1,208 @@
+"""Idempotency keys for bill submissions.
+
+A client that may send the same bill more than once tags each submission with a random key.
+That covers a double-tapped submit button, the offline queue replaying after a dropped
+connection, or a retried request. The first submission with a key creates the bill, and the key
+is kept with its bill number in idempotency_keys.jsonl. Any later submission with the same key
+gets that bill back instead of a new one.
+
+The key is written (and flushed to disk) as pending before its bill is saved, and confirmed
+after, so a crash in between can never leave a saved bill without its key. At startup
+recover() settles the keys still pending: kept when their bill made it into the store, dropped
+when it did not.
+
+The index is bounded: keys are forgotten after KEY_TTL_DAYS (BILLING_IDEMPOTENCY_DAYS, default 7),
+and beyond MAX_KEYS (BILLING_IDEMPOTENCY_MAX_KEYS, default 10000) the oldest go first. The
+file is rewritten without expired, evicted or torn lines when it is loaded and whenever it
+holds twice as many lines as the index. Callers hold excel_lock around lookup(),
+remember() and confirm(), so checking a key and creating its bill happen together.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+import bill_store
+
+IDEMPOTENCY_FILE = "idempotency_keys.jsonl"
+KEY_TTL_DAYS = float(os.environ.get("BILLING_IDEMPOTENCY_DAYS", "7"))
+MAX_KEYS = int(os.environ.get("BILLING_IDEMPOTENCY_MAX_KEYS", "10000"))
+
+KEY_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+# Store each key's bill is saved in, to settle pending keys
+STORES = {"sale": bill_store.SALE_FILE, "purchase": bill_store.PURCHASE_FILE, "transport": bill_store.TRANSPORT_FILE}
+
+_lock = Lock()
+_index = OrderedDict()  # key -> {"key", "kind", "bill_no", "fingerprint", "at"}, oldest first
+_state = {"path": None, "lines": 0}
+
+
+def new_key():
+    """A fresh key for an entry form."""
+    return uuid.uuid4().hex
+
+
+def valid(key):
+    """True when `key` looks like a client-generated key (8-64 letters, digits, - or _)."""
+    return isinstance(key, str) and bool(KEY_PATTERN.match(key))
+
+
+def fingerprint(kind, fields):
+    """Hash of a submission's form fields, to tell a retry from a different bill reusing a key."""
+    body = json.dumps({"kind": kind, "fields": {k: fields[k] for k in sorted(fields) if k != "idempotency_key"}},
+                      sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def _expired(entry, now):
+    return now - entry.get("at", 0) > KEY_TTL_DAYS * 86400
+
+
+def _trim(now):
+    """Drop expired keys and the oldest beyond MAX_KEYS; returns how many went."""
+    dropped = 0
+    while _index and (len(_index) > MAX_KEYS or _expired(next(iter(_index.values())), now)):
+        _index.popitem(last=False)
+        dropped += 1
+    return dropped
+
+
+def _rewrite():
+    tmp = IDEMPOTENCY_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in _index.values()))
+    bill_store.durable_replace(tmp, IDEMPOTENCY_FILE)
+    _state["lines"] = len(_index)
+
+
+def _load():
+    if _state["path"] == IDEMPOTENCY_FILE:
+        return
+    _index.clear()
+    lines = 0
+    if os.path.exists(IDEMPOTENCY_FILE):
+        with open(IDEMPOTENCY_FILE, encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                    if not line.endswith("\n"):
+                        raise ValueError
+                except ValueError:
+                    continue
+                _index.pop(entry["key"], None)
+                if not entry.get("forget"):
+                    _index[entry["key"]] = entry
+    _trim(time.time())
+    _state["lines"] = lines
+    if lines != len(_index):
+        _rewrite()
+    _state["path"] = IDEMPOTENCY_FILE
+
+
+def _saved(entry):
+    """True when the bill of a pending key is in its store (deleted or not)."""
+    path = STORES.get(entry.get("kind"))
+    return bool(path) and not bill_store.select_bills(path, {"bill_no": entry["bill_no"]}, include_deleted=True,
+                                                      archived=False).empty
+
+
+def lookup(key):
+    """The entry remembered for `key`, or None when the key is new, expired, evicted or its bill
+    was never saved."""
+    with _lock:
+        _load()
+        entry = _index.get(key)
+        if entry is None or _expired(entry, time.time()):
+            return None
+        if entry.get("pending") and not _saved(entry):
+            return None
+        return entry
+
+
+def _append(entries, sync):
+    with open(IDEMPOTENCY_FILE, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    _state["lines"] += len(entries)
+
+
+def remember(entries):
+    """Log [{"key", "kind", "bill_no", "fingerprint"}] of bills about to be saved as pending (one
+    fsync for all). Call confirm() once they are saved, or forget() when saving them failed."""
+    if not entries:
+        return
+    now = time.time()
+    with _lock:
+        _load()
+        entries = [dict(entry, at=now, pending=True) for entry in entries]
+        _append(entries, sync=True)
+        for entry in entries:
+            _index.pop(entry["key"], None)
+            _index[entry["key"]] = entry
+        _trim(now)
+
+
+def confirm(keys):
+    """Mark the pending `keys` as belonging to saved bills. Not flushed: should the line be lost,
+    recover() confirms them from the store."""
+    with _lock:
+        _load()
+        entries = []
+        for key in keys:
+            entry = _index.get(key)
+            if entry and entry.get("pending"):
+                entry = {k: v for k, v in entry.items() if k != "pending"}
+                _index[key] = entry
+                entries.append(entry)
+        if entries:
+            _append(entries, sync=False)
+        if _state["lines"] > 2 * max(len(_index), 1000):
+            _rewrite()
+
+
+def forget(keys):
+    """Drop pending `keys` whose bills could not be saved, so the clerk can submit them again."""
+    with _lock:
+        _load()
+        keys = [key for key in keys if _index.get(key, {}).get("pending")]
+        for key in keys:
+            del _index[key]
+        if keys:
+            _append([{"key": key, "forget": True} for key in keys], sync=True)
+
+
+def recover():
+    """Settle the keys left pending by a crash; returns {"confirmed", "dropped"} counts. Run at
+    startup under excel_lock, before any bill is created: a dropped key's bill number is free
+    again and will be issued to another bill."""
+    with _lock:
+        _state["path"] = None
+        _load()
+        report = {"confirmed": 0, "dropped": 0}
+        for key, entry in list(_index.items()):
+            if not entry.get("pending"):
+                continue
+            if _saved(entry):
+                _index[key] = {k: v for k, v in entry.items() if k != "pending"}
+                report["confirmed"] += 1
+            else:
+                del _index[key]
+                report["dropped"] += 1
+        if report["confirmed"] or report["dropped"]:
+            _rewrite()
+        return report
+
+
+def stats():
+    """Size of the key index, for /healthz."""
+    with _lock:
+        _load()
+        return {"keys": len(_index), "max_keys": MAX_KEYS, "ttl_days": KEY_TTL_DAYS}
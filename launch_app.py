@@ -2,15 +2,61 @@ import subprocess
 import webbrowser
 import time
 import os
+import json
+from urllib.request import urlopen
+from urllib.error import HTTPError, URLError
+
+APP_URL = "http://127.0.0.1:5000"
+HEALTH_URL = APP_URL + "/healthz"
+APP_ID = "sri-anjaneya-traders"  # must match APP_ID in app.py
+STARTUP_TIMEOUT = 60  # seconds to wait for /healthz before opening the browser anyway
+
+
+def probe():
+    """Return the /healthz payload, or None when nothing is listening on the port."""
+    try:
+        with urlopen(HEALTH_URL, timeout=2) as resp:
+            return json.load(resp)
+    except HTTPError as e:
+        # 503 while the app is still warming up; the body still identifies it
+        try:
+            return json.load(e)
+        except ValueError:
+            return {}
+    except (URLError, OSError, ValueError):
+        return None
+
+
+def wait_until_ready(proc=None):
+    """Poll /healthz with exponential backoff until the app reports ready."""
+    delay = 0.1
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        status = probe()
+        if status and status.get("app") == APP_ID and status.get("status") == "ready":
+            return True
+        if proc is not None and proc.poll() is not None:
+            print(f"App exited during startup (code {proc.returncode}).")
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 2.0)
+    print(f"App not ready after {STARTUP_TIMEOUT}s, opening the browser anyway.")
+    return False
+
 
 # Go to project folder
 os.chdir(r"C:\Users\mohan\OneDrive\Desktop\sri_anjaneya_traders")
 
-# Start Flask app silently using pythonw
-subprocess.Popen([r"venv\Scripts\pythonw.exe", "app.py"])
-
-# Wait for Flask to start
-time.sleep(3)
+status = probe()
+if status is not None and status.get("app") == APP_ID:
+    # Reuse the running instance instead of starting a second server on the same workbooks
+    wait_until_ready()
+elif status is not None:
+    raise SystemExit(f"Port of {APP_URL} is used by another program; not starting the app.")
+else:
+    # Start Flask app silently using pythonw
+    proc = subprocess.Popen([r"venv\Scripts\pythonw.exe", "app.py"])
+    wait_until_ready(proc)
 
 # Open default browser to the local website
-webbrowser.open("http://127.0.0.1:5000")
+webbrowser.open(APP_URL)
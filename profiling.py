@@ -0,0 +1,151 @@
+"""Opt-in profiling of single requests with ?__profile=1.
+
+Enabled with BILLING_PROFILING=1 and limited to the users listed in BILLING_PROFILER_USERS.
+Uses pyinstrument when it is installed (speedscope JSON, open at https://www.speedscope.app)
+and falls back to cProfile (.pstats, open with snakeviz or flameprof).
+"""
+import cProfile
+import os
+import pstats
+import re
+import time
+from datetime import datetime
+from threading import Lock
+
+from flask import abort, g, render_template, request, send_from_directory, session
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # optional dependency
+    Profiler = None
+
+PROFILE_DIR = "profiles"
+MAX_PROFILES = 50
+
+# One profiled request at a time: since Python 3.12 a second cProfile cannot be enabled while one
+# is running. A request asking for a profile meanwhile is served without one.
+_lock = Lock()
+
+
+def _allowed(app):
+    return app.config["PROFILING_ENABLED"] and session.get("user") in app.config["PROFILER_USERS"]
+
+
+def _start():
+    if not _lock.acquire(blocking=False):
+        return
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    g.profiler = profiler
+    g.profile_start = time.perf_counter()
+
+
+def _stop(profiler):
+    if Profiler is not None:
+        profiler.stop()
+    else:
+        profiler.disable()
+
+
+def _save(profiler, elapsed, path):
+    """Write the finished profile of a request for `path` to PROFILE_DIR and return its file name."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    route = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+    stem = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{route}_{int(elapsed * 1000)}ms"
+    _stop(profiler)
+    if Profiler is not None:
+        name = stem + ".speedscope.json"
+        with open(os.path.join(PROFILE_DIR, name), "w") as f:
+            f.write(profiler.output(SpeedscopeRenderer()))
+    else:
+        name = stem + ".pstats"
+        pstats.Stats(profiler).dump_stats(os.path.join(PROFILE_DIR, name))
+
+    # Keep only the most recent captures
+    files = sorted(os.listdir(PROFILE_DIR))
+    for old in files[:-MAX_PROFILES]:
+        os.remove(os.path.join(PROFILE_DIR, old))
+    return name
+
+
+def _finish(profiler, started, path):
+    try:
+        return _save(profiler, time.perf_counter() - started, path)
+    finally:
+        _lock.release()
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        # <taken>_<route slug>_<duration>ms.<ext>
+        taken, _, rest = name.split(".")[0].partition("_")
+        route, _, duration = rest.rpartition("_")
+        try:
+            taken = datetime.strptime(taken, "%Y%m%d-%H%M%S-%f")
+        except ValueError:
+            continue  # not a capture: a leftover .tmp, an editor backup, .DS_Store
+        profiles.append({
+            "name": name,
+            "taken": taken.strftime("%d-%m-%Y %H:%M:%S"),
+            "route": route,
+            "duration": duration,
+            "size_kb": round(os.path.getsize(os.path.join(PROFILE_DIR, name)) / 1024, 1),
+        })
+    return profiles
+
+
+def init_app(app):
+    """Register the ?__profile=1 hooks and the /__profiles index on `app`."""
+    app.config.setdefault("PROFILING_ENABLED", os.environ.get("BILLING_PROFILING") == "1")
+    app.config.setdefault("PROFILER_USERS", set(
+        u.strip() for u in os.environ.get("BILLING_PROFILER_USERS", "admin").split(",") if u.strip()
+    ))
+
+    @app.before_request
+    def start_profile():
+        if request.args.get("__profile") == "1" and _allowed(app):
+            _start()
+
+    @app.after_request
+    def stop_profile(response):
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return response
+        started, path = g.profile_start, request.path
+        if response.is_streamed:
+            # A streamed download (CSV, xlsx) is generated after this hook; profile until it is sent
+            response.call_on_close(lambda: _finish(profiler, started, path))
+            response.headers["X-Profile"] = "/__profiles"
+        else:
+            name = _finish(profiler, started, path)
+            response.headers["X-Profile"] = f"/__profiles/{name}"
+        return response
+
+    @app.teardown_request
+    def drop_profile(exc):
+        # The request failed before after_request ran: stop profiling it and free the lock
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            _stop(profiler)
+            _lock.release()
+
+    @app.route("/__profiles")
+    def profiles_index():
+        if not _allowed(app):
+            abort(404)
+        return render_template("profiles.html", profiles=list_profiles(),
+                               engine="pyinstrument" if Profiler is not None else "cProfile")
+
+    @app.route("/__profiles/<path:name>")
+    def profile_download(name):
+        if not _allowed(app):
+            abort(404)
+        return send_from_directory(os.path.abspath(PROFILE_DIR), name, as_attachment=True)
@@ -0,0 +1,270 @@
+// Analytics dashboard: fetches every widget from /api/analytics/<widget> and draws it with Chart.js
+// Palette
+const C_SALES = "#4e73df";
+const C_PURCH = "#1cc88a";
+const C_ACCENT = "#f6c23e";
+const C_DANGER = "#e74a3b";
+
+// Widget names and the records page size come from the page (data-widgets, data-per-page on <body>)
+const WIDGETS = JSON.parse(document.body.dataset.widgets);
+const PER_PAGE = Number(document.body.dataset.perPage);
+const RECORD_COLUMNS = {
+    sale: ["date", "mill", "farmer", "lorry", "bags", "ntwt", "amount"],
+    purchase: ["date", "mill", "farmer", "village", "lorry", "bags", "ntwt", "amount"]
+};
+
+// Responses per widget and filter combination, so going back to earlier filters costs nothing
+const responses = new Map();
+function fetchJSON(url) {
+    if (!responses.has(url)) {
+        responses.set(url, fetch(url, { credentials: "same-origin" }).then((r) => {
+            if (!r.ok) throw new Error(r.status + " " + r.statusText);
+            return r.json();
+        }).catch((err) => { responses.delete(url); throw err; }));
+    }
+    return responses.get(url);
+}
+
+function filterQuery() {
+    const params = new URLSearchParams();
+    for (const [name, value] of new FormData(document.getElementById("filters"))) {
+        if (value) params.append(name, value);
+    }
+    return params.toString();
+}
+
+// Charts are created on the first response and updated in place afterwards
+const charts = {};
+function chart(id, config) {
+    if (charts[id]) {
+        charts[id].data = config.data;
+        charts[id].update();
+    } else {
+        charts[id] = new Chart(document.getElementById(id), config);
+    }
+}
+
+const round2 = (v) => String(Math.round(v * 100) / 100);
+
+// Time-series widgets get at most about one point per 5 pixels of their chart (?points=N)
+const SERIES_CANVAS = { daily: "dailyBar", weekly: "weeklyBar", monthly: "monthlyTrend", diff: "monthlyDiff" };
+const RESOLUTION_TITLES = { day: "Daily", week: "Weekly", month: "Monthly" };
+function widgetQuery(name, query) {
+    if (!(name in SERIES_CANVAS)) return query;
+    const width = document.getElementById(SERIES_CANVAS[name]).parentElement.clientWidth;
+    const params = new URLSearchParams(query);
+    params.set("points", Math.max(24, Math.min(366, Math.round(width / 5))));
+    return params.toString();
+}
+
+const RENDER = {
+    kpis(d) {
+        document.querySelectorAll("[data-kpi]").forEach((el) => {
+            const [group, key] = el.dataset.kpi.split(".");
+            el.textContent = key === "total_count" ? d[group][key] : round2(d[group][key]);
+        });
+        // Donut bags
+        chart("donutBags", {
+            type: 'doughnut',
+            data: {
+                labels: ["Bags (Sales)", "Bags (Purchase)"],
+                datasets: [{ data: [d.sales.total_bags, d.purchase.total_bags], backgroundColor: [C_ACCENT, C_DANGER] }]
+            }
+        });
+        // Pie amounts
+        chart("pieAmounts", {
+            type: 'pie',
+            data: {
+                labels: ["Sales", "Purchase"],
+                datasets: [{ data: [d.sales.total_sales, d.purchase.total_purchase], backgroundColor: [C_SALES, C_PURCH] }]
+            }
+        });
+    },
+    options(d) {
+        document.querySelectorAll("select[data-options]").forEach((select) => {
+            const selected = select.value || select.dataset.selected;
+            select.length = 1;
+            for (const value of d[select.dataset.options]) {
+                select.add(new Option(value, value, false, value === selected));
+            }
+        });
+    },
+    daily(d) {
+        document.getElementById("dailyTitle").textContent =
+            RESOLUTION_TITLES[d.resolution] + " Sales vs Purchases" + (d.downsampled ? " (grouped)" : "");
+        chart("dailyBar", {
+            type: 'bar',
+            data: {
+                labels: d.labels,
+                datasets: [
+                    { label: "Sales ₹", data: d.sales, backgroundColor: C_SALES },
+                    { label: "Purchase ₹", data: d.purchase, backgroundColor: C_PURCH }
+                ]
+            }
+        });
+    },
+    weekly(d) {
+        chart("weeklyBar", {
+            type: 'bar',
+            data: {
+                labels: d.labels,
+                datasets: [
+                    { label: "Sales ₹", data: d.sales, backgroundColor: C_SALES },
+                    { label: "Purchase ₹", data: d.purchase, backgroundColor: C_PURCH }
+                ]
+            }
+        });
+    },
+    monthly(d) {
+        chart("monthlyTrend", {
+            type: 'line',
+            data: {
+                labels: d.labels,
+                datasets: [
+                    { label: 'Sales ₹', data: d.sales, borderColor: C_SALES, backgroundColor: "rgba(78,115,223,0.1)", fill: true, tension: 0.3 },
+                    { label: 'Purchase ₹', data: d.purchase, borderColor: C_PURCH, backgroundColor: "rgba(28,200,138,0.1)", fill: true, tension: 0.3 }
+                ]
+            }
+        });
+    },
+    diff(d) {
+        chart("monthlyDiff", {
+            type: 'bar',
+            data: {
+                labels: d.labels,
+                datasets: [
+                    { label: 'profit ₹ (Sales - Purchase)', data: d.values, backgroundColor: C_ACCENT }
+                ]
+            }
+        });
+    },
+    // Top Farmers (Lollipop → bar + scatter overlay)
+    "top-farmers"(d) {
+        chart("topFarmers", {
+            data: {
+                labels: d.labels,
+                datasets: [
+                    { type: 'bar', label: 'Purchase ₹', data: d.values, backgroundColor: C_PURCH },
+                    { type: 'scatter', label: 'Points', data: d.values.map((v,i)=>({x:i,y:v})), backgroundColor: C_DANGER, pointRadius: 6 }
+                ]
+            },
+            options: { indexAxis: 'x' }
+        });
+    },
+    // Top Villages (Area)
+    "top-villages"(d) {
+        chart("topVillages", {
+            type: 'line',
+            data: {
+                labels: d.labels,
+                datasets: [
+                    { label: 'Bags', data: d.values, borderColor: C_ACCENT, backgroundColor: "rgba(246,194,62,0.3)", fill: true, tension: 0.4 }
+                ]
+            }
+        });
+    },
+    "top-mills"(d) {
+        chart("topMills", {
+            type: 'bar',
+            data: {
+                labels: d.labels,
+                datasets: [{ label: 'Sales ₹', data: d.values, backgroundColor: C_SALES }]
+            },
+            options: { indexAxis: 'y' }
+        });
+    },
+    // Top Trucks (Column)
+    "top-trucks"(d) {
+        chart("topTrucks", {
+            type: 'bar',
+            data: {
+                labels: d.labels,
+                datasets: [{ label: 'Bags', data: d.values, backgroundColor: C_DANGER }]
+            }
+        });
+    }
+};
+
+// Record tables: fetched a page at a time, and only once the table is scrolled into view
+const tables = Array.from(document.querySelectorAll("[data-records]")).map((card) => ({
+    card, kind: card.dataset.records, page: 1, pages: 1, visible: false, shown: null
+}));
+
+function loadRecords(table) {
+    const query = filterQuery();
+    const key = query + "#" + table.page;
+    if (!table.visible || table.shown === key) return;
+    table.shown = key;
+    const params = new URLSearchParams(query);
+    params.set("kind", table.kind);
+    params.set("page", table.page);
+    params.set("per_page", PER_PAGE);
+    fetchJSON("/api/analytics/records?" + params).then((d) => {
+        if (table.shown !== key) return;
+        table.pages = d.pages;
+        const body = table.card.querySelector("tbody");
+        body.replaceChildren(...d.rows.map((row) => {
+            const tr = document.createElement("tr");
+            for (const col of RECORD_COLUMNS[table.kind]) {
+                const td = document.createElement("td");
+                td.textContent = row[col];
+                tr.appendChild(td);
+            }
+            return tr;
+        }));
+        table.card.querySelector(".pager span").textContent = ` Page ${d.page} of ${d.pages} (${d.total} bills) `;
+        table.card.querySelector('[data-step="-1"]').disabled = d.page <= 1;
+        table.card.querySelector('[data-step="1"]').disabled = d.page >= d.pages;
+    }).catch((err) => { table.shown = null; showError(err); });
+}
+
+tables.forEach((table) => {
+    table.card.querySelectorAll("[data-step]").forEach((button) => button.addEventListener("click", () => {
+        table.page = Math.min(Math.max(table.page + Number(button.dataset.step), 1), table.pages);
+        loadRecords(table);
+    }));
+    if ("IntersectionObserver" in window) {
+        new IntersectionObserver((entries) => {
+            if (entries.some((e) => e.isIntersecting)) { table.visible = true; loadRecords(table); }
+        }, { rootMargin: "200px" }).observe(table.card);
+    } else {
+        table.visible = true;
+    }
+});
+
+const status = document.getElementById("status");
+function showError(err) {
+    status.textContent = "⚠️ Could not load some of the analytics: " + err.message;
+}
+
+// Every widget is requested at once; each is drawn as soon as its own response arrives
+function load() {
+    const query = filterQuery();
+    status.textContent = "";
+    for (const name of WIDGETS) {
+        fetchJSON(`/api/analytics/${name}?${widgetQuery(name, query)}`).then(RENDER[name]).catch(showError);
+    }
+    tables.forEach((table) => { table.page = 1; loadRecords(table); });
+}
+
+const form = document.getElementById("filters");
+form.addEventListener("submit", (e) => {
+    e.preventDefault();
+    history.pushState(null, "", "?" + filterQuery());
+    load();
+});
+document.getElementById("resetFilters").addEventListener("click", (e) => {
+    e.preventDefault();
+    form.querySelectorAll("input, select").forEach((field) => { field.value = ""; field.dataset.selected = ""; });
+    form.querySelectorAll("input[type=hidden]").forEach((field) => field.remove());
+    history.pushState(null, "", location.pathname);
+    load();
+});
+window.addEventListener("popstate", () => {
+    const params = new URLSearchParams(location.search);
+    form.querySelectorAll("input[name], select[name]").forEach((field) => {
+        field.value = field.dataset.selected = params.get(field.name) || "";
+    });
+    load();
+});
+load();
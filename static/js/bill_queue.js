@@ -0,0 +1,116 @@
+// Offline bill queue, shared by the entry forms (offline_forms.js) and the service worker.
+// Bills entered while the shop machine cannot be reached are kept in IndexedDB and sent to
+// /api/bills/bulk in batches once it can. Each bill carries an idempotency key, so a batch that
+// is sent twice (the connection dropped before the answer came back) never creates a bill twice.
+const BillQueue = (() => {
+    const DB_NAME = "billing-offline";
+    const STORE = "bills";
+    const BATCH = 20;
+    const KINDS = {"/sale-bill": "sale", "/purchase-bill": "purchase", "/transportation-bill": "transport"};
+    const DATE_FIELDS = {sale: "manual_date", purchase: "date", transport: "date"};
+
+    function newKey() {
+        const bytes = crypto.getRandomValues(new Uint8Array(16));
+        return Array.from(bytes, b => b.toString(16).padStart(2, "0")).join("");
+    }
+
+    function today() {
+        const d = new Date();
+        return `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, "0")}-${String(d.getDate()).padStart(2, "0")}`;
+    }
+
+    function open() {
+        return new Promise((resolve, reject) => {
+            const req = indexedDB.open(DB_NAME, 1);
+            req.onupgradeneeded = () => req.result.createObjectStore(STORE, {keyPath: "key"});
+            req.onsuccess = () => resolve(req.result);
+            req.onerror = () => reject(req.error);
+        });
+    }
+
+    // Run fn(objectStore) in one transaction; resolves with the result of the last request fn returns
+    function run(mode, fn) {
+        return open().then(db => new Promise((resolve, reject) => {
+            const tx = db.transaction(STORE, mode);
+            const req = fn(tx.objectStore(STORE));
+            tx.oncomplete = () => { db.close(); resolve(req ? req.result : undefined); };
+            tx.onerror = tx.onabort = () => { db.close(); reject(tx.error); };
+        }));
+    }
+
+    function kindFor(path) {
+        return KINDS[path];
+    }
+
+    function add(kind, fields) {
+        fields = Object.assign({}, fields);
+        // Keep the day the bill was entered, not the day it finally reaches the shop machine
+        if (fields.date_mode !== "manual" || !fields[DATE_FIELDS[kind]]) {
+            fields.date_mode = "manual";
+            fields[DATE_FIELDS[kind]] = today();
+        }
+        const entry = {key: fields.idempotency_key || newKey(), kind, fields, queued_at: Date.now(), status: "queued"};
+        return run("readwrite", store => store.put(entry)).then(() => entry);
+    }
+
+    function all() {
+        return run("readonly", store => store.getAll());
+    }
+
+    function remove(keys) {
+        return run("readwrite", store => {
+            let req;
+            keys.forEach(key => { req = store.delete(key); });
+            return req;
+        });
+    }
+
+    function save(entries) {
+        return run("readwrite", store => {
+            let req;
+            entries.forEach(entry => { req = store.put(entry); });
+            return req;
+        });
+    }
+
+    // Send every queued bill; resolves with {sent, failed} (entries with bill_no / error).
+    // Rejects when the server cannot be reached or refuses the request; the bills stay queued.
+    let flushing = null;
+    function flush() {
+        if (flushing) return flushing;
+        flushing = (async () => {
+            const sent = [], failed = [];
+            const pending = (await all()).filter(entry => entry.status === "queued");
+            for (let i = 0; i < pending.length; i += BATCH) {
+                const batch = pending.slice(i, i + BATCH);
+                const resp = await fetch("/api/bills/bulk", {
+                    method: "POST",
+                    credentials: "same-origin",
+                    headers: {"Content-Type": "application/json"},
+                    body: JSON.stringify({bills: batch.map(entry => ({kind: entry.kind, key: entry.key, fields: entry.fields}))}),
+                });
+                if (!resp.ok) {
+                    throw new Error(resp.status === 401 ? "please log in to send them" : `server answered ${resp.status}`);
+                }
+                const {results} = await resp.json();
+                const done = [], refused = [];
+                results.forEach((result, j) => {
+                    const entry = batch[j];
+                    if (result.status === "created" || result.status === "duplicate") {
+                        done.push(entry.key);
+                        sent.push(Object.assign(entry, {bill_no: result.bill_no}));
+                    } else {
+                        refused.push(Object.assign(entry, {status: "failed", error: result.error}));
+                    }
+                });
+                await remove(done);
+                await save(refused);
+                failed.push(...refused);
+            }
+            return {sent, failed};
+        })().finally(() => { flushing = null; });
+        return flushing;
+    }
+
+    return {newKey, kindFor, add, all, remove, flush};
+})();
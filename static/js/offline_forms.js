@@ -0,0 +1,101 @@
+// Entry forms: while the browser is offline, keep a submitted bill in the offline queue
+// (bill_queue.js) instead of posting it, and show what is still waiting to be sent.
+(() => {
+    const form = document.querySelector("form[data-bill-kind]");
+    if (!form) return;
+    const kind = form.dataset.billKind;
+
+    const banner = document.createElement("div");
+    banner.style.cssText = "display:none; margin-bottom:15px; padding:10px; border-radius:6px; background:#fff3cd; color:#664d03; font-weight:600;";
+    form.parentNode.insertBefore(banner, form);
+
+    async function show(message) {
+        const entries = await BillQueue.all();
+        const waiting = entries.filter(entry => entry.status === "queued").length;
+        banner.replaceChildren();
+        const line = (text) => {
+            const p = document.createElement("p");
+            p.style.margin = "4px 0";
+            p.textContent = text;
+            banner.appendChild(p);
+            return p;
+        };
+        if (message) line(message);
+        if (waiting) line(`📥 ${waiting} bill(s) saved on this device; they are sent as soon as the connection is back.`);
+        entries.filter(entry => entry.status === "failed").forEach(entry => {
+            const p = line(`❌ Not sent (${entry.kind} bill entered ${new Date(entry.queued_at).toLocaleString()}): ${entry.error} `);
+            const dismiss = document.createElement("button");
+            dismiss.type = "button";
+            dismiss.textContent = "Dismiss";
+            dismiss.onclick = () => BillQueue.remove([entry.key]).then(() => show());
+            p.appendChild(dismiss);
+        });
+        banner.style.display = banner.childElementCount ? "block" : "none";
+    }
+
+    async function flush() {
+        if (!navigator.onLine) return;
+        try {
+            const {sent, failed} = await BillQueue.flush();
+            if (sent.length || failed.length) {
+                show(sent.length ? `✅ Sent ${sent.length} offline bill(s): ${sent.map(entry => entry.bill_no).join(", ")}` : "");
+            }
+        } catch (err) {
+            show(`⚠️ Offline bills not sent yet: ${err.message}`);
+        }
+    }
+
+    // The form's idempotency key stays the same for repeated taps on submit, so the server (or
+    // the queue) keeps one bill; it changes once the clerk edits the form for the next bill.
+    // A fresh key on every load, because the offline copy of the page is served again and again.
+    const keyInput = form.elements.idempotency_key;
+    if (keyInput) keyInput.value = BillQueue.newKey();
+    let submittedKey = null;
+    form.addEventListener("input", () => {
+        if (keyInput && submittedKey === keyInput.value) keyInput.value = BillQueue.newKey();
+    });
+
+    // Called before the form posts: notes its key, and queues the bill instead while offline.
+    // Returns true when the post should go ahead.
+    function beforePost() {
+        const repeated = keyInput && submittedKey === keyInput.value;
+        submittedKey = keyInput ? keyInput.value : null;
+        if (navigator.onLine) return true;
+        queue(repeated);
+        return false;
+    }
+
+    async function queue(repeated) {
+        if (typeof closePreview === "function") closePreview();  // the sale and purchase preview dialog
+        if (repeated) {
+            show("ℹ️ This bill is already saved offline.");
+            return;
+        }
+        await BillQueue.add(kind, Object.fromEntries(new FormData(form)));
+        if ("serviceWorker" in navigator) {
+            navigator.serviceWorker.ready
+                .then(reg => reg.sync && reg.sync.register("bill-queue"))
+                .catch(() => {});
+        }
+        show("📥 No connection: the bill was saved on this device.");
+    }
+
+    form.addEventListener("submit", (e) => {
+        // Respect the page's own validation
+        if (!e.defaultPrevented && !beforePost()) e.preventDefault();
+    });
+    // The sale and purchase pages post from their preview dialog with form.submit(), which fires no submit event
+    form.submit = () => {
+        if (beforePost()) HTMLFormElement.prototype.submit.call(form);
+    };
+
+    window.addEventListener("online", flush);
+    if ("serviceWorker" in navigator) {
+        // The service worker queued a post that failed, or sent the queue in the background
+        navigator.serviceWorker.addEventListener("message", (e) => {
+            if (e.data && e.data.type === "bill-queue") show(e.data.message);
+        });
+    }
+    show(new URLSearchParams(location.search).has("queued")
+        ? "📥 No connection: the bill was saved on this device." : "").then(flush);
+})();
@@ -0,0 +1,32 @@
+// Shared PWA glue for every page: the install button (when the page has one) and the service worker
+let deferredPrompt;
+
+window.addEventListener("beforeinstallprompt", (e) => {
+    const installBtn = document.getElementById("installBtn");
+    if (!installBtn) return;
+    e.preventDefault();
+    deferredPrompt = e;
+    installBtn.style.display = "inline-block";
+});
+
+document.addEventListener("DOMContentLoaded", () => {
+    const installBtn = document.getElementById("installBtn");
+    if (!installBtn) return;
+    installBtn.addEventListener("click", () => {
+        if (!deferredPrompt) return;
+        installBtn.style.display = "none";
+        deferredPrompt.prompt();
+        deferredPrompt.userChoice.then(() => {
+            deferredPrompt = null;
+        });
+    });
+});
+
+// ✅ Register Service Worker
+if ("serviceWorker" in navigator) {
+    window.addEventListener("load", () => {
+        navigator.serviceWorker.register("/service-worker.js")
+            .then(reg => console.log("Service Worker registered:", reg.scope))
+            .catch(err => console.error("Service Worker registration failed:", err));
+    });
+}
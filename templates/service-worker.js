@@ -0,0 +1,99 @@
+// Rendered by assets.init_app: the cache name and asset list change whenever a bundle does
+importScripts('{{ queue_script }}');
+
+const CACHE_NAME = '{{ cache_name }}';
+const URLS_TO_CACHE = [
+  '/',
+  '/manifest.json',
+{%- for asset in assets %}
+  '{{ asset }}',
+{%- endfor %}
+];
+// Pages kept from the last visit so bills can still be entered without a connection
+const OFFLINE_PAGES = ['/menu', '/sale-bill', '/purchase-bill', '/transportation-bill'];
+
+self.addEventListener('install', event => {
+  event.waitUntil(
+    caches.open(CACHE_NAME)
+      .then(cache => cache.addAll(URLS_TO_CACHE))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys().then(keys =>
+      Promise.all(keys.map(k => {
+        if (k !== CACHE_NAME) return caches.delete(k);
+      }))
+    ).then(() => self.clients.claim())
+  );
+});
+
+function tellClients(message) {
+  return self.clients.matchAll().then(clients => clients.forEach(c => c.postMessage({type: 'bill-queue', message})));
+}
+
+function sendQueue() {
+  return BillQueue.flush().then(({sent}) => {
+    if (sent.length) {
+      return tellClients(`✅ Sent ${sent.length} offline bill(s): ${sent.map(e => e.bill_no).join(', ')}`);
+    }
+  });
+}
+
+// Background Sync: the browser calls this once the connection is back (and retries if it fails)
+self.addEventListener('sync', event => {
+  if (event.tag === 'bill-queue') event.waitUntil(sendQueue());
+});
+
+self.addEventListener('fetch', event => {
+  const url = new URL(event.request.url);
+  if (url.origin !== self.location.origin) return;
+
+  // A bill form posted while the shop machine is unreachable goes into the offline queue
+  const kind = BillQueue.kindFor(url.pathname);
+  if (event.request.method === 'POST' && kind && event.request.mode === 'navigate') {
+    const copy = event.request.clone();
+    event.respondWith(
+      fetch(event.request).catch(async () => {
+        await BillQueue.add(kind, Object.fromEntries(await copy.formData()));
+        if (self.registration.sync) self.registration.sync.register('bill-queue').catch(() => {});
+        return Response.redirect(new URL(url.pathname + '?queued=1', self.location.origin).href, 303);
+      })
+    );
+    return;
+  }
+  if (event.request.method !== 'GET') return;
+
+  // Fingerprinted bundles never change: serve from the cache, fetch (and keep) only new ones
+  if (url.pathname.startsWith('/assets/')) {
+    event.respondWith(
+      caches.match(event.request).then(resp => resp || fetch(event.request).then(fresh => {
+        if (fresh.ok) {
+          const copy = fresh.clone();
+          caches.open(CACHE_NAME).then(cache => cache.put(event.request, copy));
+        }
+        return fresh;
+      }))
+    );
+    return;
+  }
+
+  // Everything else (pages, bill data, analytics) comes from the network while online
+  event.respondWith(
+    fetch(event.request).then(resp => {
+      if (event.request.mode === 'navigate' && OFFLINE_PAGES.includes(url.pathname) && resp.ok && !resp.redirected) {
+        const copy = resp.clone();
+        caches.open(CACHE_NAME).then(cache => cache.put(url.pathname, copy));
+      }
+      return resp;
+    }).catch(() =>
+      caches.match(event.request, {ignoreSearch: event.request.mode === 'navigate'}).then(resp => {
+        if (resp) return resp;
+        if (event.request.mode === 'navigate') return caches.match('/');
+        return Response.error();
+      })
+    )
+  );
+});
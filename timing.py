@@ -0,0 +1,153 @@
+"""Request timing: named spans, Server-Timing headers, structured log lines and Prometheus histograms.
+
+Other modules can add their own lines to /metrics with add_collector().
+"""
+import json
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+from flask import Response, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("billing.timing")
+
+_metrics_lock = Lock()
+_request_hist = {}  # route -> [bucket counts, sum, count]
+_stage_hist = {}    # (route, stage) -> [bucket counts, sum, count]
+_collectors = []    # functions returning extra /metrics lines
+
+
+def _observe(hists, key, seconds):
+    with _metrics_lock:
+        h = hists.get(key)
+        if h is None:
+            h = hists[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        h[0][bisect_left(BUCKETS, seconds)] += 1
+        h[1] += seconds
+        h[2] += 1
+
+
+def _route():
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return "unmatched" if has_request_context() else "background"
+
+
+def record(stage, seconds):
+    """Record a finished stage against the current request (if any) and the stage histogram."""
+    if has_request_context():
+        spans = g.setdefault("timing_spans", {})
+        total, count = spans.get(stage, (0.0, 0))
+        spans[stage] = (total + seconds, count + 1)
+    _observe(_stage_hist, (_route(), stage), seconds)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as `stage` (storage_read, storage_write, bill_no, render, pdf, ...)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+
+def _render_started(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault("timing_render_stack", []).append(time.perf_counter())
+
+
+def _render_finished(sender, template, context, **extra):
+    if has_request_context() and g.get("timing_render_stack"):
+        record("render", time.perf_counter() - g.timing_render_stack.pop())
+
+
+def _before_request():
+    g.timing_start = time.perf_counter()
+
+
+def _after_request(response):
+    start = g.get("timing_start")
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    route = _route()
+    spans = g.get("timing_spans", {})
+    _observe(_request_hist, route, total)
+
+    parts = []
+    for stage, (seconds, count) in spans.items():
+        part = f"{stage};dur={seconds * 1000:.1f}"
+        if count > 1:
+            part += f';desc="x{count}"'
+        parts.append(part)
+    parts.append(f"total;dur={total * 1000:.1f}")
+    response.headers["Server-Timing"] = ", ".join(parts)
+
+    logger.info(json.dumps({
+        "method": request.method,
+        "path": request.path,
+        "route": route,
+        "status": response.status_code,
+        "ms": round(total * 1000, 1),
+        "stages": {stage: round(seconds * 1000, 1) for stage, (seconds, _) in spans.items()},
+    }))
+    return response
+
+
+def _histogram_lines(name, hists, label_names):
+    lines = [f"# TYPE {name} histogram"]
+    with _metrics_lock:
+        items = sorted((k, ([*h[0]], h[1], h[2])) for k, h in hists.items())
+    for key, (counts, total, count) in items:
+        values = key if isinstance(key, tuple) else (key,)
+        labels = ",".join(f'{n}="{v}"' for n, v in zip(label_names, values))
+        cumulative = 0
+        for bound, c in zip(BUCKETS, counts):
+            cumulative += c
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {count}")
+    return lines
+
+
+def metrics_text():
+    """All latency histograms in the Prometheus text exposition format."""
+    lines = ["# HELP billing_request_duration_seconds Request latency per route."]
+    lines += _histogram_lines("billing_request_duration_seconds", _request_hist, ("route",))
+    lines.append("# HELP billing_stage_duration_seconds Time spent per named stage within a route.")
+    lines += _histogram_lines("billing_stage_duration_seconds", _stage_hist, ("route", "stage"))
+    for collect in _collectors:
+        lines += collect()
+    return "\n".join(lines) + "\n"
+
+
+def add_collector(collect):
+    """Have /metrics also include the lines returned by `collect()` (counters and gauges of other modules)."""
+    _collectors.append(collect)
+
+
+def init_app(app):
+    """Install the timing hooks and the /metrics endpoint on `app`."""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(metrics_text(), mimetype="text/plain; version=0.0.4")
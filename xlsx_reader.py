@@ -0,0 +1,53 @@
+"""Pluggable .xlsx reader for the bill stores and archives.
+
+openpyxl builds a Python object for every cell and is by far the slowest part of opening a
+store. When python-calamine (a Rust xlsx parser) is installed it is used instead; otherwise
+the reader falls back to openpyxl. Both go through pandas.read_excel, so the columns, dtypes
+and date cells come out the same (see benchmarks/reader_parity.py).
+
+BILLING_XLSX_READER picks the backend: "auto" (default), "calamine" or "openpyxl".
+"""
+import os
+
+import pandas as pd
+
+try:
+    import python_calamine  # noqa: F401
+except ImportError:  # optional dependency
+    python_calamine = None
+
+READERS = ["calamine", "openpyxl"]
+DEFAULT_READER = os.environ.get("BILLING_XLSX_READER", "auto")
+
+
+def available():
+    """Backends that can be used here, fastest first."""
+    return [name for name in READERS if name != "calamine" or python_calamine is not None]
+
+
+def engine(name=None):
+    """The pandas engine for the backend `name` (default BILLING_XLSX_READER)."""
+    name = name or DEFAULT_READER
+    if name == "auto":
+        return available()[0]
+    if name not in READERS:
+        raise ValueError(f"Unknown xlsx reader {name!r}; choose one of auto, {', '.join(READERS)}")
+    if name not in available():
+        raise ValueError(f"xlsx reader {name!r} is not installed (pip install python-calamine)")
+    return name
+
+
+def read_xlsx(path, reader=None, **kwargs):
+    """pandas.read_excel through the chosen backend.
+
+    A workbook calamine cannot parse is retried with openpyxl, so an unusual file from another
+    program still opens; the openpyxl error is raised if that fails too.
+    """
+    name = engine(reader)
+    try:
+        return pd.read_excel(path, engine=name, **kwargs)
+    except Exception as e:
+        if name == "openpyxl":
+            raise
+        print(f"⚠️ {name} could not read {path} ({e}); retrying with openpyxl")
+        return pd.read_excel(path, engine="openpyxl", **kwargs)
@@ -0,0 +1,232 @@
+"""Write-only, streaming .xlsx writer.
+
+Rows are turned into worksheet XML and deflated into the zip as they arrive, and the compressed
+bytes are yielded as soon as they are available. Memory stays bounded by one chunk regardless of
+the number of rows, and a download starts before the last row has been read.
+
+Columns can be typed so Excel gets real numbers and dates instead of text:
+"int", "number", "money", "date" (a date object or a dd-mm-YYYY string) and "text".
+Untyped columns are written as numbers or text depending on each value.
+"""
+import math
+import re
+import zipfile
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 64 * 1024
+
+# Style index (cellXfs position in STYLES_XML) for each column type
+STYLE_IDS = {"text": 0, "int": 1, "number": 2, "money": 3, "date": 4, "header": 5}
+
+EXCEL_EPOCH = date(1899, 12, 30)
+
+_ILLEGAL_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_BAD_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+CONTENT_TYPES_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+{sheets}
+</Types>"""
+
+ROOT_RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+WORKBOOK_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>{sheets}</sheets>
+</workbook>"""
+
+WORKBOOK_RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+{sheets}
+<Relationship Id="rIdStyles" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+STYLES_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="dd\\-mm\\-yyyy"/></numFmts>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="6">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="1" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="2" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+
+class _Sink:
+    """Unseekable file object that collects what zipfile writes until the generator drains it."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def column_letter(idx):
+    """0 -> A, 25 -> Z, 26 -> AA."""
+    letters = ""
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _text_cell(ref, value, style=0):
+    text = escape(_ILLEGAL_XML.sub("", str(value)))
+    return f'<c r="{ref}" t="inlineStr" s="{style}"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value).strip(), "%d-%m-%Y").date()
+    except ValueError:
+        return None
+
+
+def _cell(ref, value, kind):
+    """One <c> element for `value` in a column of type `kind` (None when untyped)."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if kind == "date" or (kind is None and isinstance(value, date)):
+        day = _to_date(value)
+        if day is None:
+            return _text_cell(ref, value)
+        return f'<c r="{ref}" s="{STYLE_IDS["date"]}"><v>{(day - EXCEL_EPOCH).days}</v></c>'
+    if kind == "text" or (kind is None and isinstance(value, str)):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)  # phone numbers and legacy numeric bill numbers read back as floats
+        return _text_cell(ref, value)
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return _text_cell(ref, value)
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return f'<c r="{ref}" s="{STYLE_IDS.get(kind, 0)}"><v>{value!r}</v></c>'
+    return _text_cell(ref, value)
+
+
+def _sheet_parts(rows, column_types):
+    """Yield the worksheet XML for `rows` (header first) in encoded pieces."""
+    rows = iter(rows)
+    header = next(rows, None) or ()
+    kinds = [column_types.get(name) for name in header]
+    letters = [column_letter(i) for i in range(len(header))]
+    widths = "".join(
+        f'<col min="{i + 1}" max="{i + 1}" width="{max(12, min(40, len(str(name)) + 4))}" customWidth="1"/>'
+        for i, name in enumerate(header)
+    )
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+           '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+           '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+           '</sheetView></sheetViews>'
+           + (f"<cols>{widths}</cols>" if widths else "") + "<sheetData>").encode()
+    if header:
+        cells = "".join(_text_cell(f"{letters[i]}1", name, STYLE_IDS["header"]) for i, name in enumerate(header))
+        yield f'<row r="1">{cells}</row>'.encode()
+
+    n = 1
+    batch = []
+    for row in rows:
+        n += 1
+        cells = "".join(_cell(f"{letters[i]}{n}", value, kinds[i]) for i, value in enumerate(row))
+        batch.append(f'<row r="{n}">{cells}</row>')
+        if len(batch) == 200:
+            yield "".join(batch).encode()
+            batch = []
+    if batch:
+        yield "".join(batch).encode()
+
+    tail = "</sheetData>"
+    if header:
+        tail += f'<autoFilter ref="A1:{letters[-1]}{n}"/>'
+    yield (tail + "</worksheet>").encode()
+
+
+def _sheet_name(name, used):
+    name = _BAD_SHEET_CHARS.sub(" ", str(name)).strip()[:31] or "Sheet"
+    candidate, i = name, 2
+    while candidate.lower() in used:
+        candidate = f"{name[:28]} {i}"
+        i += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def stream_xlsx(sheets, column_types=None):
+    """Yield the bytes of an .xlsx workbook.
+
+    `sheets` is a list of (sheet name, rows) where `rows` yields the header tuple first and then one
+    tuple per row. `column_types` maps column names to "int", "number", "money", "date" or "text".
+    """
+    column_types = column_types or {}
+    sink = _Sink()
+    zf = zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED)
+    names, used = [], set()
+    for i, (name, rows) in enumerate(sheets, 1):
+        names.append(_sheet_name(name, used))
+        with zf.open(f"xl/worksheets/sheet{i}.xml", "w") as part:
+            for piece in _sheet_parts(rows, column_types):
+                part.write(piece)
+                if sink.size >= CHUNK_SIZE:
+                    yield sink.drain()
+
+    sheet_overrides = "\n".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(names) + 1)
+    )
+    zf.writestr("[Content_Types].xml", CONTENT_TYPES_XML.format(sheets=sheet_overrides))
+    zf.writestr("_rels/.rels", ROOT_RELS_XML)
+    zf.writestr("xl/workbook.xml", WORKBOOK_XML.format(sheets="".join(
+        f'<sheet name="{escape(name, {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, name in enumerate(names, 1)
+    )))
+    zf.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS_XML.format(sheets="\n".join(
+        f'<Relationship Id="rId{i}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(names) + 1)
+    )))
+    zf.writestr("xl/styles.xml", STYLES_XML)
+    zf.close()
+    yield sink.drain()